@@ -0,0 +1,424 @@
+'''!@file autotune.py
+    Tunes the PID gains of the motors from their step responses.
+
+    Each motor is identified from open loop steps: at each of
+    @c TUNE_DUTIES, in both directions, its position is logged for
+    @c TUNE_RUN_MS. A motor with friction turning a pulley has the model
+    @code
+    tau * dv/dt = gain * (duty - bias) - v
+    @endcode
+    where the bias opposes the motion and differs in each direction, since
+    the bungee helps one way. The speed and time constant of each step come
+    from the straight line the position approaches, and the gain and biases
+    from the speeds as in @c calibration.fit_feedforward().
+
+    The gains are then found by running @c controller.PIDController.run_both()
+    on steps of @c TUNE_STEP ticks of the model, over a grid of gains. The gains which settle within
+    @c SETTLE_BAND soonest without overshooting more than @c MAX_OVERSHOOT
+    are saved for each motor and direction to @c GAINS_FILE, in the format
+    of @c controller.load_schedule(), which @c main.py loads.
+
+    Running this file on the Nucleo tunes both motors; it takes a few
+    minutes. On a computer, it tunes against a @c PlantModel instead of the
+    motors, so the whole routine can be tried without hardware, or tunes a
+    model from the Nucleo's output:
+    @code
+    python autotune.py
+    python autotune.py GAIN TAU BIAS_POS BIAS_NEG
+    @endcode
+    Start with the pen near the middle of the drawing area; each step is
+    run forward and then back so the pen returns.
+
+    @author     Tori Bornino
+    @author     Jackson McLaughlin
+    @author     Zach Stednitz
+    @date       March 15, 2022
+'''
+
+import calibration
+import controller
+import task_parser
+
+## @brief   Duty cycles (%) to step each motor with while identifying it.
+TUNE_DUTIES = (30, 50)
+
+## @brief   Time to log each step for (ms).
+TUNE_RUN_MS = 400
+
+## @brief   Time between position samples of a step (ms).
+#  @details Short enough to read the encoders before they overflow.
+TUNE_SAMPLE_MS = 5
+
+## @brief   Time for a motor to stop between steps (ms).
+TUNE_REST_MS = 300
+
+## @brief   Size of the step the gains are tuned for (ticks).
+#  @details About the distance between interpolated set points.
+TUNE_STEP = 1024
+
+## @brief   Error a step has to stay within to be settled (ticks).
+SETTLE_BAND = 20
+
+## @brief   Largest overshoot allowed, as a fraction of the step.
+MAX_OVERSHOOT = 0.05
+
+## @brief   Time each step is simulated for (ms).
+#  @details Gains which haven't settled by then are not used.
+SIM_DURATION_MS = 1000
+
+## @brief   Time from reading the encoders to setting the motors (ms).
+#  @details The encoder tasks run before the controller task, so the
+#           positions are a little old when the duty cycles are set.
+SIM_DELAY_MS = 2
+
+## @brief   Proportional gains tried (duty cycle/tick).
+KP_GRID = tuple(0.02 * 1.35**i for i in range(16))
+
+## @brief   Derivative gains tried, as multiples of Kp (s).
+KD_RATIOS = (0, 0.005, 0.01, 0.02, 0.04)
+
+## @brief   Integral gains tried, as multiples of Kp (1/s).
+KI_RATIOS = (0, 2, 5, 10)
+
+## @brief   The model simulated when tuning on a computer.
+#  @details (gain, tau, bias_pos, bias_neg), roughly as measured on the
+#           plotter.
+SIM_PLANT = (250.0, 0.03, 8.0, 14.0)
+
+## @brief   File the tuned gains are saved to.
+GAINS_FILE = controller.SCHEDULE_FILE
+
+class PlantModel:
+    '''!
+    This class simulates a motor and its encoder, and the clock the routine
+    waits on, so @c identify() can run on a computer.
+
+    It has the methods of a @c motor.MotorDriver, an
+    @c encoder.EncoderDriver, a @c task_share.Share of the position and the
+    @c time module used here. Time only passes in @c sleep_ms().
+    '''
+
+    def __init__(self, gain, tau, bias_pos, bias_neg, reverse=False):
+        '''!
+        Creates a motor at rest at position zero.
+
+        @param gain     The speed per duty cycle above the bias
+                        ((ticks/s)/%).
+        @param tau      The time constant of the motor (s).
+        @param bias_pos The duty cycle needed to move forward (%).
+        @param bias_neg The duty cycle needed to move back (%).
+        @param reverse  @c True if the motor turns backwards for the
+                        controller, as motor 1 does.
+        '''
+        self._gain = gain
+        self._tau = tau
+        self._bias_pos = bias_pos
+        self._bias_neg = bias_neg
+        self._reverse = reverse
+        self._duty = 0
+        self._velocity = 0.0
+        self._position = 0.0
+        self._time = 0
+
+    def set_duty_cycle(self, level):
+        '''!
+        Sets the duty cycle of the motor.
+
+        @param level The duty cycle (%).
+        '''
+        self._duty = -level if self._reverse else level
+
+    def read(self):
+        '''!
+        Reads the position of the motor.
+
+        @return The position (ticks).
+        '''
+        return int(self._position)
+
+    def get(self):
+        '''!
+        Reads the position of the motor, as the controller reads it from
+        the encoder task.
+
+        @return The position (ticks).
+        '''
+        return int(self._position)
+
+    def sleep_ms(self, duration):
+        '''!
+        Lets the motor run.
+
+        @param duration The time to run for (ms).
+        '''
+        dt = 0.001
+        for i in range(int(duration)):
+            self._time += 1000
+            u = self._duty
+            v = self._velocity
+            if v > 0 or (v == 0 and u > self._bias_pos):
+                drive = u - self._bias_pos
+            elif v < 0 or (v == 0 and u < -self._bias_neg):
+                drive = u + self._bias_neg
+            else:
+                # Held by friction
+                continue
+            new_v = v + (self._gain * drive - v) * dt / self._tau
+            # Friction stops the motor rather than turning it around
+            if (v > 0 and new_v < 0) or (v < 0 and new_v > 0):
+                new_v = 0.0
+            self._velocity = new_v
+            self._position += new_v * dt
+
+    def ticks_us(self):
+        '''!
+        Reads the simulated clock.
+
+        @return The time (us).
+        '''
+        return self._time
+
+    def ticks_diff(self, end, start):
+        '''!
+        Finds the time between two readings of the clock.
+
+        @param end      The later reading (us).
+        @param start    The earlier reading (us).
+        @return The time between them (us).
+        '''
+        return end - start
+
+
+def identify(motor, encoder, clock, reverse=False, duties=TUNE_DUTIES):
+    '''!
+    Steps a motor open loop and fits the model to its responses.
+
+    @param motor    The @c motor.MotorDriver to run.
+    @param encoder  The @c encoder.EncoderDriver of the motor.
+    @param clock    The @c time module, or a @c PlantModel.
+    @param reverse  @c True if the motor turns backwards for the controller,
+                    as motor 1 does.
+    @param duties   The duty cycles to step with (%).
+    @return A tuple (gain, tau, bias_pos, bias_neg) of the model.
+    '''
+    log_duties = []
+    log_velocities = []
+    taus = []
+    for duty in duties:
+        for sign in (1, -1):
+            times, positions = step_response(motor, encoder, clock,
+                                              sign*duty, reverse)
+            velocity, tau = fit_step(times, positions)
+            log_duties.append(sign*duty)
+            log_velocities.append(velocity)
+            taus.append(tau)
+    kv, bias_pos, bias_neg = calibration.fit_feedforward(log_duties,
+                                                         log_velocities)
+    return (1 / kv, sum(taus) / len(taus), bias_pos, bias_neg)
+
+def step_response(motor, encoder, clock, duty, reverse=False,
+                  duration=TUNE_RUN_MS):
+    '''!
+    Logs the position of a motor after a step in duty cycle from rest.
+
+    @param motor    The @c motor.MotorDriver to run.
+    @param encoder  The @c encoder.EncoderDriver of the motor.
+    @param clock    The @c time module, or a @c PlantModel.
+    @param duty     The duty cycle in the controller's direction (%).
+    @param reverse  @c True if the motor turns backwards for the controller.
+    @param duration The time to log for (ms).
+    @return A tuple (times, positions) of lists of the time since the step
+            (s) and the distance moved (ticks).
+    '''
+    times = []
+    positions = []
+    start_position = encoder.read()
+    start_time = clock.ticks_us()
+    motor.set_duty_cycle(-duty if reverse else duty)
+    elapsed = 0
+    while elapsed < duration * 1000:
+        clock.sleep_ms(TUNE_SAMPLE_MS)
+        position = encoder.read()
+        elapsed = clock.ticks_diff(clock.ticks_us(), start_time)
+        times.append(elapsed / 1000000)
+        positions.append(position - start_position)
+    motor.set_duty_cycle(0)
+    for i in range(TUNE_REST_MS // TUNE_SAMPLE_MS):
+        clock.sleep_ms(TUNE_SAMPLE_MS)
+        encoder.read()
+    return (times, positions)
+
+def fit_step(times, positions):
+    '''!
+    Finds the steady speed and time constant of a step response.
+
+    Once the motor is up to speed its position follows the straight line
+    v*(t - tau), so a line fitted to the second half of the response gives
+    both.
+
+    @param times        The times since the step (s).
+    @param positions    The distances moved (ticks).
+    @return A tuple (velocity, tau) in (ticks/s) and (s).
+    '''
+    n = len(times) // 2
+    t = times[n:]
+    p = positions[n:]
+    t_mean = sum(t) / len(t)
+    p_mean = sum(p) / len(p)
+    stt = sum((ti - t_mean)**2 for ti in t)
+    velocity = sum((ti - t_mean) * (pi - p_mean)
+                   for ti, pi in zip(t, p)) / stt
+    if velocity == 0:
+        raise ValueError('motor did not move')
+    intercept = p_mean - velocity * t_mean
+    return (velocity, max(-intercept / velocity, 0.001))
+
+def simulate(plant, gains, step=TUNE_STEP, period=controller.PERIOD,
+             delay=SIM_DELAY_MS, duration=SIM_DURATION_MS):
+    '''!
+    Simulates a step of the set point of the controller on a model.
+
+    The model is motor 2 of a @c controller.PIDController, without
+    feedforward or cross-coupling, and @c run_both() sets its duty cycle
+    every period. Motor 1 stands still at its set point.
+
+    @param plant    The model (gain, tau, bias_pos, bias_neg).
+    @param gains    The gains (Kp, Ki, Kd), in the units of
+                    @c controller.PIDController.set_gains().
+    @param step     The change in set point (ticks).
+    @param period   The period of the controller (ms).
+    @param delay    The time from reading the encoder to setting the motor
+                    (ms).
+    @param duration The time to simulate (ms).
+    @return A tuple (settle, overshoot) of the time to settle (s), or
+            @c None if it doesn't, and the overshoot as a fraction of the
+            step.
+    '''
+    model = PlantModel(*plant)
+    still = PlantModel(*plant)
+    pid = controller.PIDController(*gains, (0, 0), still, model,
+                                   period=period)
+    pid.set_set_point((0, step))
+    dt = period / 1000
+    settle = 0
+    peak = 0
+    for k in range(duration // period):
+        error = model.read() - step
+        if abs(error) > SETTLE_BAND:
+            settle = None
+        elif settle == None:
+            settle = k * dt
+        # Overshoot is past the set point, away from where the step began
+        if step > 0:
+            peak = max(peak, error)
+        else:
+            peak = max(peak, -error)
+
+        pid.run_both()
+        model.sleep_ms(delay)
+        model.set_duty_cycle(pid.duty[1])
+        model.sleep_ms(period - delay)
+    return (settle, peak / abs(step))
+
+def tune(plant, step=TUNE_STEP, period=controller.PERIOD):
+    '''!
+    Searches for the gains which settle a step soonest on a model.
+
+    @param plant    The model (gain, tau, bias_pos, bias_neg).
+    @param step     The change in set point (ticks). Its sign is the
+                    direction tuned for.
+    @param period   The period of the controller (ms).
+    @return A tuple (gains, settle, overshoot) of the best gains
+            (Kp, Ki, Kd) and their time to settle (s) and overshoot, or
+            @c None if no gains settle.
+    '''
+    best = None
+    for kp in KP_GRID:
+        for kd_ratio in KD_RATIOS:
+            for ki_ratio in KI_RATIOS:
+                gains = (kp, kp * ki_ratio, kp * kd_ratio)
+                settle, overshoot = simulate(plant, gains, step, period)
+                if settle == None or overshoot > MAX_OVERSHOOT:
+                    continue
+                if best == None or settle < best[1]:
+                    best = (gains, settle, overshoot)
+    return best
+
+def save_gains(motor_gains, gains_file=GAINS_FILE):
+    '''!
+    Saves tuned gains as a gain schedule with the same gains all over the
+    drawing area.
+
+    @param motor_gains  For each motor, a tuple of the gains (Kp, Ki, Kd)
+                        while its set point increases and while it
+                        decreases.
+    @param gains_file   The name of the file to write.
+    '''
+    corners = [task_parser.transform(x, y)
+               for x in (0, task_parser.WIDTH)
+               for y in (0, task_parser.HEIGHT)]
+    th1 = [corner[0] for corner in corners]
+    th2 = [corner[1] for corner in corners]
+    with open(gains_file, 'w') as out:
+        out.write('# Tuned by autotune.py\n')
+        out.write('grid,{:d},{:d},{:d},{:d},2,2\n'.format(
+            min(th1), max(th1), min(th2), max(th2)))
+        for motor_id, directions in enumerate(motor_gains):
+            for direction, (kp, ki, kd) in zip('+-', directions):
+                for i2 in range(2):
+                    for i1 in range(2):
+                        out.write('{:d},{:s},{:d},{:d},{:g},{:g},{:g}\n'
+                                  .format(motor_id + 1, direction, i1, i2,
+                                          kp, ki, kd))
+
+if __name__ == '__main__':
+    import sys
+
+    if sys.platform == 'pyboard':
+        import pyb
+        import time
+        import encoder
+        import motor
+
+        # The same pins and timers as main.py
+        _encoders = (encoder.EncoderDriver(pyb.Pin.cpu.B6, pyb.Pin.cpu.B7, 4),
+                     encoder.EncoderDriver(pyb.Pin.cpu.C6, pyb.Pin.cpu.C7, 8))
+        _motors = (motor.MotorDriver(pyb.Pin.board.PC1, pyb.Pin.board.PA0,
+                                     pyb.Pin.board.PA1,
+                                     pyb.Timer(5, freq=20000)),
+                   motor.MotorDriver(pyb.Pin.board.PA10, pyb.Pin.board.PB4,
+                                     pyb.Pin.board.PB5,
+                                     pyb.Timer(3, freq=20000)))
+        _plants = []
+        for _i in range(2):
+            print('identifying motor {:d}...'.format(_i + 1))
+            _plants.append(identify(_motors[_i], _encoders[_i], time,
+                                    reverse=(_i == 0)))
+    elif len(sys.argv) == 5:
+        # On a computer, tune a model identified on the Nucleo
+        _plants = [tuple(float(_value) for _value in sys.argv[1:])] * 2
+    else:
+        # On a computer, identify and tune the simulated motors
+        _plants = []
+        for _i in range(2):
+            _model = PlantModel(*SIM_PLANT, reverse=(_i == 0))
+            _plants.append(identify(_model, _model, _model,
+                                    reverse=(_i == 0)))
+
+    _motor_gains = []
+    for _i, _plant in enumerate(_plants):
+        print('motor {:d}: gain {:.1f} (ticks/s)/%, tau {:.3f} s, '
+              'bias {:.1f} % forward, {:.1f} % back'.format(_i + 1, *_plant))
+        _directions = []
+        for _step in (TUNE_STEP, -TUNE_STEP):
+            _best = tune(_plant, _step)
+            if _best == None:
+                raise ValueError('no gains settle motor {:d}'.format(_i + 1))
+            _gains, _settle, _overshoot = _best
+            print('  {:s}: Kp {:.4f}, Ki {:.4f}, Kd {:.5f}, settles in '
+                  '{:.0f} ms, overshoot {:.0f} %'.format(
+                      '+' if _step > 0 else '-', *_gains,
+                      _settle * 1000, _overshoot * 100))
+            _directions.append(_gains)
+        _motor_gains.append(_directions)
+    save_gains(_motor_gains)
@@ -0,0 +1,233 @@
+'''!@file calibration.py
+    Estimates the feedforward coefficients of the motors from logged encoder
+    data.
+
+    Feedforward models the duty cycle a motor needs to turn at a steady
+    speed v as Kv*v plus a bias which depends on the direction, since the
+    bungee helps one way and friction resists both. On the Nucleo,
+    @c calibrate() runs one motor open loop at each of @c CAL_DUTIES in both
+    directions and logs its steady speed from the encoder.
+    @c fit_feedforward() then finds Kv and the biases by least squares. The
+    coefficients are saved to @c FEEDFORWARD_FILE, which @c main.py loads.
+
+    Running this file on the Nucleo calibrates both motors, saving the logs
+    and the coefficients. Logs can be fitted again on a computer:
+    @code
+    python calibration.py motor1.csv motor2.csv
+    @endcode
+    Start with the pen near the middle of the drawing area; each duty cycle
+    is run forward and then back so the pen returns.
+
+    @author     Tori Bornino
+    @author     Jackson McLaughlin
+    @author     Zach Stednitz
+    @date       March 15, 2022
+'''
+
+import time
+
+## @brief   Duty cycles (%) to run each motor at while calibrating.
+CAL_DUTIES = (20, 30, 40, 50, 60)
+
+## @brief   Time to let a motor reach a steady speed before measuring (ms).
+CAL_SETTLE_MS = 150
+
+## @brief   Time to measure a motor's speed over (ms).
+CAL_RUN_MS = 300
+
+## @brief   Slowest speed used to fit the coefficients (ticks/s).
+#  @details Slower runs are stalled or sticking, which the model doesn't
+#           describe.
+CAL_MIN_SPEED = 200
+
+## @brief   File the feedforward coefficients are saved to.
+#  @details One line per motor of Kv, bias_pos and bias_neg.
+FEEDFORWARD_FILE = 'feedforward.txt'
+
+def calibrate(motor, encoder, reverse=False, duties=CAL_DUTIES):
+    '''!
+    Runs a motor open loop and measures its steady speed at each duty cycle.
+
+    The duty cycles and speeds are in the controller's direction, where a
+    positive duty cycle increases the encoder position.
+
+    @param motor    The @c motor.MotorDriver to run.
+    @param encoder  The @c encoder.EncoderDriver of the motor.
+    @param reverse  @c True if the motor turns backwards for the controller,
+                    as motor 1 does.
+    @param duties   The duty cycles to run at (%).
+    @return A tuple (duties, velocities) of lists of the duty cycles run (%)
+            and the speeds measured (ticks/s).
+    '''
+    log_duties = []
+    log_velocities = []
+    for duty in duties:
+        for sign in (1, -1):
+            motor.set_duty_cycle(-sign*duty if reverse else sign*duty)
+            _wait(encoder, CAL_SETTLE_MS)
+            start_position = encoder.read()
+            start_time = time.ticks_us()
+            _wait(encoder, CAL_RUN_MS)
+            distance = encoder.read() - start_position
+            elapsed = time.ticks_diff(time.ticks_us(), start_time)
+            motor.set_duty_cycle(0)
+            _wait(encoder, CAL_SETTLE_MS)
+            log_duties.append(sign*duty)
+            log_velocities.append(1000000 * distance / elapsed)
+    return (log_duties, log_velocities)
+
+def _wait(encoder, duration):
+    '''!
+    Waits while reading an encoder often enough not to miss an overflow.
+
+    @param encoder  The @c encoder.EncoderDriver to read.
+    @param duration The time to wait (ms).
+    '''
+    start = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), start) < duration:
+        encoder.read()
+        time.sleep_ms(5)
+
+def fit_feedforward(duties, velocities, min_speed=CAL_MIN_SPEED):
+    '''!
+    Finds the feedforward coefficients which best fit logged duty cycles and
+    speeds.
+
+    Fits duty = Kv*v + bias_pos for v > 0 and duty = Kv*v - bias_neg for
+    v < 0 by least squares, with the same Kv both ways.
+
+    @param duties       The duty cycles run (%).
+    @param velocities   The speeds measured (ticks/s).
+    @param min_speed    The slowest speed to use (ticks/s).
+    @return A tuple (Kv, bias_pos, bias_neg).
+    '''
+    # Normal equations of the least squares fit
+    a = [[0.0] * 3 for i in range(3)]
+    b = [0.0] * 3
+    for duty, velocity in zip(duties, velocities):
+        if abs(velocity) < min_speed:
+            continue
+        row = (velocity, 1.0 if velocity > 0 else 0.0,
+               -1.0 if velocity < 0 else 0.0)
+        for i in range(3):
+            b[i] += row[i] * duty
+            for j in range(3):
+                a[i][j] += row[i] * row[j]
+    return tuple(_solve(a, b))
+
+def _solve(a, b):
+    '''!
+    Solves a small system of linear equations by Gaussian elimination.
+
+    @param a The matrix of coefficients, as a list of rows. It is changed.
+    @param b The right hand side. It is changed.
+    @return The list of unknowns.
+    '''
+    n = len(b)
+    for i in range(n):
+        pivot = max(range(i, n), key=lambda k: abs(a[k][i]))
+        if a[pivot][i] == 0:
+            raise ValueError("not enough runs in each direction to fit")
+        a[i], a[pivot] = a[pivot], a[i]
+        b[i], b[pivot] = b[pivot], b[i]
+        for k in range(i + 1, n):
+            factor = a[k][i] / a[i][i]
+            for j in range(i, n):
+                a[k][j] -= factor * a[i][j]
+            b[k] -= factor * b[i]
+    x = [0.0] * n
+    for i in range(n - 1, -1, -1):
+        x[i] = (b[i] - sum(a[i][j] * x[j] for j in range(i + 1, n))) \
+            / a[i][i]
+    return x
+
+def write_log(log_file, duties, velocities):
+    '''!
+    Saves logged duty cycles and speeds.
+
+    @param log_file     The name of the file to write.
+    @param duties       The duty cycles run (%).
+    @param velocities   The speeds measured (ticks/s).
+    '''
+    with open(log_file, 'w') as log:
+        log.write('duty,velocity\n')
+        for duty, velocity in zip(duties, velocities):
+            log.write('{:d},{:.1f}\n'.format(duty, velocity))
+
+def read_log(log_file):
+    '''!
+    Reads duty cycles and speeds saved by @c write_log().
+
+    @param log_file The name of the file to read.
+    @return A tuple (duties, velocities) of lists.
+    '''
+    duties = []
+    velocities = []
+    with open(log_file) as log:
+        log.readline()
+        for line in log:
+            if line.strip():
+                duty, velocity = line.split(',')
+                duties.append(int(duty))
+                velocities.append(float(velocity))
+    return (duties, velocities)
+
+def save_feedforward(coefficients, feedforward_file=FEEDFORWARD_FILE):
+    '''!
+    Saves the feedforward coefficients of both motors.
+
+    @param coefficients     A list of tuples (Kv, bias_pos, bias_neg), one
+                            for each motor.
+    @param feedforward_file The name of the file to write.
+    '''
+    with open(feedforward_file, 'w') as ff:
+        for kv, bias_pos, bias_neg in coefficients:
+            ff.write('{:g},{:g},{:g}\n'.format(kv, bias_pos, bias_neg))
+
+def load_feedforward(feedforward_file=FEEDFORWARD_FILE):
+    '''!
+    Loads the feedforward coefficients saved by @c save_feedforward().
+
+    @param feedforward_file The name of the file to read.
+    @return A list of tuples (Kv, bias_pos, bias_neg), one for each motor.
+    '''
+    coefficients = []
+    with open(feedforward_file) as ff:
+        for line in ff:
+            if line.strip():
+                coefficients.append(tuple(float(value)
+                                          for value in line.split(',')))
+    return coefficients
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1:
+        # On a computer, fit logs saved on the Nucleo
+        _coefficients = [fit_feedforward(*read_log(_log_file))
+                         for _log_file in sys.argv[1:]]
+    else:
+        import pyb
+        import encoder
+        import motor
+
+        # The same pins and timers as main.py
+        _encoders = (encoder.EncoderDriver(pyb.Pin.cpu.B6, pyb.Pin.cpu.B7, 4),
+                     encoder.EncoderDriver(pyb.Pin.cpu.C6, pyb.Pin.cpu.C7, 8))
+        _motors = (motor.MotorDriver(pyb.Pin.board.PC1, pyb.Pin.board.PA0,
+                                     pyb.Pin.board.PA1,
+                                     pyb.Timer(5, freq=20000)),
+                   motor.MotorDriver(pyb.Pin.board.PA10, pyb.Pin.board.PB4,
+                                     pyb.Pin.board.PB5,
+                                     pyb.Timer(3, freq=20000)))
+        _coefficients = []
+        for _i in range(2):
+            print('calibrating motor {:d}...'.format(_i + 1))
+            _log = calibrate(_motors[_i], _encoders[_i], reverse=(_i == 0))
+            write_log('motor{:d}.csv'.format(_i + 1), *_log)
+            _coefficients.append(fit_feedforward(*_log))
+
+    for _i, (_kv, _bias_pos, _bias_neg) in enumerate(_coefficients):
+        print('motor {:d}: Kv {:.5f} %/(ticks/s), bias {:.1f} % forward, '
+              '{:.1f} % back'.format(_i + 1, _kv, _bias_pos, _bias_neg))
+    save_feedforward(_coefficients)
@@ -1,5 +1,11 @@
 '''!@file controller.py
-    A class that performs closed loop PID control.
+    A class that performs closed loop PID control, with gains which may be
+    scheduled over the drawing area and cross-coupling of the motors to keep
+    the pen on its path.
+    
+    Running this file profiles a step of both motors by @c run() twice
+    against @c run_both() with @c cotask, and prints the task table with
+    their average and longest run times.
     
     @author     Tori Bornino
     @author     Jackson McLaughlin
@@ -7,8 +13,21 @@
     @date       March 15, 2022
 '''
 
+import array
 import time
 
+try:
+    import micropython
+except ImportError:
+    # On a computer, as when autotune.py simulates the controller, the code
+    # emitters aren't there and the functions run as they are
+    class micropython:
+        @staticmethod
+        def native(function):
+            return function
+
+import task_parser
+
 # Motor IDs
 _MOTOR1 = 0
 _MOTOR2 = 1
@@ -16,14 +35,85 @@ _MOTOR2 = 1
 ## @brief Maximum allowable power to set on the motors (percent duty cycle).
 MAX_POWER = 100
 
+## @brief   Time between runs of the controller (ms).
+#  @details @c run_both() takes this as the time step of the integral,
+#           derivative and feedforward terms rather than measuring it.
+PERIOD = 10
+
+## @brief   Bits of fraction of the fixed point gains used by @c run_both().
+GAIN_FRAC = 16
+
+## @brief   Largest error (ticks) and speed (ticks per run) of both motors
+#           at which a set point of each tolerance class is reached.
+#  @details Indexed by @c task_parser.TOL_TRAVEL, @c task_parser.TOL_DRAW
+#           and @c task_parser.TOL_CORNER. Travel set points only need the
+#           pen nearby, while corners of strokes need it there and stopped.
+#           The corner error is widened to what the gains can settle at, as
+#           found by @c PIDController.settle_error().
+FINISH_TOLERANCES = ((1000, 1000), (200, 50), (25, 5))
+
+## @brief   Bits of fraction of the contour error and correction
+#           directions used by @c run_both().
+CONTOUR_FRAC = 12
+
+## @brief   Largest error of either motor used for the contour error
+#           (ticks).
+#  @details Keeps the products of the contour error small ints. Larger
+#           errors are far off the path anyway.
+CONTOUR_CLIP = 4096
+
+## @brief   Distance either motor's set point moves before the direction
+#           of the path is found again (ticks).
+#  @details The direction is the chord over this distance, which is
+#           within about a degree of the path.
+CONTOUR_UPDATE = 256
+
+## @brief   File the gain schedule is saved to.
+#  @details A line @c grid,th1_min,th1_max,th2_min,th2_max,nodes1,nodes2
+#           sets the grid of motor angles (ticks), then each line
+#           @c motor,direction,i1,i2,Kp,Ki,Kd sets the gains of motor 1 or 2
+#           at node (i1, i2) while its set point increases (+) or decreases
+#           (-). Lines starting with @c # are comments.
+SCHEDULE_FILE = 'gains.txt'
+
+## @brief   Fraction of a grid cell the set point moves before the gains
+#           are looked up again.
+#  @details The gains are interpolated between nodes, so they change little
+#           over a few ticks and looking them up every run is wasted work.
+SCHEDULE_DIVISIONS = 4
+
 class PIDController:
     '''! 
     This class implements a PID controller to run a pen plotter.
     It contains methods for calculating the actuation value 
     and setting the Kp, Ki, and Kd gains. 
+    
+    The set point can be a step with @c set_set_point(), or moved a little
+    every run with @c set_reference(), as when following a motion planner.
+    
+    @c run_both() runs both motors at once with integer math on fixed point
+    gains, which doesn't allocate memory, and stores the duty cycles in
+    @c duty. The time step is fixed at the task period.
+    
+    Gains can be scheduled with @c set_schedule() from a @c GainSchedule,
+    which gives each motor its own gains depending on where the set point
+    is and which way it moves, since the bungee tension and the belt angles
+    change across the drawing area.
+    
+    With cross-coupling set by @c set_contour_gain(), the errors of both
+    motors are turned into the contour error, how far the pen is off the
+    path on the page, through the Jacobian of the kinematics. Both motors
+    are driven to move the pen back onto the path, so a lagging belt
+    doesn't pull the pen off the line while the other catches up.
+    
+    While the set point moves, feedforward set with @c set_feedforward() adds
+    the duty cycle the motor needs to keep up with it: a term proportional to
+    the set point's speed, plus a bias for the direction it moves in, which
+    differs for each motor since the bungee pulls one way.
     ''' 
     
-    def __init__ (self, Kp, Ki, Kd, set_point, sensor_share1, sensor_share2):
+    def __init__ (self, Kp, Ki, Kd, set_point, sensor_share1, sensor_share2,
+                  period=PERIOD):
         '''! 
         Creates a PID controller by initializing controller gains and storing
         the queue of setpoints and (2) shares with sensor data. 
@@ -41,11 +131,12 @@ class PIDController:
         @param sensor_share2    A share that contains the read position from
                                 sensor 2 in a (2) sensor system with
                                 independently controlled actuators.
+        @param period           The time between runs of @c run_both() (ms).
         '''
         self._set_point = set_point
-        self._Kp = Kp
-        self._Ki = Ki
-        self._Kd = Kd
+        self._Kp = [Kp, Kp]
+        self._Ki = [Ki, Ki]
+        self._Kd = [Kd, Kd]
         self._sensor_share = [sensor_share1, sensor_share2]
 
         # Step response start time for each motor
@@ -56,6 +147,48 @@ class PIDController:
         self._last_time = [0, 0]
         self._last_error = [0, 0]
         self._Iduty = [0, 0]
+        
+        # Feedforward coefficients and the set point's speed (ticks/s)
+        self._Kv = [0, 0]
+        self._bias_pos = [0, 0]
+        self._bias_neg = [0, 0]
+        self._ref_velocity = [0, 0]
+        self._last_set_point = [set_point[0], set_point[1]]
+        self._ref_time = [None, None]
+        
+        # Fixed point state of run_both() for both motors
+        self._period = period / 1000
+        self._gains = array.array('i', [0] * 6)
+        self._bounds = array.array('i', [0] * 6)
+        self._ff_gains = array.array('i', [0] * 6)
+        self._ff_bounds = array.array('i', [0] * 2)
+        self._last_err = array.array('i', [0, 0])
+        self._integral = array.array('i', [0, 0])
+        self._last_sp = array.array('i', [set_point[0], set_point[1]])
+        self._restart = True
+        
+        # Measured position of each motor and its change over the last run
+        self._position = array.array('i', [0, 0])
+        self._speed = array.array('i', [0, 0])
+        
+        # Cross-coupling: the gain, the contour error of each motor's error
+        # and the motor angles which move the pen across the path, in fixed
+        # point, and the set point they were found at
+        self._contour_gain = 0
+        self._contour_bound = 0
+        self._contour = array.array('i', [0] * 4)
+        self._contour_at = array.array('i', [set_point[0], set_point[1]])
+        self._set_fixed_gains(_MOTOR1)
+        self._set_fixed_gains(_MOTOR2)
+        
+        # Gain schedule, with the set point and directions of the set
+        # point's motion the gains were last looked up at
+        self._schedule = None
+        self._sched_at = array.array('i', [0, 0])
+        self._direction = bytearray(2)
+        
+        ## @brief The duty cycles (%) of motors 1 and 2 from @c run_both().
+        self.duty = array.array('i', [0, 0])
 
     def run(self, motorID):
         '''! 
@@ -71,21 +204,27 @@ class PIDController:
                 of the duty cycle. If the actuation value is False,
                 then the state changes to servo.
         '''
-        # Store initial motor step time
+        # Store initial motor step time. Times are measured from it.
         if self._step_start_time[motorID] == None:
             self._step_start_time[motorID] = time.ticks_ms()
-            self._last_time[motorID] = self._step_start_time[motorID]
+            self._last_time[motorID] = 0
         
         # Calculate the current error in position
-        self._error[motorID] = self._sensor_share[motorID].get() - self._set_point[motorID]
+        position = self._sensor_share[motorID].get()
+        self._speed[motorID] = position - self._position[motorID]
+        self._position[motorID] = position
+        self._error[motorID] = position - self._set_point[motorID]
         curr_time = time.ticks_diff(time.ticks_ms(),self._step_start_time[motorID])
+        # Runs within the same millisecond have no time step to integrate
+        # or differentiate over
+        dt = curr_time - self._last_time[motorID]
         
         # Calculate the PID actuation value
         # Proportional component of actuation value
-        Pduty = -self._Kp*self._error[motorID]
+        Pduty = -self._Kp[motorID]*self._error[motorID]
         
         # Integral component of actuation value
-        _Iduty_new = self._Ki*self._error[motorID]*(curr_time - self._last_time[motorID])
+        _Iduty_new = self._Ki[motorID]*self._error[motorID]*dt
         if (self._Iduty[motorID] > 0 and _Iduty_new < 0) \
             or  (self._Iduty[motorID] < 0 and _Iduty_new > 0):
             self._Iduty[motorID] = _Iduty_new
@@ -93,10 +232,30 @@ class PIDController:
             self._Iduty[motorID] += _Iduty_new
         
         # Differential component of actuation value
-        Dduty = self._Kd*(self._error[motorID]-self._last_error[motorID])/(curr_time - self._last_time[motorID])
+        Dduty = 0
+        if dt > 0:
+            Dduty = self._Kd[motorID]*(self._error[motorID]-self._last_error[motorID])/dt
+        
+        # Feedforward component of actuation value, from the set point's
+        # speed since the last run
+        now = time.ticks_us()
+        if self._ref_time[motorID] != None:
+            dt = time.ticks_diff(now, self._ref_time[motorID])
+            if dt > 0:
+                self._ref_velocity[motorID] = 1000000 * (
+                    self._set_point[motorID]
+                    - self._last_set_point[motorID]) / dt
+        self._ref_time[motorID] = now
+        self._last_set_point[motorID] = self._set_point[motorID]
+        velocity = self._ref_velocity[motorID]
+        FFduty = self._Kv[motorID]*velocity
+        if velocity > 0:
+            FFduty += self._bias_pos[motorID]
+        elif velocity < 0:
+            FFduty -= self._bias_neg[motorID]
         
         # Total PID actuation value
-        actuation_value = Pduty + self._Iduty[motorID] + Dduty
+        actuation_value = Pduty + self._Iduty[motorID] + Dduty + FFduty
 
         # Filter saturated values
         if actuation_value > MAX_POWER:
@@ -114,7 +273,88 @@ class PIDController:
         elif motorID == _MOTOR2:
             return actuation_value
 
-    def set_gains(self, Kp, Ki, Kd):
+    @micropython.native
+    def run_both(self):
+        '''!
+        Runs the control algorithm for both motors in one pass and stores
+        the duty cycles in @c duty.
+        
+        Each term is an integer in duty cycle shifted left @c GAIN_FRAC
+        bits. The error, its change and the set point's change are each
+        clipped where their term alone would saturate the motor, so no
+        product grows past a small int. The integral and derivative use the
+        controller period as the time step, and the derivative is skipped
+        on the first run after a new set point. With cross-coupling, the
+        correction for the contour error is added to both motors.
+        '''
+        ff_gains = self._ff_gains
+        contour = self._contour
+        limit = MAX_POWER << GAIN_FRAC
+        restart = self._restart
+        self._restart = False
+        for motorID in range(2):
+            position = self._sensor_share[motorID].get()
+            self._speed[motorID] = position - self._position[motorID]
+            self._position[motorID] = position
+            self._error[motorID] = position - self._set_point[motorID]
+        
+        # Correction for the contour error, in duty cycle before it is
+        # shared out between the motors
+        correction = 0
+        if self._contour_gain != 0:
+            deviation = (contour[0] * _clip(self._error[_MOTOR1],
+                                            CONTOUR_CLIP)
+                         + contour[1] * _clip(self._error[_MOTOR2],
+                                              CONTOUR_CLIP)) >> CONTOUR_FRAC
+            correction = (-self._contour_gain
+                          * _clip(deviation, self._contour_bound)) >> 8
+        
+        for motorID in range(2):
+            error = self._error[motorID]
+            if restart:
+                self._last_err[motorID] = error
+            gains = 3 * motorID
+            
+            # Proportional component
+            total = -self._gains[gains] * _clip(error, self._bounds[gains])
+            
+            # Integral component, restarted when the error changes sign
+            change = -self._gains[gains + 1] * _clip(error,
+                                                     self._bounds[gains + 1])
+            integral = self._integral[motorID]
+            if (integral > 0 and change < 0) or (integral < 0 and change > 0):
+                integral = change
+            else:
+                integral = _clip(integral + change, limit)
+            self._integral[motorID] = integral
+            total += integral
+            
+            # Derivative component
+            total -= self._gains[gains + 2] * _clip(
+                error - self._last_err[motorID], self._bounds[gains + 2])
+            self._last_err[motorID] = error
+            
+            # Feedforward component
+            step = self._set_point[motorID] - self._last_sp[motorID]
+            self._last_sp[motorID] = self._set_point[motorID]
+            total += ff_gains[motorID] * _clip(step,
+                                               self._ff_bounds[motorID])
+            if step > 0:
+                total += ff_gains[2 + motorID]
+            elif step < 0:
+                total -= ff_gains[4 + motorID]
+            
+            # Cross-coupling component
+            total += (correction * contour[2 + motorID]) \
+                >> (CONTOUR_FRAC - 8)
+            
+            duty = (_clip(total, limit) + (1 << (GAIN_FRAC - 1))) \
+                >> GAIN_FRAC
+            
+            # Compensate for swapped directions on each motor due to belt
+            self.duty[motorID] = -duty if motorID == _MOTOR1 else duty
+
+    def set_gains(self, Kp, Ki, Kd, motorID=None):
         '''! 
         Sets the proportional gain controller value.
         
@@ -124,10 +364,175 @@ class PIDController:
                             Units of (dutyCycle/(ticks*seconds))
         @param Kd           The derivative gain for the controller.
                             Units of (dutyCycle/(ticks/seconds))
+        @param motorID      The motor the gains are for, or @c None for
+                            both motors.
+        '''
+        for motor in (_MOTOR1, _MOTOR2) if motorID == None else (motorID,):
+            self._Kp[motor] = Kp
+            self._Ki[motor] = Ki
+            self._Kd[motor] = Kd
+            self._set_fixed_gains(motor)
+        
+    def _set_fixed_gains(self, motorID):
+        '''!
+        Converts the gains of one motor to the fixed point gains used by
+        @c run_both(), per run of the controller, with the bounds on the
+        values they multiply.
+        
+        @param motorID  The motor to convert the gains of.
+        '''
+        i = 3 * motorID
+        self._gains[i] = round(self._Kp[motorID] * (1 << GAIN_FRAC))
+        self._gains[i + 1] = round(self._Ki[motorID] * self._period
+                                   * (1 << GAIN_FRAC))
+        self._gains[i + 2] = round(self._Kd[motorID] / self._period
+                                   * (1 << GAIN_FRAC))
+        for k in range(i, i + 3):
+            self._bounds[k] = _bound(self._gains[k])
+        
+    def set_schedule(self, schedule):
+        '''!
+        Schedules the gains of both motors over the drawing area.
+        
+        From now on, whenever the set point moves more than a
+        @c SCHEDULE_DIVISIONS part of a grid cell or a motor's set point
+        turns around, the motors' gains are looked up in the schedule.
+        
+        @param schedule A @c GainSchedule, or @c None to keep the gains
+                        last set.
+        '''
+        self._schedule = schedule
+        if schedule != None:
+            self._lookup_gains(self._set_point)
+        
+    def _reschedule(self, set_point):
+        '''!
+        Looks up the gains for a new set point if it has moved far enough
+        from where they were last looked up, or turned around.
+        
+        @param set_point The new set point (theta_1, theta_2) in ticks.
+        '''
+        schedule = self._schedule
+        if schedule == None:
+            return
+        moved = False
+        for motorID in range(2):
+            step = set_point[motorID] - self._set_point[motorID]
+            if step != 0 and (step < 0) != self._direction[motorID]:
+                self._direction[motorID] = step < 0
+                moved = True
+            elif abs(set_point[motorID] - self._sched_at[motorID]) \
+                > schedule.spacing[motorID] // SCHEDULE_DIVISIONS:
+                moved = True
+        if moved:
+            self._lookup_gains(set_point)
+        
+    def _lookup_gains(self, set_point):
+        '''!
+        Sets the gains of both motors from the gain schedule.
+        
+        @param set_point The set point (theta_1, theta_2) in ticks.
+        '''
+        self._sched_at[_MOTOR1] = set_point[_MOTOR1]
+        self._sched_at[_MOTOR2] = set_point[_MOTOR2]
+        for motorID in range(2):
+            self.set_gains(*self._schedule.gains(
+                motorID, self._direction[motorID], set_point[_MOTOR1],
+                set_point[_MOTOR2]), motorID=motorID)
+        
+    def set_contour_gain(self, Kc):
+        '''!
+        Sets the gain of the cross-coupled correction of the contour error.
+        
+        @param Kc   The duty cycle per tick of distance the pen is off its
+                    path on the page, or @c 0 to control the motors
+                    independently. Units of (dutyCycle/ticks)
+        '''
+        self._contour_gain = round(Kc * (1 << GAIN_FRAC))
+        self._contour_bound = _bound(self._contour_gain)
+        
+    def _find_contour(self, set_point):
+        '''!
+        Finds how the motors' errors make up the contour error, and how the
+        motors move the pen across the path, for a new set point.
+        
+        The path's direction is the chord from where they were last found,
+        once either motor's set point has moved @c CONTOUR_UPDATE. While
+        the set point stands still there is no path and no contour error.
+        
+        @param set_point The new set point (theta_1, theta_2) in ticks.
+        '''
+        if self._contour_gain == 0:
+            return
+        contour = self._contour
+        at = self._contour_at
+        d1 = set_point[_MOTOR1] - at[_MOTOR1]
+        d2 = set_point[_MOTOR2] - at[_MOTOR2]
+        if set_point[_MOTOR1] == self._set_point[_MOTOR1] \
+            and set_point[_MOTOR2] == self._set_point[_MOTOR2]:
+            for i in range(4):
+                contour[i] = 0
+            at[_MOTOR1] = set_point[_MOTOR1]
+            at[_MOTOR2] = set_point[_MOTOR2]
+            return
+        if abs(d1) < CONTOUR_UPDATE and abs(d2) < CONTOUR_UPDATE:
+            return
+        at[_MOTOR1] = set_point[_MOTOR1]
+        at[_MOTOR2] = set_point[_MOTOR2]
+        
+        # Jacobian of the belt lengths by the pen's position, with motor 2
+        # at the origin and motor 1 at (R, 0)
+        r_1 = set_point[_MOTOR1] / task_parser.TICKS_PER_MM
+        r_2 = set_point[_MOTOR2] / task_parser.TICKS_PER_MM
+        x, y = task_parser.inverse_transform(r_1, r_2)
+        x += task_parser.X_HOME
+        y += task_parser.Y_HOME
+        j11 = (x - task_parser.R) / r_1
+        j12 = y / r_1
+        j21 = x / r_2
+        j22 = y / r_2
+        det = j11*j22 - j12*j21
+        if abs(det) < 1e-3:
+            return
+        
+        # Direction of the path on the page, and the normal to it
+        tx = (j22*d1 - j12*d2) / det
+        ty = (j11*d2 - j21*d1) / det
+        length = (tx*tx + ty*ty)**0.5
+        nx = -ty / length
+        ny = tx / length
+        
+        # The contour error is the normal part of the page error J^-1 e,
+        # and the belts move the pen along the normal by J n
+        scale = 1 << CONTOUR_FRAC
+        contour[0] = round((nx*j22 - ny*j21) / det * scale)
+        contour[1] = round((ny*j11 - nx*j12) / det * scale)
+        contour[2] = round((j11*nx + j12*ny) * scale)
+        contour[3] = round((j21*nx + j22*ny) * scale)
+        
+    def set_feedforward(self, motorID, Kv, bias_pos, bias_neg):
+        '''!
+        Sets the feedforward coefficients of one motor, as estimated by
+        @c calibration.fit_feedforward().
+        
+        @param motorID      The motor the coefficients are for.
+        @param Kv           The duty cycle per set point speed.
+                            Units of (dutyCycle/(ticks/seconds))
+        @param bias_pos     The duty cycle added while the set point
+                            increases. Units of (dutyCycle)
+        @param bias_neg     The duty cycle subtracted while the set point
+                            decreases. Units of (dutyCycle)
         '''
-        self._Kp = Kp
-        self._Ki = Ki
-        self._Kd = Kd
+        self._Kv[motorID] = Kv
+        self._bias_pos[motorID] = bias_pos
+        self._bias_neg[motorID] = bias_neg
+        
+        # Fixed point gains for run_both(), per tick of set point change
+        # each run
+        self._ff_gains[motorID] = round(Kv / self._period * (1 << GAIN_FRAC))
+        self._ff_gains[2 + motorID] = round(bias_pos * (1 << GAIN_FRAC))
+        self._ff_gains[4 + motorID] = round(bias_neg * (1 << GAIN_FRAC))
+        self._ff_bounds[motorID] = _bound(self._ff_gains[motorID])
         
     def set_set_point(self, set_point):
         '''! 
@@ -136,8 +541,19 @@ class PIDController:
         @param set_point  The desired steady state response value. It is in the
                           form of a tuple (theta_1, theta_2, pen) in ticks.
         '''
+        self._reschedule(set_point)
+        self._find_contour(set_point)
         self._set_point = set_point
         
+        # A step has no speed to feed forward
+        self._last_set_point = [set_point[0], set_point[1]]
+        self._ref_velocity = [0, 0]
+        self._last_sp[_MOTOR1] = set_point[_MOTOR1]
+        self._last_sp[_MOTOR2] = set_point[_MOTOR2]
+        self._integral[_MOTOR1] = 0
+        self._integral[_MOTOR2] = 0
+        self._restart = True
+        
         # Step response start time for each motor
         self._step_start_time = [None, None]
         
@@ -147,16 +563,319 @@ class PIDController:
         self._last_error = [0, 0]
         self._Iduty = [0, 0]
         
-    def check_finish_step(self):
+    def set_reference(self, set_point):
+        '''!
+        Moves the set point without starting a new step response.
+        
+        Used when the set point moves a little every run, as when following
+        a motion planner, so the integral and derivative terms carry on.
+        This is how the controller follows a trajectory: @c main.py moves
+        the reference along each segment every period with
+        @c planner.Planner.advance(), at the planned speed for the time
+        since the last run, rather than stepping to each set point.
+        
+        @param set_point  The desired position (theta_1, theta_2) in ticks.
+        '''
+        self._reschedule(set_point)
+        self._find_contour(set_point)
+        self._set_point = set_point
+        
+    def check_finish_step(self, tolerance=task_parser.TOL_TRAVEL):
         '''!
         Check if current set point has been reached by both motors.
         
+        @param tolerance    The tolerance class of the set point, which
+                            selects the error and speed allowed from
+                            @c FINISH_TOLERANCES.
         @return a boolean is returned for if the setpoint has been reached.
         '''
         done = False
+        max_error, max_speed = FINISH_TOLERANCES[tolerance]
+        max_error1 = max_error
+        max_error2 = max_error
+        if tolerance == task_parser.TOL_CORNER:
+            max_error1 = max(max_error, self.settle_error(_MOTOR1))
+            max_error2 = max(max_error, self.settle_error(_MOTOR2))
 #         print(self._error[_MOTOR1], self._error[_MOTOR2])
-        if abs(self._error[_MOTOR1]) < 1000 and abs(self._error[_MOTOR2]) < 1000:
+        if abs(self._error[_MOTOR1]) < max_error1 \
+            and abs(self._error[_MOTOR2]) < max_error2 \
+            and abs(self._speed[_MOTOR1]) < max_speed \
+            and abs(self._speed[_MOTOR2]) < max_speed:
             self._step_start_time = [None, None]
             self._error = [0, 0]
             done = True
         return done
+        
+    def settle_error(self, motorID):
+        '''!
+        Finds how far from a still set point a motor may settle.
+        
+        Friction holds the motor once the proportional term is less than
+        the duty cycle it takes to turn it, which is the feedforward bias,
+        so without an integral term the motor can stop up to the bias over
+        Kp from the set point. With an integral term, or before
+        @c set_feedforward() has given the bias, this is 0.
+        
+        @param motorID  The motor to find the error of.
+        @return The error (ticks).
+        '''
+        Kp = self._Kp[motorID]
+        if self._Ki[motorID] != 0 or Kp <= 0:
+            return 0
+        return int(max(self._bias_pos[motorID],
+                       self._bias_neg[motorID]) / Kp) + 1
+
+
+
+class GainSchedule:
+    '''!
+    This class holds a table of controller gains for each motor over a grid
+    of motor angles, for each direction the motor's set point moves in.
+    
+    The grid spans the motor angles of the drawing area with evenly spaced
+    nodes, and the gains between nodes are interpolated bilinearly from the
+    four nodes around them. Set points off the grid take the gains of the
+    nearest edge. Gains of nodes which haven't been set are the default
+    gains the schedule was made with.
+    '''
+    
+    def __init__(self, th1_range, th2_range, nodes, gains):
+        '''!
+        Creates a schedule with the same gains everywhere.
+        
+        @param th1_range    The motor angles (first, last) theta_1 of the
+                            grid (ticks).
+        @param th2_range    The motor angles (first, last) theta_2 of the
+                            grid (ticks).
+        @param nodes        The number of nodes (along theta_1,
+                            along theta_2), at least 2 each.
+        @param gains        The default gains (Kp, Ki, Kd), in the units of
+                            @c PIDController.set_gains().
+        '''
+        self._start = (th1_range[0], th2_range[0])
+        self._nodes = nodes
+        ## @brief The grid spacing (along theta_1, along theta_2) (ticks).
+        self.spacing = ((th1_range[1] - th1_range[0]) // (nodes[0] - 1),
+                        (th2_range[1] - th2_range[0]) // (nodes[1] - 1))
+        
+        # Gains of each motor and direction, node by node along theta_1
+        self._table = array.array('f', gains * (4 * nodes[0] * nodes[1]))
+        
+    def set(self, motorID, direction, i1, i2, gains):
+        '''!
+        Sets the gains at one node of the grid.
+        
+        @param motorID      The motor the gains are for.
+        @param direction    @c 0 while the motor's set point increases and
+                            @c 1 while it decreases.
+        @param i1           The index of the node along theta_1.
+        @param i2           The index of the node along theta_2.
+        @param gains        The gains (Kp, Ki, Kd).
+        '''
+        i = self._index(motorID, direction, i1, i2)
+        for j in range(3):
+            self._table[i + j] = gains[j]
+        
+    def gains(self, motorID, direction, th1, th2):
+        '''!
+        Interpolates the gains of a motor at a set point.
+        
+        @param motorID      The motor to find the gains of.
+        @param direction    @c 0 while the motor's set point increases and
+                            @c 1 while it decreases.
+        @param th1          The set point motor angle theta_1 (ticks).
+        @param th2          The set point motor angle theta_2 (ticks).
+        @return The gains (Kp, Ki, Kd).
+        '''
+        i1, f1 = self._cell(0, th1)
+        i2, f2 = self._cell(1, th2)
+        table = self._table
+        k00 = self._index(motorID, direction, i1, i2)
+        k10 = k00 + 3
+        k01 = k00 + 3 * self._nodes[0]
+        k11 = k01 + 3
+        return tuple((table[k00 + j] * (1 - f1) + table[k10 + j] * f1)
+                     * (1 - f2)
+                     + (table[k01 + j] * (1 - f1) + table[k11 + j] * f1)
+                     * f2 for j in range(3))
+        
+    def save(self, schedule_file=SCHEDULE_FILE):
+        '''!
+        Saves the schedule in the format read by @c load_schedule().
+        
+        @param schedule_file    The name of the file to write.
+        '''
+        with open(schedule_file, 'w') as out:
+            out.write('grid,{:d},{:d},{:d},{:d},{:d},{:d}\n'.format(
+                self._start[0],
+                self._start[0] + self.spacing[0] * (self._nodes[0] - 1),
+                self._start[1],
+                self._start[1] + self.spacing[1] * (self._nodes[1] - 1),
+                self._nodes[0], self._nodes[1]))
+            for motorID in range(2):
+                for direction in range(2):
+                    for i2 in range(self._nodes[1]):
+                        for i1 in range(self._nodes[0]):
+                            k = self._index(motorID, direction, i1, i2)
+                            out.write('{:d},{:s},{:d},{:d},{:g},{:g},{:g}\n'
+                                      .format(motorID + 1, '+-'[direction],
+                                              i1, i2, *self._table[k:k + 3]))
+        
+    def _index(self, motorID, direction, i1, i2):
+        '''!
+        Finds where the gains of a node are in the table.
+        
+        @param motorID      The motor.
+        @param direction    The direction of the motor's set point.
+        @param i1           The index of the node along theta_1.
+        @param i2           The index of the node along theta_2.
+        @return The index of the node's Kp in the table.
+        '''
+        return 3 * (((2*motorID + direction) * self._nodes[1] + i2)
+                    * self._nodes[0] + i1)
+        
+    def _cell(self, axis, th):
+        '''!
+        Finds the grid cell a motor angle is in along one axis.
+        
+        @param axis The axis, @c 0 for theta_1 and @c 1 for theta_2.
+        @param th   The motor angle (ticks).
+        @return A tuple (i, f) of the index of the node before the motor
+                angle and the fraction of the way to the next node.
+        '''
+        u = (th - self._start[axis]) / self.spacing[axis]
+        last = self._nodes[axis] - 2
+        if u <= 0:
+            return (0, 0.0)
+        if u >= last + 1:
+            return (last, 1.0)
+        i = int(u)
+        return (i, u - i)
+
+
+def area_schedule(nodes, gains, samples=17):
+    '''!
+    Creates a gain schedule whose grid just covers the motor angles of the
+    drawing area.
+    
+    @param nodes    The number of nodes (along theta_1, along theta_2).
+    @param gains    The gains (Kp, Ki, Kd) of every node.
+    @param samples  The number of points along each side of the drawing area
+                    to find the motor angles of.
+    @return A @c GainSchedule.
+    '''
+    angles = [task_parser.transform(task_parser.WIDTH * i / (samples - 1),
+                                    task_parser.HEIGHT * j / (samples - 1))
+              for i in range(samples) for j in range(samples)]
+    th1 = [angle[0] for angle in angles]
+    th2 = [angle[1] for angle in angles]
+    return GainSchedule((min(th1), max(th1)), (min(th2), max(th2)), nodes,
+                        gains)
+
+
+def load_schedule(gains, schedule_file=SCHEDULE_FILE):
+    '''!
+    Loads a gain schedule saved by @c GainSchedule.save() or written by hand.
+    
+    @param gains            The default gains (Kp, Ki, Kd) of nodes the file
+                            doesn't set.
+    @param schedule_file    The name of the file to read.
+    @return A @c GainSchedule.
+    '''
+    schedule = None
+    with open(schedule_file) as sched:
+        for line in sched:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(',')
+            if fields[0] == 'grid':
+                values = [int(value) for value in fields[1:]]
+                schedule = GainSchedule(values[0:2], values[2:4], values[4:6],
+                                        gains)
+            elif schedule == None:
+                raise ValueError('gain schedule has no grid line')
+            else:
+                schedule.set(int(fields[0]) - 1, '+-'.index(fields[1]),
+                             int(fields[2]), int(fields[3]),
+                             [float(value) for value in fields[4:7]])
+    if schedule == None:
+        raise ValueError('gain schedule has no grid line')
+    return schedule
+
+
+@micropython.native
+def _clip(value, bound):
+    '''!
+    Limits a value to a range around zero.
+    
+    @param value    The value to limit.
+    @param bound    The largest magnitude allowed.
+    @return The limited value.
+    '''
+    if value > bound:
+        return bound
+    if value < -bound:
+        return -bound
+    return value
+
+
+def _bound(gain):
+    '''!
+    Finds how large a value can be before its product with a fixed point
+    gain saturates the motor on its own.
+    
+    @param gain The fixed point gain.
+    @return The largest magnitude of the value worth keeping.
+    '''
+    if gain == 0:
+        return 0
+    return (MAX_POWER << GAIN_FRAC) // abs(gain) + 1
+
+
+# Profiles a step of both motors by run() twice against run_both()
+if __name__ == '__main__':
+    import cotask
+    import task_share
+    
+    def _profiled(name, step_fun):
+        '''!
+        Creates a profiled task which runs a step of both motors of its own
+        controller every controller period. The encoders move around the
+        set point, which moves every run, so every term is worked out.
+        
+        @param name     The name of the task.
+        @param step_fun A function which runs a step of a controller.
+        @return The task.
+        '''
+        shares = (task_share.Share('i', thread_protect=False),
+                  task_share.Share('i', thread_protect=False))
+        pid = PIDController(0, 0, 0, (100000, 100000), *shares)
+        pid.set_gains(0.088, 0.04, 0.0009)
+        pid.set_contour_gain(0.088)
+        for motorID in range(2):
+            pid.set_feedforward(motorID, 0.01, 10, 12)
+        
+        def task_fun():
+            count = 0
+            while True:
+                count += 1
+                shares[_MOTOR1].put(100000 + count % 50)
+                shares[_MOTOR2].put(100000 - count % 30)
+                pid.set_reference((100000 + count, 100000 - count))
+                step_fun(pid)
+                yield 0
+        
+        return cotask.Task(task_fun, name=name, priority=1, period=PERIOD,
+                           profile=True)
+    
+    def _run_twice(pid):
+        pid.run(_MOTOR1)
+        pid.run(_MOTOR2)
+    
+    cotask.task_list.append(_profiled('run() x2', _run_twice))
+    cotask.task_list.append(_profiled('run_both()', PIDController.run_both))
+    _start = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), _start) < 5000:
+        cotask.task_list.pri_sched()
+    print(cotask.task_list)
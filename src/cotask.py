@@ -8,6 +8,14 @@ Tasks are created as generators, functions which have infinite loops and call
 in the system are kept in a list maintained by class @c CoTaskList; the 
 system scheduler then runs the tasks' @c run() methods according to a 
 chosen scheduling algorithm such as round-robin or highest-priority-first. 
+The tickless scheduler sleeps the CPU whenever no task is ready, rather than
+checking every task over and over, and runs either the highest priority task
+or the task with the earliest deadline. Deadline misses are counted, and
+@c TaskList.admit() checks whether the tasks' run times leave time for every
+task to meet its deadlines. Profiled tasks keep histograms of their run times
+and lateness, from which percentiles are shown and which can be dumped in a
+compact binary form. Traced tasks keep their latest state transitions in a
+ring buffer of fixed size, so tracing can be left on indefinitely.
 
 @author JR Ridgely
 @date   2017-Jan-01 JRR Approximate date of creation of file
@@ -16,9 +24,38 @@ chosen scheduling algorithm such as round-robin or highest-priority-first.
            under the GNU Public License, version 3.0. 
 """
 
-import gc                              # Memory allocation garbage collector
+import array                           # Preallocated histograms and traces
+import struct                          # Packs histograms and traces to dump
+import sys                             # Standard output for dumping
 import utime                           # Micropython version of time library
 import micropython                     # This shuts up incorrect warnings
+import machine                         # Used to sleep the CPU when idle
+
+
+## The number of buckets in each histogram of run times and lateness. The last
+#  bucket also counts every time too long for the others.
+HIST_BINS = 64
+
+## The width in microseconds of each bucket of the histograms
+HIST_BIN_US = 100
+
+## The first bytes of a histogram dump from @c TaskList.dump()
+HIST_MAGIC = b'HST1'
+
+## The number of state transitions kept by each traced task. When the trace
+#  is full, each new transition overwrites the oldest one
+TRACE_SIZE = 256
+
+## The first bytes of a trace dump from @c Task.dump_trace()
+TRACE_MAGIC = b'TRC1'
+
+## Scheduling policy of @c TaskList.tickless_sched() which runs the highest
+#  priority task which is ready, the same as @c TaskList.pri_sched()
+PRIORITY = 0
+
+## Scheduling policy of @c TaskList.tickless_sched() which runs the task which
+#  is ready and has the earliest deadline (EDF)
+EDF = 1
 
 
 class Task:
@@ -58,7 +95,8 @@ class Task:
 
 
     def __init__ (self, run_fun, name = "NoName", priority = 0, 
-                  period = None, profile = False, trace = False):
+                  period = None, profile = False, trace = False,
+                  deadline = None, wcet = None):
         """!
         Initialize a task object so it may be run by the scheduler.
 
@@ -78,6 +116,12 @@ class Task:
         @param profile Set to @c True to enable run-time profiling 
         @param trace Set to @c True to generate a list of transitions between
                states. @b Note: This slows things down and allocates memory.
+        @param deadline The time in milliseconds after the task is due to run,
+               or after @c go() is called, by which it must have run, or
+               @c None for the task's period. A task which isn't run by a
+               timer has no deadline unless one is given.
+        @param wcet The longest time in milliseconds one run of the task takes,
+               or @c None to use the longest run time measured by profiling
         """
         # The function which is run to implement this task's code. Since it 
         # is a generator, we "run" it here, which doesn't actually run it but
@@ -103,6 +147,16 @@ class Task:
             self.period = period
             self._next_run = None
 
+        # The relative deadline and worst case run time in microseconds, and
+        # the time the task is due to have run by. Runs which finish after it
+        # are counted with the profile
+        if deadline == None:
+            self._deadline = self.period
+        else:
+            self._deadline = int (deadline * 1000)
+        self._wcet = None if wcet == None else int (wcet * 1000)
+        self._due = None
+
         # Flag which causes the task to be profiled, in which the execution
         #  time of the @c run() method is measured and basic statistics kept. 
         self._prof = profile
@@ -112,10 +166,16 @@ class Task:
         # for and track state transitions.
         self._prev_state = 0
 
-        # If transition tracing has been enabled, create an empty list in 
-        # which to store transition (time, to-state) stamps
+        # If transition tracing has been enabled, allocate the ring buffer in
+        # which transition (time, to-state) stamps are stored. The times are
+        # in microseconds since the previous transition. The index is where
+        # the next transition goes and the count how many have been recorded
         self._trace = trace
-        self._tr_data = []
+        if trace:
+            self._tr_times = array.array ('i', [0] * TRACE_SIZE)
+            self._tr_states = array.array ('i', [0] * TRACE_SIZE)
+        self._tr_index = 0
+        self._tr_count = 0
         self._prev_time = utime.ticks_us ()
 
         ## Flag which is set true when the task is ready to be run by the
@@ -144,10 +204,16 @@ class Task:
             # Run the method belonging to the state which should be run next
             curr_state = next (self._run_gen)
 
-            # If profiling or tracing, save timing data
-            if self._prof or self._trace:
+            # If profiling, tracing, or checking deadlines, save timing data
+            if self._prof or self._trace or self._due != None:
                 etime = utime.ticks_us ()
 
+            # Count the run as a miss if it finished after its deadline
+            if self._due != None:
+                if utime.ticks_diff (etime, self._due) > 0:
+                    self._misses += 1
+                self._due = None
+
             # If profiling, save timing data
             if self._prof:
                 self._runs += 1
@@ -156,20 +222,20 @@ class Task:
                     self._run_sum += runt
                     if runt > self._slowest:
                         self._slowest = runt
-
-            # If transition logic tracing is on, record a transition; if not,
-            # ignore the state. If out of memory, switch tracing off and 
-            # run the memory allocation garbage collector
-            if self._trace:
-                try:
-                    if curr_state != self._prev_state:
-                        self._tr_data.append (
-                            (utime.ticks_diff (etime, self._prev_time),
-                             curr_state))
-                except MemoryError:
-                    self._trace = False
-                    gc.collect ()
-
+                    _count (self._run_hist, runt)
+
+            # If transition logic tracing is on, record a transition over
+            # the oldest one in the ring buffer; if not, ignore the state.
+            # States which aren't integers can't be stored and aren't traced
+            if self._trace and curr_state != self._prev_state \
+                    and isinstance (curr_state, int):
+                self._tr_times[self._tr_index] = utime.ticks_diff (etime,
+                    self._prev_time)
+                self._tr_states[self._tr_index] = curr_state
+                self._tr_index += 1
+                if self._tr_index >= TRACE_SIZE:
+                    self._tr_index = 0
+                self._tr_count += 1
                 self._prev_state = curr_state
                 self._prev_time = etime
 
@@ -193,7 +259,13 @@ class Task:
         if self.period != None:
             late = utime.ticks_diff (utime.ticks_us (), self._next_run)
             if late > 0:
+                # If the last run it came due for hasn't happened, that run
+                # is skipped and missed its deadline
+                if self.go_flag:
+                    self._misses += 1
                 self.go_flag = True
+                self._due = utime.ticks_diff (self._deadline,
+                                              -self._next_run)
                 self._next_run = utime.ticks_diff (self.period, 
                                                    -self._next_run)
 
@@ -202,6 +274,7 @@ class Task:
                     self._late_sum += late
                     if late > self._latest:
                         self._latest = late
+                    _count (self._late_hist, late)
 
         # If the task doesn't use a timer, we rely on go_flag to signal ready
         return self.go_flag
@@ -209,7 +282,8 @@ class Task:
 
     def reset_profile (self):
         """!
-        This method resets the variables used for execution time profiling.
+        This method resets the variables used for execution time profiling
+        and the count of deadline misses.
         This method is also used by @c __init__() to create the variables.
         """
         self._runs = 0
@@ -217,21 +291,86 @@ class Task:
         self._slowest = 0
         self._late_sum = 0
         self._latest = 0
+        self._misses = 0
+
+        # Histograms of run time and lateness, allocated once and then cleared
+        # in place
+        if not hasattr (self, '_run_hist'):
+            self._run_hist = array.array ('H', [0] * HIST_BINS)
+            self._late_hist = array.array ('H', [0] * HIST_BINS)
+        for index in range (HIST_BINS):
+            self._run_hist[index] = 0
+            self._late_hist[index] = 0
+
+
+    def percentiles (self):
+        """!
+        This method finds the median and 99th percentile of the task's run
+        times and lateness from its histograms, along with their maxima. A
+        percentile is the upper edge of the bucket it falls in, so it may be
+        up to @c HIST_BIN_US too high.
+        @return A tuple (run_p50, run_p99, run_max, late_p50, late_p99,
+                late_max) in milliseconds
+        """
+        return (_percentile (self._run_hist, 0.5, self._slowest) / 1000.0,
+                _percentile (self._run_hist, 0.99, self._slowest) / 1000.0,
+                self._slowest / 1000.0,
+                _percentile (self._late_hist, 0.5, self._latest) / 1000.0,
+                _percentile (self._late_hist, 0.99, self._latest) / 1000.0,
+                self._latest / 1000.0)
+
+
+    def worst_case (self) -> int:
+        """!
+        This method finds the longest time one run of the task takes, as
+        given when the task was created or else as measured by profiling.
+        @return The worst case run time in microseconds
+        """
+        if self._wcet != None:
+            return self._wcet
+        return self._slowest
+
+
+    def trace_snapshot (self):
+        """!
+        This method copies the transitions in the task's trace, oldest first.
+        Each is a tuple of the time in microseconds since the transition
+        before it and the state to which the task transitioned. Only the
+        latest @c TRACE_SIZE transitions are kept.
+        @return A list of (time, state) tuples, empty if the task isn't traced
+        """
+        if not self._trace:
+            return []
+        items = []
+        index = self._tr_index if self._tr_count > TRACE_SIZE else 0
+        for count in range (min (self._tr_count, TRACE_SIZE)):
+            items.append ((self._tr_times[index], self._tr_states[index]))
+            index += 1
+            if index >= TRACE_SIZE:
+                index = 0
+        return items
 
 
     def get_trace (self):
         """!
         This method returns a string containing the task's transition trace.
         The trace is a set of tuples, each of which contains a time and the
-        states from and to which the system transitioned. 
+        states from and to which the system transitioned. Times count from
+        the oldest transition kept if older ones have been overwritten.
         @return A possibly quite large string showing state transitions
         """
         tr_str = 'Task ' + self.name + ':'
         if self._trace:
             tr_str += '\n'
+            items = self.trace_snapshot ()
             last_state = 0
+            if self._tr_count > TRACE_SIZE:
+                # The oldest transition kept is where the times start
+                tr_str += '({:d} older transitions overwritten)\n'.format (
+                    self._tr_count - TRACE_SIZE + 1)
+                last_state = items.pop (0)[1]
             total_time = 0.0
-            for item in self._tr_data:
+            for item in items:
                 total_time += item[0] / 1000000.0
                 tr_str += '{: 12.6f}: {: 2d} -> {:d}\n'.format (total_time, 
                     last_state, item[1])
@@ -241,12 +380,43 @@ class Task:
         return (tr_str)
 
 
+    def dump_trace (self, stream = None):
+        """!
+        Write the task's trace in a compact binary form, by default to the
+        USB serial port over which the REPL runs. The ring buffer is written
+        as it is, so this doesn't need to allocate much memory.
+
+        The dump starts with @c TRACE_MAGIC, the task's name in 16 bytes
+        padded with zeros, and a header of three little endian unsigned 32
+        bit numbers: @c TRACE_SIZE, the index in the buffer where the next
+        transition would go and the number of transitions recorded. If that
+        number is at least @c TRACE_SIZE the oldest transition kept is at the
+        index; otherwise the first one is at index zero. Then come the times
+        and then the states of @c TRACE_SIZE transitions as signed 32 bit
+        numbers. Nothing but the header is written for an untraced task.
+        @param stream The binary stream to write to, by default standard
+               output
+        """
+        if stream == None:
+            stream = sys.stdout.buffer
+        stream.write (TRACE_MAGIC)
+        stream.write (struct.pack ('<16sIII', self.name.encode ()[:16],
+            TRACE_SIZE if self._trace else 0, self._tr_index,
+            self._tr_count))
+        if self._trace:
+            stream.write (self._tr_times)
+            stream.write (self._tr_states)
+
+
     def go (self):
         """!
         Method to set a flag so that this task indicates that it's ready to run.
         This method may be called from an interrupt service routine or from
         another task which has data that this task needs to process soon.
+        If the task has a deadline, it must run within it from now.
         """
+        if self.period == None and self._deadline != None:
+            self._due = utime.ticks_diff (self._deadline, -utime.ticks_us ())
         self.go_flag = True
 
 
@@ -261,7 +431,7 @@ class Task:
             rst += '{: 10.1f}'.format (self.period / 1000.0)
         except TypeError:
             rst += '         -'
-        rst += '{: 8d}'.format (self._runs)
+        rst += '{: 8d}{: 8d}'.format (self._runs, self._misses)
 
         if self._prof and self._runs > 0:
             avg_dur = (self._run_sum / self._runs) / 1000.0
@@ -289,6 +459,15 @@ class TaskList:
     look through the list to find the highest priority task which is ready to
     run at any given time. Tasks can also be scheduled in a simpler
     "round-robin" fashion.
+
+    The timed tasks are also kept in a heap sorted by their next run times,
+    which lets @c tickless_sched() look only at the task due soonest and
+    sleep the CPU until then when nothing is ready. It keeps track of the
+    fraction of the time the CPU is busy and how often it wakes up. The
+    tickless scheduler runs tasks by priority or by earliest deadline
+    depending on @c policy; @c rate_monotonic() sets the priorities from
+    the periods, and @c admit() checks that the tasks can meet their
+    deadlines with either policy.
     """
 
     def __init__ (self):
@@ -302,6 +481,22 @@ class TaskList:
         #  that priority. 
         self.pri_list = []
 
+        # A heap of the tasks which run on a timer, with the task due next at
+        # the front, and the tasks which are only run when their go() method
+        # is called
+        self._heap = []
+        self._event_tasks = []
+
+        # Statistics of the tickless scheduler: when it started, the time it
+        # has slept, and the number of times the CPU has woken up
+        self._sched_start = None
+        self._idle_us = 0
+        self._wakeups = 0
+
+        ## The scheduling policy of @c tickless_sched(), @c PRIORITY or
+        #  @c EDF
+        self.policy = PRIORITY
+
 
     def append (self, task):
         """!
@@ -329,6 +524,13 @@ class TaskList:
         # Make sure the main list (of lists at each priority) is sorted
         self.pri_list.sort (key=lambda pri: pri[0], reverse=True)
 
+        # Keep timed tasks in the heap of run times, for tickless_sched()
+        if task.period != None:
+            self._heap.append (task)
+            self._sift_up (len (self._heap) - 1)
+        else:
+            self._event_tasks.append (task)
+
 
     @micropython.native
     def rr_sched (self):
@@ -375,19 +577,339 @@ class TaskList:
                     return
 
 
+    @micropython.native
+    def tickless_sched (self):
+        """!
+        Run tasks according to their priorities, sleeping when none is ready.
+
+        This scheduler runs the same task as @c pri_sched() would: the
+        highest priority task which is ready, taking turns with others at
+        the same priority. Rather than checking the time for every task,
+        it checks only the timed tasks whose run times have come, which are
+        at the front of the heap. If no task is ready, the CPU sleeps with
+        @c machine.idle() until the next run time or until an interrupt
+        calls a task's @c go() method.
+        """
+        now = utime.ticks_us ()
+        if self._sched_start == None:
+            self._sched_start = now
+
+        # Mark each timed task whose run time has come as ready to go. Its
+        # ready() method moves its next run time on by a period, so it is
+        # moved back in the heap
+        heap = self._heap
+        while heap and utime.ticks_diff (now, heap[0]._next_run) > 0:
+            heap[0].ready ()
+            self._sift_down (0)
+
+        # Run the ready task with the earliest deadline. Tasks without one go
+        # after those with one, and ties go to the higher priority task
+        if self.policy == EDF:
+            first = None
+            for pri in self.pri_list:
+                for task in pri[2:]:
+                    if task.go_flag and (first == None or (
+                            task._due != None and (first._due == None
+                            or utime.ticks_diff (task._due, first._due) < 0))):
+                        first = task
+            if first != None and first.schedule ():
+                return
+
+        # Otherwise run the highest priority task which is ready, in the same
+        # order as pri_sched()
+        for pri in self.pri_list:
+            tries = 2
+            length = len (pri)
+            while tries < length:
+                task = pri[pri[1]]
+                tries += 1
+                pri[1] += 1
+                if pri[1] >= length:
+                    pri[1] = 2
+                if task.go_flag and task.schedule ():
+                    return
+
+        # Nothing is ready, so sleep until the next run time. Any interrupt
+        # wakes the CPU, so check whether it made a task ready
+        sleep_start = utime.ticks_us ()
+        while not self._any_go ():
+            if heap and utime.ticks_diff (utime.ticks_us (),
+                                          heap[0]._next_run) > 0:
+                break
+            machine.idle ()
+            self._wakeups += 1
+        self._idle_us += utime.ticks_diff (utime.ticks_us (), sleep_start)
+
+
+    def rate_monotonic (self):
+        """!
+        Set the priorities of the timed tasks by rate monotonic order, in
+        which tasks with shorter periods have higher priorities. Tasks with
+        the same period get the same priority. The timed tasks are put above
+        the tasks which aren't run by a timer, whose priorities are kept.
+        """
+        base = 0
+        for task in self._event_tasks:
+            base = max (base, task.priority + 1)
+        periods = sorted (set (task.period for task in self._heap),
+                          reverse=True)
+        tasks = [task for pri in self.pri_list for task in pri[2:]]
+        self.pri_list = []
+        self._heap = []
+        self._event_tasks = []
+        for task in tasks:
+            if task.period != None:
+                task.priority = base + periods.index (task.period)
+            self.append (task)
+
+
+    def admit (self, policy = None) -> bool:
+        """!
+        Check if every task with a deadline is sure to meet it, from the
+        tasks' worst case run times.
+
+        Tasks can't be interrupted while they run, so any task may have to
+        wait for one run of a task which would otherwise go after it. Under
+        @c PRIORITY scheduling, each task's longest response time is found by
+        adding that wait to its own run time and the runs of the tasks at
+        its priority or higher which can come due meanwhile, and checked
+        against its deadline. Under @c EDF scheduling, the sum over the timed
+        tasks of run time over the shorter of period and deadline, plus that
+        wait over the task's deadline, must be at most one for each task. A
+        task which isn't run by a timer is counted as running once in each
+        wait, since how often it runs is unknown.
+
+        The worst case run times are as given when the tasks were created or
+        else as measured by profiling, so profiled tasks should be run for a
+        while first. The result for each task is printed.
+        @param policy The policy to check, by default the list's @c policy
+        @return @c True if every task will meet its deadlines
+        """
+        if policy == None:
+            policy = self.policy
+        tasks = [task for pri in self.pri_list for task in pri[2:]]
+        density = 0.0
+        for task in self._heap:
+            density += task.worst_case () / min (task.period, task._deadline)
+
+        admitted = True
+        for task in tasks:
+            if task._deadline == None:
+                continue
+            if policy == EDF:
+                # The longest run of a task with a later deadline
+                block = 0
+                for other in tasks:
+                    if other._deadline == None \
+                            or other._deadline > task._deadline:
+                        block = max (block, other.worst_case ())
+                load = density + block / task._deadline
+                ok = load <= 1.0
+                print ('{:<16s} load {:6.3f}'.format (task.name, load),
+                       'ok' if ok else 'MAY MISS')
+            else:
+                # The longest run of a lower priority task, then the runs of
+                # tasks at the same or higher priority which come due until
+                # the task starts
+                block = 0
+                for other in tasks:
+                    if other.priority < task.priority:
+                        block = max (block, other.worst_case ())
+                wait = block
+                while True:
+                    start = block
+                    for other in tasks:
+                        if other is task or other.priority < task.priority:
+                            continue
+                        if other.period == None:
+                            start += other.worst_case ()
+                        else:
+                            start += (wait // other.period + 1) \
+                                * other.worst_case ()
+                    if start == wait or start > task._deadline:
+                        break
+                    wait = start
+                response = start + task.worst_case ()
+                ok = response <= task._deadline
+                print ('{:<16s} response {:8.3f} of {:8.3f} ms'.format (
+                       task.name, response / 1000, task._deadline / 1000),
+                       'ok' if ok else 'MAY MISS')
+            admitted = admitted and ok
+        return admitted
+
+
+    def utilization (self):
+        """!
+        Find the fraction of the time the CPU has been busy running tasks
+        since @c tickless_sched() was first called.
+        @return The fraction of the time the CPU was busy, from 0 to 1
+        """
+        if self._sched_start == None:
+            return 0.0
+        total = utime.ticks_diff (utime.ticks_us (), self._sched_start)
+        if total <= 0:
+            return 0.0
+        return 1.0 - self._idle_us / total
+
+
+    def _any_go (self):
+        """!
+        Check if any task which runs only when its @c go() method is called
+        is ready to go.
+        @return @c True if such a task is ready
+        """
+        for task in self._event_tasks:
+            if task.go_flag:
+                return True
+        return False
+
+
+    def _sift_up (self, index):
+        """!
+        Move a task towards the front of the heap until the task in front of
+        it is due no later than it is.
+        @param index The index of the task in the heap
+        """
+        heap = self._heap
+        task = heap[index]
+        while index > 0:
+            parent = (index - 1) // 2
+            if utime.ticks_diff (task._next_run, heap[parent]._next_run) >= 0:
+                break
+            heap[index] = heap[parent]
+            index = parent
+        heap[index] = task
+
+
+    @micropython.native
+    def _sift_down (self, index):
+        """!
+        Move a task towards the back of the heap until the tasks behind it
+        are due no earlier than it is.
+        @param index The index of the task in the heap
+        """
+        heap = self._heap
+        length = len (heap)
+        task = heap[index]
+        while True:
+            child = 2 * index + 1
+            if child >= length:
+                break
+            if child + 1 < length and utime.ticks_diff (
+                    heap[child + 1]._next_run, heap[child]._next_run) < 0:
+                child += 1
+            if utime.ticks_diff (heap[child]._next_run, task._next_run) >= 0:
+                break
+            heap[index] = heap[child]
+            index = child
+        heap[index] = task
+
+
     def __repr__ (self):
         """!
-        Create some diagnostic text showing the tasks in the task list.
+        Create some diagnostic text showing the tasks in the task list. If the
+        tickless scheduler has been run, the CPU use and the number of times
+        the CPU woke up are shown too.
         """
-        ret_str = 'TASK             PRI    PERIOD    RUNS   AVG DUR   MAX ' \
-            'DUR  AVG LATE  MAX LATE\n'
+        ret_str = 'TASK             PRI    PERIOD    RUNS  MISSES   AVG DUR   ' \
+            'MAX DUR  AVG LATE  MAX LATE\n'
         for pri in self.pri_list:
             for task in pri[2:]:
                 ret_str += str (task) + '\n'
+        if self._sched_start != None:
+            ret_str += 'CPU busy {:.1f}%, {:d} wakeups\n'.format (
+                100 * self.utilization (), self._wakeups)
+
+        # Percentiles of the profiled tasks' run times and lateness
+        ret_str += 'TASK             RUN P50   RUN P99   RUN MAX  LATE P50  ' \
+            'LATE P99  LATE MAX\n'
+        for pri in self.pri_list:
+            for task in pri[2:]:
+                if task._prof and task._runs > 2:
+                    ret_str += '{:<16s}'.format (task.name)
+                    ret_str += '{: 8.3f}{: 10.3f}{: 10.3f}{: 10.3f}{: 10.3f}' \
+                        '{: 10.3f}\n'.format (*task.percentiles ())
 
         return ret_str
 
 
+    def dump (self, stream = None):
+        """!
+        Write the histograms of the profiled tasks in a compact binary form,
+        by default to the USB serial port over which the REPL runs.
+
+        The dump starts with @c HIST_MAGIC and a header of four little endian
+        unsigned 16 bit numbers: the number of tasks, @c HIST_BINS,
+        @c HIST_BIN_US and zero. Each task follows with its name in 16 bytes
+        padded with zeros, the number of runs, misses, the longest run time
+        and the greatest lateness as unsigned 32 bit numbers in microseconds,
+        and the run time and lateness histograms of @c HIST_BINS unsigned 16
+        bit counts each. After many runs the counts of a histogram are
+        scaled down, so they may add up to fewer than the runs.
+        @param stream The binary stream to write to, by default standard
+               output
+        """
+        if stream == None:
+            stream = sys.stdout.buffer
+        tasks = [task for pri in self.pri_list for task in pri[2:]
+                 if task._prof]
+        stream.write (HIST_MAGIC)
+        stream.write (struct.pack ('<HHHH', len (tasks), HIST_BINS,
+                                   HIST_BIN_US, 0))
+        for task in tasks:
+            stream.write (struct.pack ('<16sIIII', task.name.encode ()[:16],
+                                       task._runs, task._misses,
+                                       task._slowest, task._latest))
+            stream.write (task._run_hist)
+            stream.write (task._late_hist)
+
+
+# =============================================================================
+
+@micropython.native
+def _count (hist, value):
+    """!
+    Count a time in its bucket of a histogram without allocating memory.
+    When a bucket is full to the largest number an unsigned 16 bit bucket
+    holds, every bucket is halved, so the counts keep their proportions and
+    the percentiles stay right however long the task runs.
+    @param hist The histogram, an @c array of @c HIST_BINS buckets
+    @param value The time in microseconds
+    """
+    index = value // HIST_BIN_US
+    if index >= HIST_BINS:
+        index = HIST_BINS - 1
+    elif index < 0:
+        index = 0
+    if hist[index] >= 65535:
+        for bucket in range (HIST_BINS):
+            hist[bucket] >>= 1
+    hist[index] += 1
+
+
+def _percentile (hist, fraction, largest):
+    """!
+    Find a percentile of the times counted in a histogram.
+    @param hist The histogram, an @c array of @c HIST_BINS buckets
+    @param fraction The fraction of the times at or below the percentile
+    @param largest The largest time counted, which bounds the percentile
+    @return The upper edge of the bucket holding the percentile, in
+            microseconds
+    """
+    total = 0
+    for count in hist:
+        total += count
+    target = fraction * total
+    total = 0
+    for index in range (HIST_BINS):
+        total += hist[index]
+        if total >= target and total > 0:
+            return min ((index + 1) * HIST_BIN_US, largest)
+    return largest
+
+
+# =============================================================================
+
 ## This is @b the main task list which is created for scheduling when 
 #  @c cotask.py is imported into a program. 
 task_list = TaskList ()
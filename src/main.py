@@ -23,6 +23,8 @@ import encoder
 import motor
 import servo
 import controller
+import calibration
+import planner
 import task_parser
 
 ## @brief   Encoder pulses (ticks) per revolution
@@ -37,6 +39,8 @@ PPR = 256*4*16
 _KP = 4*(360/PPR)
 _KI = 0*(360/PPR)
 _KD = 0*(360/PPR)
+# Gain of the cross-coupled correction of the pen's distance off its path
+_KC = 4*(360/PPR)
 
 ## @brief Encoder ticks per mm of belt length change.
 #  @details There are 512 ticks/mm because there are 16 teeth on the drive
@@ -48,6 +52,10 @@ R_MAX = 330 # mm
 ## @brief Maximum position of either motor (ticks).
 TICKS_MAX = TICKS_PER_MM * R_MAX
 
+## @brief   Period of the controller task (ms).
+#  @details The controller uses this as its time step.
+CONTROLLER_PERIOD = 10
+
 # Motor IDs
 _MOTOR1 = 0
 _MOTOR2 = 1
@@ -56,6 +64,55 @@ _MOTOR2 = 1
 UP = 8
 ##  @brief The servo pwm to set when the pen is down (% duty cycle)
 DOWN = 7
+## @brief   Time the controller used to wait for every pen move (ms).
+#  @details The time saved by the pen timing model is reported against it.
+SERVO_WAIT = 500
+
+## @brief   How far (ticks) the motors may be behind the set point when the
+#           pen is set down early.
+#  @details The pen is set down as the set point approaches the start of a
+#           stroke, by the planner's time left to get there. If the motors
+#           lag further behind than this, the pen waits for them, so it can't
+#           land more than this short of the start. 100 ticks is 0.2 mm.
+PEN_LAG = 100
+
+## @brief   Whether the plotter stops at corners and ends of strokes.
+#  @details Stopping lets the motors settle on the corner rather than round
+#           it, at a cost of about 3 s per job plus the settling time.
+HOLD_CORNERS = True
+
+## @brief   Time (ms) after which a corner the motors haven't settled on
+#           counts as missed.
+#  @details The motors usually settle within the corner tolerance well
+#           before this. The plotter still waits for them, but a missed
+#           corner is printed and counted in the report after the plot, as
+#           a sign of gains or a calibration which leave the motors short.
+CORNER_SETTLE_MS = 150
+
+## @brief Number of set points the set point queue can hold.
+#  @details Most set points are stored as 4 bytes of changes from the one
+#           before, so this takes 6 kB. Counting keyframes, set points take
+#           4.3 to 5.9 bytes on average, so about 1000 to 1400 fit.
+QUEUE_SIZE = 1500
+## @brief Number of set points the parser task keeps in the queue.
+#  @details The parser task tops the queue up to this level while plotting,
+#           so a drawing of any size only needs this many set points in memory.
+#           Set points stored as keyframes take more room, so the queue may
+#           fill up with fewer, and the parser then waits for room.
+QUEUE_WATERMARK = 1200
+## @brief   Longest time one run of each encoder task takes (ms).
+#  @details The tasks are checked for their deadlines with these run times
+#           before the plotter moves. They are bounds with some margin over
+#           the MAX DUR column of the task table printed after a plot, and
+#           should be raised if a task is found to take longer.
+ENCODER_WCET = 0.3
+## @brief   Longest time one run of the controller task takes (ms).
+#  @details See @c ENCODER_WCET.
+CONTROLLER_WCET = 3
+## @brief   Longest time one run of the parser task takes (ms).
+#  @details One run queues at most @c task_parser.BATCH set points. See
+#           @c ENCODER_WCET.
+PARSER_WCET = 4
 
 def startup():
     '''!
@@ -102,6 +159,14 @@ def task_enc2_fun():
 def task_controller_fun ():
     """!
     Task that runs a PID controller that controls both motors and the servo.
+    
+    The controller follows the set point moved along the queued set points
+    by the motion planner, and stops to move the pen when the planner needs
+    it. Pen moves overlap the motion as the pen timing model allows: the pen
+    is set down while the motors approach the start of a stroke, and the
+    travel move after a stroke starts before the pen is clear. When the
+    drawing is done the achieved and planned plot times are printed, with
+    the time saved against waiting @c SERVO_WAIT at every pen move.
     """
     # States of controller FSM
     STATE_MOTOR = 0
@@ -117,51 +182,110 @@ def task_controller_fun ():
     state = STATE_MOTOR
     curr_servo_state = 0
     servo_start_time = None
+    # Pen state the servo was last set to, which may be ahead of the pen
+    # state the planner has been told about
+    servo_pen = curr_servo_state
+    pen_moves = 0
+    pen_wait = 0
     
-    # Load the first setpoint
-    if sp_theta1_queue.any():
-        next_th1_sp = sp_theta1_queue.get()
-        next_th2_sp = sp_theta2_queue.get()
-        next_pen_sp = sp_pen_queue.get()
-    pidController.set_set_point((next_th1_sp, next_th2_sp))
-    
+    # Hold the zeroed position until the parser task queues the first
+    # setpoint
+    next_pen_sp = curr_servo_state
+    pidController.set_set_point((TICKS_MAX, TICKS_MAX))
+    last_time = time.ticks_us()
+    plot_start = None
+    hold_start = None
+    hold_missed = False
+    corner_misses = 0
     
     while True:
+        # Move the set point along the planned path
+        now = time.ticks_us()
+        dt = time.ticks_diff(now, last_time) / 1000000
+        last_time = now
+        if state == STATE_MOTOR:
+            motion_planner.advance(dt)
+            pidController.set_reference((motion_planner.th1,
+                                         motion_planner.th2))
+        
         # Always update the controller first
-        motor1.set_duty_cycle(pidController.run(_MOTOR1))
-        motor2.set_duty_cycle(pidController.run(_MOTOR2))
+        pidController.run_both()
+        motor1.set_duty_cycle(pidController.duty[_MOTOR1])
+        motor2.set_duty_cycle(pidController.duty[_MOTOR2])
         
         if state == STATE_MOTOR:
-            move_done = pidController.check_finish_step()
-            if move_done:
-                # Retrieve the next setpoint in the queue, but don't update
-                # the controller yet (pen may need to move)
-                if sp_theta1_queue.any():
-                    next_pen_sp = sp_pen_queue.get()
-                    next_th1_sp = sp_theta1_queue.get()
-                    next_th2_sp = sp_theta2_queue.get()
-                if next_pen_sp == curr_servo_state:
-                    # Update controller if pen is already in position
-                    pidController.set_set_point((next_th1_sp, next_th2_sp))
-                else:
-                    # If pen position needs to change, go to servo state
-                    state = STATE_SERVO
+            if plot_start == None and not motion_planner.idle():
+                plot_start = time.ticks_ms()
+            elif plot_start != None and motion_planner.idle() \
+                and parser.done and not sp_queue.any():
+                print('plot took {:.1f} s, planned moves {:.1f} s'.format(
+                    time.ticks_diff(time.ticks_ms(), plot_start) / 1000,
+                    motion_planner.planned))
+                print('{:d} pen moves waited {:.1f} s, {:.1f} s saved'.format(
+                    pen_moves, pen_wait / 1000,
+                    (pen_moves * SERVO_WAIT - pen_wait) / 1000))
+                print('{:d} corners took over {:d} ms to settle'.format(
+                    corner_misses, CORNER_SETTLE_MS))
+                plot_start = None
+                pen_moves = 0
+                pen_wait = 0
+                corner_misses = 0
+            
+            # Set the pen down early enough that it lands as the motors
+            # reach the start of the stroke, as long as the motors are
+            # keeping up with the set point
+            pen_time = motion_planner.time_to_pen()
+            if pen_time != None and pen_time[1] == task_parser.PEN_DOWN \
+                and servo_pen != task_parser.PEN_DOWN \
+                and pen_time[0] * 1000 <= pen_timing.lead() \
+                and motion_planner.lag(encoder1_share.get(),
+                                       encoder2_share.get()) <= PEN_LAG:
+                servo1.set_angle(DOWN)
+                servo_pen = task_parser.PEN_DOWN
+                servo_start_time = time.ticks_ms()
+            
+            # The planner holds at corners and ends of strokes until the
+            # motors settle there as closely as the set point needs
+            hold = motion_planner.hold()
+            if hold != None:
+                if hold_start == None:
+                    hold_start = time.ticks_ms()
+                    hold_missed = False
+                if pidController.check_finish_step(hold):
+                    motion_planner.release()
+                    hold_start = None
+                elif not hold_missed and time.ticks_diff(
+                    time.ticks_ms(), hold_start) >= CORNER_SETTLE_MS:
+                    hold_missed = True
+                    corner_misses += 1
+                    print('corner at ({:d}, {:d}) not settled after {:d} ms'
+                          .format(motion_planner.th1, motion_planner.th2,
+                                  CORNER_SETTLE_MS))
+            
+            # The planner stops where the pen needs to move, and the motors
+            # settle there as closely as that set point needs
+            next_pen_sp = motion_planner.next_pen()
+            if next_pen_sp != None and pidController.check_finish_step(
+                motion_planner.reached()):
+                state = STATE_SERVO
+                wait_start = time.ticks_ms()
             
         elif state == STATE_SERVO:
-            # Time that the servo needs to change position
-            SERVO_WAIT = 500 # ms
-            if servo_start_time == None:
+            if servo_pen != next_pen_sp:
                 servo_start_time = time.ticks_ms()
-                if curr_servo_state == 0:
+                servo_pen = next_pen_sp
+                if next_pen_sp == task_parser.PEN_DOWN:
                     servo1.set_angle(DOWN)
-                elif curr_servo_state == 1:
+                else:
                     servo1.set_angle(UP)
-            # Wait for servo
-            elif time.ticks_diff(time.ticks_ms(),
-                                 servo_start_time) > SERVO_WAIT:
-                pidController.set_set_point((next_th1_sp, next_th2_sp))
+            # Wait for servo, for as long as the timing model says the pen
+            # has left to move
+            elif time.ticks_diff(time.ticks_ms(), servo_start_time) \
+                >= pen_timing.wait(next_pen_sp == task_parser.PEN_DOWN):
+                motion_planner.set_pen(next_pen_sp)
                 curr_servo_state = next_pen_sp
-                servo_start_time = None
+                pen_moves += 1
+                pen_wait += time.ticks_diff(time.ticks_ms(), wait_start)
                 state = STATE_MOTOR
         yield ()
         
@@ -179,13 +303,26 @@ if __name__ == "__main__":
     encoder2_share = task_share.Share('i', thread_protect = False,
                                       name = "Encoder 2 Share")
 
-    # Create Queues with set points (theta_1, theta_2, Pen_up/down) (ticks).
-    sp_theta1_queue = task_share.Queue('i', 2000)
-    sp_theta2_queue = task_share.Queue('i', 2000)
-    sp_pen_queue = task_share.Queue('i', 2000)
+    # Create a Queue with set points (theta_1, theta_2, Pen_up/down) (ticks).
+    sp_queue = task_share.DeltaQueue(QUEUE_SIZE,
+                                     flag_bits=task_parser.FLAG_BITS,
+                                     name="Set Points")
+    
+    # Create the HPGL parser which streams the selected HPGL file into the
+    # queue while plotting. A plot file compiled on a computer with
+    # plot_compiler.py can be loaded in place of the HPGL file; the compiler's
+    # defaults give the same set points as these settings. Strokes which
+    # Inkscape draws twice are drawn once.
+    parser = task_parser.Parser(sp_queue, watermark=QUEUE_WATERMARK,
+                                interp_fun=task_parser.adaptive_linterp2,
+                                tolerance=task_parser.SIMPLIFY_TOLERANCE,
+                                dedupe=task_parser.DUPLICATE_TOLERANCE)
+    parser.load('WE_ARE_AWESOME.hpgl')
     
-    # Create the HPGL parser.
-    parser = task_parser.Parser(sp_theta1_queue, sp_theta2_queue, sp_pen_queue)
+    # Create the motion planner which moves the controller's set point
+    # smoothly through the queued set points
+    motion_planner = planner.Planner(sp_queue, (TICKS_MAX, TICKS_MAX),
+                                     hold_corners=HOLD_CORNERS)
     
     # Instantiate encoders with default pins and timer.
     encoder1 = encoder.EncoderDriver(pyb.Pin.cpu.B6, pyb.Pin.cpu.B7, 4)
@@ -199,6 +336,9 @@ if __name__ == "__main__":
     servo1 = servo.Servo(pin1 = pyb.Pin.board.PA9,
                          timer = pyb.Timer(1, freq=50), channel = 2)
     
+    # Latencies of the pen, as measured on the plotter
+    pen_timing = servo.PenTiming(servo.PEN_UP_MS, servo.PEN_DOWN_MS)
+    
     # Instantiate motors with default pins and timer
     motor1 = motor.MotorDriver(pyb.Pin.board.PC1, pyb.Pin.board.PA0,
                                pyb.Pin.board.PA1, pyb.Timer(5, freq=20000))
@@ -207,40 +347,71 @@ if __name__ == "__main__":
     
     # Instantiate proportional controller with initial gains and setpoint
     pidController = controller.PIDController(1, 0, 0, (TICKS_MAX, TICKS_MAX),
-                                             encoder1_share, encoder2_share)
+                                             encoder1_share, encoder2_share,
+                                             period=CONTROLLER_PERIOD)
     pidController.set_gains(_KP, _KI, _KD)
+    pidController.set_contour_gain(_KC)
+    
+    # Add the feedforward found by calibration.py, if it has been run
+    try:
+        for motor_id, coefficients in enumerate(
+                calibration.load_feedforward()):
+            pidController.set_feedforward(motor_id, *coefficients)
+    except OSError:
+        print('no feedforward calibration, using feedback only')
+    
+    # Schedule the gains over the drawing area, if a schedule has been made
+    try:
+        pidController.set_schedule(controller.load_schedule((_KP, _KI, _KD)))
+    except OSError:
+        print('no gain schedule, using the same gains everywhere')
 
-    # Create the tasks. If trace is enabled for any task, memory will be
-    # allocated for state transition tracing, and the application will run out
-    # of memory after a while and quit. Therefore, use tracing only for 
-    # debugging and set trace to False when it's not needed.
+    # Create the tasks. If trace is enabled for any task, a ring buffer of the
+    # latest cotask.TRACE_SIZE state transitions is allocated for it once, so
+    # tracing uses the same memory however long a plot runs and can be left
+    # on. Tasks which yield () have no states to trace.
     task_encoder1 = cotask.Task(task_enc1_fun, name='Encoder_1_Task',
-        priority=3, period=10, profile=True, trace=False)
+        priority=3, period=10, profile=True, trace=False, wcet=ENCODER_WCET)
     task_encoder2 = cotask.Task(task_enc2_fun, name = 'Encoder_2_Task',
-        priority=3, period=10, profile=True, trace=False)
+        priority=3, period=10, profile=True, trace=False, wcet=ENCODER_WCET)
     task_controller = cotask.Task(task_controller_fun, name='Controller_Task',
-        priority=1, period=10, profile=True, trace=False)
+        priority=1, period=CONTROLLER_PERIOD, profile=True, trace=False,
+        deadline=CONTROLLER_PERIOD, wcet=CONTROLLER_WCET)
+    task_parser1 = cotask.Task(parser.run, name='Parser_Task',
+        priority=0, period=10, profile=True, trace=False, wcet=PARSER_WCET)
     
     cotask.task_list.append(task_encoder1)
     cotask.task_list.append(task_encoder2)
     cotask.task_list.append(task_controller)
+    cotask.task_list.append(task_parser1)
 
-    # Run the memory garbage collector to ensure memory is as defragmented as
-    # possible before the real-time scheduler is started
-    gc.collect()
+    # Don't start unless every task, above all the controller, can meet its
+    # deadlines with the run times it was given
+    cotask.task_list.policy = cotask.EDF
+    plotting = cotask.task_list.admit()
+    if not plotting:
+        servo1.set_angle(UP)
+        print('tasks may miss their deadlines, not plotting')
+    else:
+        # Run the memory garbage collector to ensure memory is as
+        # defragmented as possible before the real-time scheduler is started
+        gc.collect()
 
-    # Run the startup routine to home the encoders 
-    startup()
-    # parse the selected HPGL file
-    parser.read('WE_ARE_AWESOME.hpgl')
+        # Run the startup routine to home the encoders 
+        startup()
     
-    # Run the scheduler with the chosen scheduling algorithm.
-    # Quit if KeyboardInterrupt.
-    while True:
+    # Run the scheduler with the chosen scheduling algorithm, sleeping
+    # between tasks. Quit if KeyboardInterrupt, with the pen raised.
+    while plotting:
         try:
-            cotask.task_list.pri_sched()
+            cotask.task_list.tickless_sched()
         except KeyboardInterrupt:
             motor1.set_duty_cycle(0)
             motor2.set_duty_cycle(0)
+            servo1.set_angle(UP)
             print('disabled')
-            break
\ No newline at end of file
+            break
+    
+    # Print the run times of each task, to measure the controller step, and
+    # how busy the CPU was
+    print(cotask.task_list)
\ No newline at end of file
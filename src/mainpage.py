@@ -34,8 +34,11 @@
     @subsection subsec_sch2 task_parser
                             Parses the HPGL file for a given image outputting the required pen locations in ticks and
                             pen states to construct the drawing. These include "pen advance" and lifting the pen
-                            off of the paper when not plotting. Parser task doesn't require a finite state machine
-                            since it's only purpose is to read the HPGL data and doesn't transition to any other state.
+                            off of the paper when not plotting. The parser runs as the lowest priority task and reads
+                            the HPGL file a piece at a time, keeping the set point queue topped up while the plotter
+                            draws so drawings of any size fit in memory. Parser task doesn't require a finite state
+                            machine since it's only purpose is to read the HPGL data and doesn't transition to any
+                            other state.
                             However, the kinematic equations used in the derivation of the transition are further
                             explained in the @ref page_kinetics page.
                             
@@ -46,9 +49,11 @@
                             
     @subsection subsec_sch4 task_controller
                             Controls the motor duty cycle and servo position based on set points stored in the  
-                            set point queues. The controller task has two states: Motor and Servo. When a new set
-                            point is loaded, the pen condition is checked, and corrected, before transitioning
-                            back to the motor state until the next desired position is reached. The controller
+                            set point queue. The controller task has two states: Motor and Servo. In the motor
+                            state a motion planner looks ahead at the queued set points and moves the controller's
+                            set point smoothly through them, slowing down only for corners, so the pen doesn't stop
+                            at every set point. When the pen needs to move, the planner stops, the motors settle and
+                            the pen condition is corrected before transitioning back to the motor state. The controller
                             driver uses PID closed loop control to set the motor duty cycle and move the pen
                             to the desired location. 
                             
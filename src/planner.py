@@ -0,0 +1,401 @@
+'''!@file planner.py
+    A motion planner which moves the controller's set point smoothly along
+    the set points from the parser.
+
+    Without it, the controller steps to each set point and waits for both
+    motors to settle before taking the next, so every interpolated point is
+    a stop. The planner looks ahead at the next @c LOOKAHEAD set points and
+    gives each move a trapezoidal speed profile: speeding up at
+    @c MAX_ACCEL to @c MAX_SPEED and slowing down in time to pass through
+    the corner at the end of the move no faster than the corner allows. The
+    controller follows the point moving along the profile.
+
+    Corner speeds are limited as in GRBL by junction deviation: the speed
+    at which the pen could round a circular arc, @c JUNCTION_DEVIATION from
+    the corner, tangent to both moves, at @c MAX_ACCEL. Nearly straight
+    corners are taken at full speed and reversals stop. The pen also stops
+    wherever it is raised or lowered and at the last set point it has seen,
+    so the set points can come in while plotting. Unless @c HOLD_CORNERS is
+    turned off, at set points of the tolerance class
+    @c task_parser.TOL_CORNER the planner stops and holds until it is
+    released, so the controller can let the motors settle there.
+
+    Speeds are planned in belt lengths, the space the motors move in, which
+    is close to the pen's motion on the page over the length of a move.
+
+    @author     Tori Bornino
+    @author     Jackson McLaughlin
+    @author     Zach Stednitz
+    @date       March 15, 2022
+'''
+
+import array
+import math
+
+import task_parser
+
+## @brief   Number of set points the planner looks ahead.
+#  @details The pen has to be able to stop within the set points it has
+#           seen, so more set points allow faster moves through short ones.
+LOOKAHEAD = 16
+
+## @brief   Fastest speed of either belt (mm/s).
+MAX_SPEED = 20
+
+## @brief   Acceleration of the belts when speeding up or slowing down
+#           (mm/s^2).
+MAX_ACCEL = 200
+
+## @brief   How far the pen may cut a corner at full speed (mm).
+#  @details Larger values take corners faster but rounder.
+JUNCTION_DEVIATION = 0.05
+
+## @brief   Whether the planner stops and holds at corners by default.
+#  @details Stopping at corners adds about 3 s of motion to a typical job,
+#           plus the time the motors take to settle.
+HOLD_CORNERS = True
+
+class Planner:
+    '''!
+    This class moves a set point along the set points in a set point queue
+    with trapezoidal speed profiles.
+
+    Each run of the controller task calls @c advance() with the time since
+    its last run and then gives the controller (@c th1, @c th2). When the
+    next set point needs the pen moved, the planner stops at the set point
+    before it and @c next_pen() returns the new pen state; the pen is
+    changed and @c set_pen() lets the planner carry on. @c time_to_pen()
+    and @c lag() tell when the pen can be moved before the planner stops,
+    from the set point and from the measured motor angles. While the planner
+    holds at a corner, @c hold() returns its tolerance class until
+    @c release() is called.
+    '''
+
+    def __init__(self, sp_queue, start, lookahead=LOOKAHEAD,
+                 speed=MAX_SPEED, accel=MAX_ACCEL,
+                 deviation=JUNCTION_DEVIATION, hold_corners=HOLD_CORNERS):
+        '''!
+        Creates a planner which starts at rest with the pen up.
+
+        @param sp_queue     A @c task_share.RecordQueue or
+                            @c task_share.DeltaQueue of set points
+                            (theta_1, theta_2, flags), with flags as from
+                            @c task_parser.classify().
+        @param start        The starting motor angles (theta_1, theta_2)
+                            (ticks).
+        @param lookahead    The number of set points to look ahead.
+        @param speed        The fastest speed of either belt (mm/s).
+        @param accel        The acceleration of the belts (mm/s^2).
+        @param deviation    How far the pen may cut a corner (mm).
+        @param hold_corners @c True to stop and hold at set points of the
+                            tolerance class @c task_parser.TOL_CORNER, or
+                            @c False to take them like any other.
+        '''
+        self._queue = sp_queue
+        self._speed = speed * task_parser.TICKS_PER_MM
+        self._accel = accel * task_parser.TICKS_PER_MM
+        self._deviation = deviation * task_parser.TICKS_PER_MM
+        self._hold_corners = hold_corners
+
+        # Ring buffer of the set points looked ahead at
+        self._th1 = array.array('i', [0] * lookahead)
+        self._th2 = array.array('i', [0] * lookahead)
+        self._pen = bytearray(lookahead)
+        self._tolerance = bytearray(lookahead)
+        self._first = 0
+        self._count = 0
+
+        # The move being made: start, direction, length and profile
+        self._x = start[0]
+        self._y = start[1]
+        self._ux = 0.0
+        self._uy = 0.0
+        self._length = 0.0
+        self._moving = False
+        self._time = 0.0
+        self._v_entry = 0.0
+        self._v_peak = 0.0
+        self._t_accel = 0.0
+        self._t_cruise = 0.0
+        self._t_decel = 0.0
+        self._v_exit = 0.0
+        self._pen_state = task_parser._UP
+        self._hold = None
+        self._reached = task_parser.TOL_TRAVEL
+
+        ## @brief The set point motor angle theta_1 to follow (ticks).
+        self.th1 = start[0]
+        ## @brief The set point motor angle theta_2 to follow (ticks).
+        self.th2 = start[1]
+        ## @brief Total time of the planned moves (s).
+        self.planned = 0.0
+
+    def advance(self, dt):
+        '''!
+        Moves the set point along the planned moves.
+
+        @param dt The time since the last call (s).
+        '''
+        self._fill()
+        self._time += dt
+        while True:
+            if not self._moving:
+                if not self._start_move():
+                    self._time = 0.0
+                    return
+            duration = self._t_accel + self._t_cruise + self._t_decel
+            if self._time < duration:
+                break
+            # Move on to the next move with the time left over, unless the
+            # move ends at a corner to hold at
+            self._time -= duration
+            self._x = self.th1 = self._th1[self._first]
+            self._y = self.th2 = self._th2[self._first]
+            tolerance = self._tolerance[self._first]
+            self._reached = tolerance
+            self._first = (self._first + 1) % len(self._pen)
+            self._count -= 1
+            self._moving = False
+            self._fill()
+            if self._hold_corners and tolerance == task_parser.TOL_CORNER:
+                self._hold = tolerance
+                self._time = 0.0
+                return
+
+        distance = self._distance(self._time)
+        self.th1 = self._x + int(self._ux * distance)
+        self.th2 = self._y + int(self._uy * distance)
+
+    def next_pen(self):
+        '''!
+        Checks if the planner is stopped for the pen to be moved.
+
+        @return The pen state needed for the next set point, or @c None if
+                the pen doesn't need to move.
+        '''
+        if self._moving or self._count == 0 or self._hold != None \
+            or self._pen[self._first] == self._pen_state:
+            return None
+        return self._pen[self._first]
+        
+    def hold(self):
+        '''!
+        Checks if the planner is holding at a set point for the motors to
+        settle.
+        
+        @return The tolerance class of the set point, or @c None if the
+                planner isn't holding.
+        '''
+        return self._hold
+        
+    def release(self):
+        '''!
+        Lets the planner carry on from the set point it is holding at.
+        '''
+        self._hold = None
+        
+    def reached(self):
+        '''!
+        Finds the tolerance class of the set point the planner last reached,
+        where it stops when it holds or waits for the pen.
+        
+        @return The tolerance class.
+        '''
+        return self._reached
+
+    def time_to_pen(self):
+        '''!
+        Checks if the planner will stop for the pen to be moved at the end
+        of the move being made.
+        
+        @return A tuple (time, pen) of the time left in the move (s) and the
+                pen state needed after it, or @c None if the pen doesn't
+                need to move then.
+        '''
+        if not self._moving or self._count < 2:
+            return None
+        pen = self._pen[(self._first + 1) % len(self._pen)]
+        if pen == self._pen_state:
+            return None
+        return (self._t_accel + self._t_cruise + self._t_decel - self._time,
+                pen)
+
+    def lag(self, th1, th2):
+        '''!
+        Measures how far the motors are behind the set point on the move
+        being made.
+        
+        @param th1 The measured motor angle theta_1 (ticks).
+        @param th2 The measured motor angle theta_2 (ticks).
+        @return How much further (ticks) either motor is from the end of the
+                move than the set point is, or @c None if no move is being
+                made.
+        '''
+        if not self._moving:
+            return None
+        end1 = self._th1[self._first]
+        end2 = self._th2[self._first]
+        return max(abs(th1 - end1) - abs(self.th1 - end1),
+                   abs(th2 - end2) - abs(self.th2 - end2))
+
+    def set_pen(self, pen):
+        '''!
+        Tells the planner the pen has been moved.
+
+        @param pen The pen state.
+        '''
+        self._pen_state = pen
+
+    def idle(self):
+        '''!
+        Checks if the planner has reached the last set point it has.
+
+        @return @c True if there is nothing left to move to.
+        '''
+        return not self._moving and self._count == 0
+
+    def _fill(self):
+        '''!
+        Takes set points from the queue while there is room to look ahead.
+
+        Repeated set points are left out, since there is nothing to move.
+        '''
+        size = len(self._pen)
+        while self._count < size and self._queue.any():
+            th1, th2, flags = self._queue.get_record()
+            pen = flags & 1
+            if self._count > 0:
+                last = (self._first + self._count - 1) % size
+                same = th1 == self._th1[last] and th2 == self._th2[last] \
+                    and pen == self._pen[last]
+                if same:
+                    self._tolerance[last] = max(self._tolerance[last],
+                                                flags >> 1)
+            else:
+                same = not self._moving and th1 == self._x \
+                    and th2 == self._y and pen == self._pen_state
+            if not same:
+                i = (self._first + self._count) % size
+                self._th1[i] = th1
+                self._th2[i] = th2
+                self._pen[i] = pen
+                self._tolerance[i] = flags >> 1
+                self._count += 1
+
+    def _start_move(self):
+        '''!
+        Plans the move to the next set point, if the pen is ready for it.
+
+        The move ends no faster than the pen could stop at the end of the
+        set points looked ahead at, and than the corner at its end allows.
+
+        @return @c True if a move was started.
+        '''
+        if self._count == 0 or self._hold != None \
+            or self._pen[self._first] != self._pen_state:
+            return False
+
+        size = len(self._pen)
+        max2 = self._speed**2
+        # Work back from the last set point, where the pen must stop, to
+        # find how fast each set point can be passed
+        v2 = 0.0
+        next_ux = 0.0
+        next_uy = 0.0
+        for k in range(self._count - 1, -1, -1):
+            i = (self._first + k) % size
+            if k > 0:
+                j = (self._first + k - 1) % size
+                dx = self._th1[i] - self._th1[j]
+                dy = self._th2[i] - self._th2[j]
+            else:
+                dx = self._th1[i] - self._x
+                dy = self._th2[i] - self._y
+            length = math.sqrt(dx*dx + dy*dy)
+            ux = dx / length if length > 0 else 0.0
+            uy = dy / length if length > 0 else 0.0
+            if k < self._count - 1:
+                if self._pen[i] != self._pen[(i + 1) % size] \
+                    or (self._hold_corners
+                        and self._tolerance[i] == task_parser.TOL_CORNER):
+                    v2 = 0.0
+                else:
+                    v2 = min(v2, self._junction2(ux, uy, next_ux, next_uy))
+            if k == 0:
+                break
+            v2 = min(v2 + 2*self._accel*length, max2)
+            next_ux = ux
+            next_uy = uy
+
+        self._ux = ux
+        self._uy = uy
+        self._length = length
+        self._v_entry = self._v_exit
+        self._v_exit = math.sqrt(min(v2, self._v_entry**2
+                                     + 2*self._accel*length))
+        self._profile()
+        self._moving = True
+        self.planned += self._t_accel + self._t_cruise + self._t_decel
+        return True
+
+    def _junction2(self, ux, uy, next_ux, next_uy):
+        '''!
+        Finds the fastest speed to turn from one move to the next.
+
+        @param ux       The x part of the direction of the first move.
+        @param uy       The y part of the direction of the first move.
+        @param next_ux  The x part of the direction of the next move.
+        @param next_uy  The y part of the direction of the next move.
+        @return The square of the speed (ticks/s)^2.
+        '''
+        if (ux == 0 and uy == 0) or (next_ux == 0 and next_uy == 0):
+            return 0.0
+        # Cosine of the angle between the moves, 1 for a reversal
+        cos_theta = -(ux*next_ux + uy*next_uy)
+        if cos_theta > 0.999999:
+            return 0.0
+        if cos_theta < -0.999999:
+            return self._speed**2
+        sin_half = math.sqrt(0.5*(1 - cos_theta))
+        return self._accel * self._deviation * sin_half / (1 - sin_half)
+
+    def _profile(self):
+        '''!
+        Computes the trapezoidal speed profile of the move being made.
+
+        The profile speeds up from the entry speed, cruises and slows down
+        to the exit speed. If the move is too short to reach full speed it
+        is a triangle instead.
+        '''
+        a = self._accel
+        v0 = self._v_entry
+        v1 = self._v_exit
+        peak2 = (2*a*self._length + v0**2 + v1**2) / 2
+        vp = math.sqrt(max(min(peak2, self._speed**2), v0**2, v1**2))
+        d_accel = (vp**2 - v0**2) / (2*a)
+        d_decel = (vp**2 - v1**2) / (2*a)
+        cruise = max(self._length - d_accel - d_decel, 0.0)
+        self._v_peak = vp
+        self._t_accel = (vp - v0) / a
+        self._t_cruise = cruise / vp if vp > 0 else 0.0
+        self._t_decel = (vp - v1) / a
+
+    def _distance(self, t):
+        '''!
+        Finds how far along the move the set point is.
+
+        @param t The time since the move started (s).
+        @return The distance along the move (ticks).
+        '''
+        a = self._accel
+        v0 = self._v_entry
+        vp = self._v_peak
+        if t < self._t_accel:
+            return v0*t + a*t*t/2
+        d_accel = (v0 + vp) / 2 * self._t_accel
+        t -= self._t_accel
+        if t < self._t_cruise:
+            return d_accel + vp*t
+        t -= self._t_cruise
+        return min(d_accel + vp*self._t_cruise + vp*t - a*t*t/2,
+                   self._length)
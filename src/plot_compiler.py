@@ -0,0 +1,791 @@
+"""!
+@file plot_compiler.py
+    This file contains a program that compiles HPGL files into plot files on a
+    computer, so the pen plotter can read its set points without parsing the
+    HPGL or doing any floating point math.
+
+    The set points are computed by @c task_parser with single precision
+    arithmetic, which is what MicroPython uses on the Nucleo, so the ticks
+    in the plot file are the same as the ones the plotter computes itself.
+    The compiler runs with regular Python:
+    @code
+    python plot_compiler.py WE_ARE_AWESOME.hpgl -o WE_ARE_AWESOME.plt
+    @endcode
+    The plot file is then copied to the Nucleo and loaded by the parser in
+    place of the HPGL file. By default repeated strokes are dropped, strokes
+    are simplified by @c task_parser.SIMPLIFY_TOLERANCE and lines split
+    adaptively, as
+    @c main.py parses HPGL files, so the plot file gives the same set points.
+
+    With @c --numpy, strokes are simplified and whole polylines are
+    interpolated and transformed as NumPy arrays instead of one point at a
+    time. Against the parser's own double precision path with the default
+    settings, that is 1.3 to 4.4 times faster for one of the files in
+    @c hpgl, 7 times for all seven at once and 12 times for a batch of 350,
+    or about 30 times with @c --fixed, @c --no-simplify and @c --no-dedupe;
+    NumPy's overhead per call is most of the time for small files.
+    @c --check compares the result with the scalar compiler and @c --bench
+    times both. @c --simplify sets how far strokes are simplified and
+    reports how many set points that saved; @c --no-simplify keeps every
+    point. @c --dedupe sets the distance within which repeated strokes are
+    dropped and @c --no-dedupe keeps them. @c --fixed splits lines every
+    @c MAX_LENGTH instead.
+
+@author             Tori Bornino
+@author             Jackson McLaughlin
+@author             Zach Stednitz
+@date               March 15, 2022
+
+"""
+import argparse
+import array
+import math
+import struct
+import time
+
+import task_parser
+from task_parser import float32
+
+# NumPy is only needed to compile with --numpy
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def transform_f32(x, y):
+    '''!
+    Calculates the two motor angles the way @c task_parser.transform() does
+    on the Nucleo.
+
+    Every operation is rounded to single precision, in the same order as
+    MicroPython evaluates @c task_parser.transform(). The coordinates are
+    rounded first since the parser divides plotter units by @c DPMM in
+    double precision on a computer.
+
+    @param x the x coordinate (mm)
+    @param y the y coordinate (mm)
+    @return the motor angles (r_1, r_2) in (ticks)
+    '''
+    y_sum = float32(float32(task_parser.Y_HOME) + float32(y))
+    x_sum = float32(float32(task_parser.X_HOME) + float32(x))
+    y_sq = float32(y_sum * y_sum)
+
+    r_2 = float32(math.sqrt(float32(y_sq + float32(x_sum * x_sum))))
+    x_diff = float32(task_parser.R - x_sum)
+    r_1 = float32(math.sqrt(float32(y_sq + float32(x_diff * x_diff))))
+
+    th1 = int(float32(task_parser.TICKS_PER_MM * r_1))
+    th2 = int(float32(task_parser.TICKS_PER_MM * r_2))
+
+    return(th1, th2)
+
+
+def linterp2_f32(x1, y1, x2, y2):
+    '''!
+    Divides a line into smaller segments the way @c task_parser.linterp2()
+    does on the Nucleo.
+
+    @param x1 The starting x value of the line
+    @param y1 The starting y value of the line
+    @param x2 The ending x value of the line
+    @param y2 The ending y value of the line
+    @return the list of interpolated points (x,y) defining the smaller segments
+    '''
+    x1 = float32(x1)
+    y1 = float32(y1)
+    x2 = float32(x2)
+    y2 = float32(y2)
+    dx = float32(x2 - x1)
+    dy = float32(y2 - y1)
+    dmax = max(abs(dx), abs(dy))
+    n = math.ceil(float32(dmax / task_parser.MAX_LENGTH))
+    if n == 0:
+        return [(x1, y1)]
+    points = []
+    for i in range(n + 1):
+        x = float32(x1 + float32(float32(dx / n) * i))
+        y = float32(y1 + float32(float32(dy / n) * i))
+        points.append((x, y))
+
+    return points
+
+
+def adaptive_linterp2_f32(x1, y1, x2, y2,
+                          tolerance=task_parser.INTERP_TOLERANCE):
+    '''!
+    Divides a line into segments only where the pen would stray from it, the
+    way @c task_parser.adaptive_linterp2() does on the Nucleo.
+
+    @param x1 The starting x value of the line
+    @param y1 The starting y value of the line
+    @param x2 The ending x value of the line
+    @param y2 The ending y value of the line
+    @param tolerance How far (mm) the pen may stray from the line
+    @return the list of interpolated points (x,y) defining the smaller segments
+    '''
+    x1 = float32(x1)
+    y1 = float32(y1)
+    x2 = float32(x2)
+    y2 = float32(y2)
+    tolerance = float32(tolerance)
+    dx = float32(x2 - x1)
+    dy = float32(y2 - y1)
+    length = float32(math.sqrt(float32(float32(dx * dx) + float32(dy * dy))))
+    if length == 0:
+        return [(x1, y1)]
+
+    points = [(x1, y1)]
+    ra = _radii_f32(x1, y1)
+    limit = float32(tolerance * length)
+    stack = [1.0]
+    ta = 0.0
+    while stack:
+        tb = stack[-1]
+        x = float32(x1 + float32(dx * tb))
+        y = float32(y1 + float32(dy * tb))
+        rb = _radii_f32(x, y)
+        if float32(float32(tb - ta) * length) > tolerance \
+            and _strays_f32(x1, y1, dx, dy, ra, rb, limit):
+            stack.append(float32(float32(ta + tb) / 2))
+        else:
+            points.append((x, y))
+            ta = stack.pop()
+            ra = rb
+
+    return points
+
+
+def _radii_f32(x, y):
+    '''!
+    Calculates the distances from both motors to a point the way
+    @c task_parser._radii() does on the Nucleo.
+
+    @param x the x coordinate (mm)
+    @param y the y coordinate (mm)
+    @return the distances (r_1, r_2) in (mm)
+    '''
+    y_sum = float32(float32(task_parser.Y_HOME) + y)
+    x_sum = float32(float32(task_parser.X_HOME) + x)
+    y_sq = float32(y_sum * y_sum)
+    x_diff = float32(task_parser.R - x_sum)
+    return (float32(math.sqrt(float32(y_sq + float32(x_diff * x_diff)))),
+            float32(math.sqrt(float32(y_sq + float32(x_sum * x_sum)))))
+
+
+def _strays_f32(x1, y1, dx, dy, ra, rb, limit):
+    '''!
+    Checks whether moving straight in ticks between two points on a line
+    strays too far from the line, the way @c task_parser._strays() does on
+    the Nucleo.
+
+    @param x1       The starting x value of the line
+    @param y1       The starting y value of the line
+    @param dx       The change in x along the line
+    @param dy       The change in y along the line
+    @param ra       The distances (r_1, r_2) of the first point (mm)
+    @param rb       The distances (r_1, r_2) of the second point (mm)
+    @param limit    The largest distance allowed, times the line length
+    @return True if the quarter, half or three quarter point strays too far.
+    '''
+    for s in (0.25, 0.5, 0.75):
+        r_1 = float32(ra[0] + float32(float32(rb[0] - ra[0]) * s))
+        r_2 = float32(ra[1] + float32(float32(rb[1] - ra[1]) * s))
+        # The inverse transform, as task_parser.inverse_transform()
+        r_2_sq = float32(r_2 * r_2)
+        x = float32(float32(float32(r_2_sq - float32(r_1 * r_1))
+                            + task_parser.R**2) / (2*task_parser.R))
+        y = float32(math.sqrt(max(float32(r_2_sq - float32(x * x)), 0)))
+        x = float32(x - float32(task_parser.X_HOME))
+        y = float32(y - float32(task_parser.Y_HOME))
+        if abs(float32(float32(dx * float32(y - y1))
+                       - float32(dy * float32(x - x1)))) > limit:
+            return True
+    return False
+
+
+def compile_setpoints(hpgl_file, tolerance=task_parser.SIMPLIFY_TOLERANCE,
+                      adaptive=True, dedupe=task_parser.DUPLICATE_TOLERANCE):
+    '''!
+    Computes the set points of an hpgl file as the Nucleo would.
+
+    The defaults are the settings @c main.py parses with.
+
+    @param hpgl_file the name of the hpgl file to compile.
+    @param tolerance How far (mm) strokes may be simplified, or @c None.
+    @param adaptive  @c True to split lines by @c adaptive_linterp2_f32(),
+                     or @c False to split them every @c MAX_LENGTH by
+                     @c linterp2_f32().
+    @param dedupe    The distance (mm) within which a stroke repeats an
+                     earlier one and is dropped, or @c None.
+    @return An array of set points, three ints (theta_1, theta_2, pen) each.
+    '''
+    interp_fun = adaptive_linterp2_f32 if adaptive else linterp2_f32
+    parser = task_parser.Parser(None, transform_fun=transform_f32,
+                                interp_fun=interp_fun, tolerance=tolerance,
+                                dedupe=dedupe)
+    setpoints = array.array('i')
+    for th1, th2, pen in parser.setpoints(hpgl_file):
+        setpoints.extend((th1, th2, pen))
+    return setpoints
+
+
+def compile_setpoints_numpy(hpgl_file,
+                            tolerance=task_parser.SIMPLIFY_TOLERANCE,
+                            adaptive=True,
+                            dedupe=task_parser.DUPLICATE_TOLERANCE):
+    '''!
+    Computes the set points of an hpgl file as the Nucleo would, using NumPy.
+    
+    @param hpgl_file the name of the hpgl file to compile.
+    @param tolerance How far (mm) strokes may be simplified, or @c None.
+    @param adaptive  @c True to split lines as @c adaptive_linterp2_f32()
+                     does, or @c False to split them every @c MAX_LENGTH.
+    @param dedupe    The distance (mm) within which a stroke repeats an
+                     earlier one and is dropped, or @c None.
+    @return An array of set points, three ints (theta_1, theta_2, pen) each.
+    '''
+    return compile_batch_numpy([hpgl_file], tolerance, adaptive, dedupe)[0]
+
+
+def compile_batch_numpy(hpgl_files, tolerance=task_parser.SIMPLIFY_TOLERANCE,
+                        adaptive=True, dedupe=task_parser.DUPLICATE_TOLERANCE):
+    '''!
+    Computes the set points of several hpgl files as the Nucleo would, using
+    NumPy.
+    
+    Repeated strokes are dropped as by @c task_parser._deduplicated() and
+    the strokes are simplified as by @c task_parser._simplified(), and each
+    PD segment is split into the same points as by
+    @c adaptive_linterp2_f32() or @c linterp2_f32() and transformed as by
+    @c transform_f32(), but for all segments of all the files at once with
+    single precision arrays.
+    
+    @param hpgl_files a list of names of the hpgl files to compile.
+    @param tolerance How far (mm) strokes may be simplified, or @c None.
+    @param adaptive  @c True to split lines as @c adaptive_linterp2_f32()
+                     does, or @c False to split them every @c MAX_LENGTH.
+    @param dedupe    The distance (mm) within which a stroke repeats an
+                     earlier one and is dropped, or @c None.
+    @return A list with an array of set points for each file, three ints
+            (theta_1, theta_2, pen) each.
+    '''
+    if numpy == None:
+        raise ImportError("compiling with numpy needs the numpy package")
+    f32 = numpy.float32
+    
+    # Coordinates (x, y) of every PU and PD pair, in file order
+    coords = []
+    pens = []
+    for hpgl_file in hpgl_files:
+        file_coords, file_pens = _hpgl_coords(hpgl_file)
+        if dedupe != None:
+            file_coords, file_pens = _deduplicated_numpy(file_coords,
+                                                         file_pens, dedupe)
+        coords.append(file_coords)
+        pens.append(file_pens)
+    if tolerance != None:
+        coords, pens = _simplified_numpy(coords, pens, tolerance)
+    pairs = [len(file_pens) for file_pens in pens]
+    coords = numpy.concatenate(coords).reshape(-1, 2).astype(f32) \
+        / f32(task_parser.DPMM)
+    pens = numpy.concatenate(pens)
+    
+    # Each PD point is the end of a line from the previous point, which is
+    # split into pieces. PU points are kept as they are.
+    start = numpy.empty_like(coords)
+    start[:1] = coords[:1]
+    start[1:] = coords[:-1]
+    start[pens == task_parser._UP] = coords[pens == task_parser._UP]
+    delta = coords - start
+    if adaptive:
+        # Each point is the fraction i of the way along its line
+        counts, i = _adaptive_fractions(start, delta,
+                                        pens == task_parser._DOWN)
+        step = delta
+    else:
+        # Each point is i of the line's n equal steps along it
+        n = numpy.ceil(numpy.maximum(numpy.abs(delta[:, 0]),
+                                     numpy.abs(delta[:, 1]))
+                       / f32(task_parser.MAX_LENGTH)).astype(numpy.int64)
+        counts = numpy.where(n == 0, 1, n + 1)
+        step = delta / numpy.maximum(n, 1).astype(f32)[:, None]
+        first = numpy.cumsum(counts) - counts
+        i = (numpy.arange(counts.sum()) - numpy.repeat(first, counts)) \
+            .astype(f32)
+    
+    # Repeating each line's values is much faster than indexing them by line
+    points = numpy.repeat(start, counts, axis=0) \
+        + numpy.repeat(step, counts, axis=0) * i[:, None]
+    r_1, r_2 = _radii_numpy(points)
+    
+    setpoints = numpy.empty((len(i), 3), dtype=numpy.int32)
+    setpoints[:, 0] = f32(task_parser.TICKS_PER_MM) * r_1
+    setpoints[:, 1] = f32(task_parser.TICKS_PER_MM) * r_2
+    setpoints[:, 2] = numpy.repeat(pens, counts)
+    
+    # Split the set points up by file and add the final home move to each
+    line_ends = numpy.concatenate(([0], numpy.cumsum(counts)))
+    ends = line_ends[numpy.cumsum(pairs)]
+    home = array.array('i', (task_parser.HOME, task_parser.HOME,
+                             task_parser._UP))
+    return [array.array('i', part.tobytes()) + home
+            for part in numpy.split(setpoints, ends[:-1])]
+
+
+def _deduplicated_numpy(coords, pens, tolerance):
+    '''!
+    Drops strokes of an hpgl file which repeat an earlier stroke, as
+    @c task_parser._deduplicated() does.
+    
+    The sums of each stroke's coordinates are found for all the strokes at
+    once, then the strokes are checked in turn with a
+    @c task_parser.StrokeIndex.
+    
+    @param coords    An array of the coordinates (x0, y0, x1, y1, ...) in
+                     plotter units, as from @c _hpgl_coords().
+    @param pens      An array of the pen condition of each pair.
+    @param tolerance The distance within which a stroke repeats another
+                     (mm).
+    @return A tuple (coords, pens) of arrays of the points kept.
+    '''
+    # Each stroke is a run of PD points starting from the point before it,
+    # or from the origin
+    xy = numpy.concatenate(([[0, 0]], coords.reshape(-1, 2)))
+    down = numpy.concatenate(([False], pens == task_parser._DOWN))
+    edges = numpy.diff(numpy.concatenate(([0], down.view(numpy.int8), [0])))
+    first = numpy.flatnonzero(edges == 1)
+    end = numpy.flatnonzero(edges == -1)
+    if not len(first):
+        return coords, pens
+    cumulative = numpy.concatenate(([[0, 0]], numpy.cumsum(xy, axis=0)))
+    sums = cumulative[end] - cumulative[first - 1]
+    
+    index = task_parser.StrokeIndex(tolerance)
+    keep = numpy.ones(len(xy), dtype=bool)
+    for start, last, n, (sum_x, sum_y), (x0, y0), (x1, y1) in zip(
+            (first - 1).tolist(), (end - 1).tolist(),
+            (end - first + 1).tolist(), sums.tolist(),
+            xy[first - 1].tolist(), xy[end - 1].tolist()):
+        if n <= task_parser.DEDUPE_POINTS \
+            and index.seen(x0, y0, x1, y1, n, sum_x, sum_y):
+            keep[start + 1:last + 1] = False
+    keep = keep[1:]
+    return coords.reshape(-1, 2)[keep].ravel(), pens[keep]
+
+
+def _simplified_numpy(coords, pens, tolerance):
+    '''!
+    Removes points from the strokes of hpgl files as
+    @c task_parser._simplified() does, for all the strokes at once.
+    
+    The strokes are cut into the same pieces of @c SIMPLIFY_POINTS as the
+    parser buffers, each starting where the pen already is. Then every piece
+    of the Ramer-Douglas-Peucker search at the same depth is checked at
+    once, which keeps the same points since each piece is split the same
+    way whatever order the pieces are checked in.
+    
+    @param coords    A list of arrays of the coordinates (x0, y0, x1, y1, ...)
+                     of each file in plotter units, as from @c _hpgl_coords().
+    @param pens      A list of arrays of the pen condition of each pair.
+    @param tolerance How far (mm) the pen may stray from the hpgl path.
+    @return A tuple (coords, pens) of lists of the arrays of the points kept.
+    '''
+    # All the points in one array, each file starting where the parser does
+    # with a point at the origin which isn't kept
+    pairs = [len(file_pens) for file_pens in pens]
+    starts = numpy.cumsum([0] + [n + 1 for n in pairs])[:-1]
+    total = sum(pairs) + len(pairs)
+    xy = numpy.zeros((total, 2), dtype=numpy.int64)
+    down = numpy.zeros(total, dtype=bool)
+    for start, n, file_coords, file_pens in zip(starts, pairs, coords, pens):
+        xy[start + 1:start + 1 + n] = file_coords.reshape(-1, 2)
+        down[start + 1:start + 1 + n] = file_pens == task_parser._DOWN
+    
+    # Each run of PD points is cut into blocks of SIMPLIFY_POINTS - 1, and
+    # each block is a piece from the point before it to its last point
+    block = task_parser.SIMPLIFY_POINTS - 1
+    edges = numpy.diff(numpy.concatenate(([0], down.view(numpy.int8), [0])))
+    run_first = numpy.flatnonzero(edges == 1)
+    run_length = numpy.flatnonzero(edges == -1) - run_first
+    blocks = (run_length + block - 1) // block
+    offset = numpy.arange(blocks.sum()) \
+        - numpy.repeat(numpy.cumsum(blocks) - blocks, blocks)
+    first = numpy.repeat(run_first, blocks) + offset * block
+    last = numpy.minimum(first + block,
+                         numpy.repeat(run_first + run_length, blocks)) - 1
+    first -= 1
+    keep = ~down
+    keep[last] = True
+    
+    # The coordinates and their products are exact in double precision, so
+    # the distances are the same as the parser's
+    tol = tolerance * task_parser.DPMM
+    x = xy[:, 0].astype(float)
+    y = xy[:, 1].astype(float)
+    while True:
+        inner = last - first - 1
+        pieces = inner > 0
+        first = first[pieces]
+        last = last[pieces]
+        inner = inner[pieces]
+        if not len(first):
+            break
+        
+        # Distance from every point inside a piece to the piece's segment,
+        # as _rdp() finds it
+        piece_start = numpy.cumsum(inner) - inner
+        i = numpy.repeat(first + 1 - piece_start, inner) \
+            + numpy.arange(inner.sum())
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        length2 = dx * dx + dy * dy
+        px = x[i] - numpy.repeat(x[first], inner)
+        py = y[i] - numpy.repeat(y[first], inner)
+        dx = numpy.repeat(dx, inner)
+        dy = numpy.repeat(dy, inner)
+        dot = px * dx + py * dy
+        dist = numpy.abs(dx * py - dy * px)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            dist /= numpy.repeat(numpy.sqrt(length2), inner)
+        before = dot <= 0
+        px_b = px[before]
+        py_b = py[before]
+        dist[before] = numpy.sqrt(px_b * px_b + py_b * py_b)
+        after = ~before & (dot >= numpy.repeat(length2, inner))
+        qx = x[i[after]] - numpy.repeat(x[last], inner)[after]
+        qy = y[i[after]] - numpy.repeat(y[last], inner)[after]
+        dist[after] = numpy.sqrt(qx * qx + qy * qy)
+        
+        # Split each piece at its first furthest point if that is too far
+        worst = numpy.maximum.reduceat(dist, piece_start)
+        furthest = numpy.where(dist == numpy.repeat(worst, inner), i, total)
+        worst_i = numpy.minimum.reduceat(furthest, piece_start)
+        split = worst > tol
+        keep[worst_i[split]] = True
+        first, last = (numpy.concatenate((first[split], worst_i[split])),
+                       numpy.concatenate((worst_i[split], last[split])))
+    
+    kept_coords = []
+    kept_pens = []
+    for start, n in zip(starts, pairs):
+        kept = start + 1 + numpy.flatnonzero(keep[start + 1:start + 1 + n])
+        kept_coords.append(xy[kept].ravel())
+        kept_pens.append(numpy.where(down[kept], task_parser._DOWN,
+                                     task_parser._UP).astype(numpy.int32))
+    return kept_coords, kept_pens
+
+
+def _adaptive_fractions(start, delta, down,
+                        tolerance=task_parser.INTERP_TOLERANCE):
+    '''!
+    Finds where @c adaptive_linterp2_f32() splits each line, for all the
+    lines at once.
+    
+    The scalar version halves the pieces of one line depth first. Here every
+    piece of every line at the same depth is checked at once, which makes
+    the same decisions since each depends only on the piece's ends.
+    
+    @param start     An array of the start (x, y) of each line (mm).
+    @param delta     An array of the change (dx, dy) along each line (mm).
+    @param down      An array which is @c True for lines drawn with the pen
+                     down, which are split.
+    @param tolerance How far (mm) the pen may stray from a line.
+    @return A tuple (counts, fractions) of the number of points of each line
+            and an array of how far along its line each point is, in order.
+    '''
+    f32 = numpy.float32
+    tolerance = f32(tolerance)
+    length = numpy.sqrt(delta[:, 0] * delta[:, 0]
+                        + delta[:, 1] * delta[:, 1])
+    
+    # Every line starts with its first point. The pieces (ta, tb) still to
+    # check start as the whole of each line which isn't a repeated point.
+    lines = numpy.flatnonzero(down & (length != 0))
+    ta = numpy.zeros(len(lines), dtype=f32)
+    tb = numpy.ones(len(lines), dtype=f32)
+    point_lines = [numpy.arange(len(start))]
+    fractions = [numpy.zeros(len(start), dtype=f32)]
+    while len(lines):
+        x1 = start[lines]
+        dx = delta[lines]
+        ra = _radii_numpy(x1 + dx * ta[:, None])
+        rb = _radii_numpy(x1 + dx * tb[:, None])
+        split = ((tb - ta) * length[lines] > tolerance) \
+            & _strays_numpy(x1, dx, ra, rb, tolerance * length[lines])
+        
+        # Pieces which aren't split end at a point
+        point_lines.append(lines[~split])
+        fractions.append(tb[~split])
+        middle = (ta[split] + tb[split]) / f32(2)
+        lines = numpy.concatenate((lines[split], lines[split]))
+        ta, tb = (numpy.concatenate((ta[split], middle)),
+                  numpy.concatenate((middle, tb[split])))
+    
+    point_lines = numpy.concatenate(point_lines)
+    fractions = numpy.concatenate(fractions)
+    order = numpy.lexsort((fractions, point_lines))
+    return (numpy.bincount(point_lines, minlength=len(start)),
+            fractions[order])
+
+
+def _radii_numpy(points):
+    '''!
+    Calculates the distances from both motors to points as
+    @c _radii_f32() does.
+    
+    @param points An array of points (x, y) (mm).
+    @return A tuple (r_1, r_2) of arrays of the distances (mm).
+    '''
+    f32 = numpy.float32
+    x_sum = f32(task_parser.X_HOME) + points[:, 0]
+    y_sum = f32(task_parser.Y_HOME) + points[:, 1]
+    y_sq = y_sum * y_sum
+    x_diff = f32(task_parser.R) - x_sum
+    return (numpy.sqrt(y_sq + x_diff * x_diff),
+            numpy.sqrt(y_sq + x_sum * x_sum))
+
+
+def _strays_numpy(x1, dx, ra, rb, limit):
+    '''!
+    Checks which pieces of lines stray too far from their lines, as
+    @c _strays_f32() does.
+    
+    @param x1    An array of the start (x, y) of each line (mm).
+    @param dx    An array of the change (dx, dy) along each line (mm).
+    @param ra    A tuple (r_1, r_2) of arrays of the distances of the first
+                 point of each piece (mm).
+    @param rb    A tuple (r_1, r_2) of arrays of the distances of the second
+                 point of each piece (mm).
+    @param limit An array of the largest distance allowed, times the line
+                 length.
+    @return An array which is @c True for the pieces which stray too far.
+    '''
+    f32 = numpy.float32
+    strays = numpy.zeros(len(x1), dtype=bool)
+    for s in (0.25, 0.5, 0.75):
+        r_1 = ra[0] + (rb[0] - ra[0]) * f32(s)
+        r_2 = ra[1] + (rb[1] - ra[1]) * f32(s)
+        r_2_sq = r_2 * r_2
+        x = (r_2_sq - r_1 * r_1 + f32(task_parser.R**2)) \
+            / f32(2*task_parser.R)
+        y = numpy.sqrt(numpy.maximum(r_2_sq - x * x, f32(0)))
+        x = x - f32(task_parser.X_HOME)
+        y = y - f32(task_parser.Y_HOME)
+        strays |= numpy.abs(dx[:, 0] * (y - x1[:, 1])
+                            - dx[:, 1] * (x - x1[:, 0])) > limit
+    return strays
+
+
+def _hpgl_coords(hpgl_file):
+    '''!
+    Reads the PU and PD coordinates of an hpgl file.
+    
+    @param hpgl_file the name of the hpgl file to read.
+    @return A tuple (coords, pens) of NumPy arrays of the coordinates
+            (x0, y0, x1, y1, ...) in plotter units and of the pen condition
+            of each pair. Both are empty if the file moves the pen nowhere.
+    '''
+    with open(hpgl_file, 'rb') as raw_hpgl:
+        commands = raw_hpgl.read().split(b';')
+    
+    # Join the parameters of all PU and PD commands so they are converted
+    # to numbers in one call
+    params = []
+    pairs = []
+    pens = []
+    for ele in commands:
+        ele = ele.strip()
+        if ele[:2] == b'PU':
+            pen = task_parser._UP
+        elif ele[:2] == b'PD':
+            pen = task_parser._DOWN
+        elif ele == b'' or ele[:2] == b'IN' or ele[:2] == b'SP':
+            continue
+        else:
+            raise ValueError("something other than PU/PD")
+        if len(ele) > 2:
+            params.append(ele[2:])
+            pairs.append((ele.count(b',') + 1) // 2)
+            pens.append(pen)
+    if not params:
+        return (numpy.empty(0, dtype=numpy.int64),
+                numpy.empty(0, dtype=numpy.int32))
+    coords = numpy.fromstring(b','.join(params), dtype=numpy.int64, sep=',')
+    return coords, numpy.repeat(numpy.array(pens, dtype=numpy.int32), pairs)
+
+
+def write_plot(setpoints, plot_file):
+    '''!
+    Writes set points to a plot file.
+
+    @param setpoints    An array of set points, three ints
+                        (theta_1, theta_2, pen) each.
+    @param plot_file    The name of the plot file to write.
+    '''
+    count = len(setpoints) // 3
+    with open(plot_file, 'wb') as raw_plot:
+        raw_plot.write(struct.pack(task_parser.PLOT_HEADER,
+                                   task_parser.PLOT_MAGIC, count,
+                                   task_parser.R, task_parser.X_HOME,
+                                   task_parser.Y_HOME,
+                                   task_parser.TICKS_PER_MM))
+        records = array.array('i', bytes(8 * count))
+        records[0::2] = setpoints[0::3]
+        records[1::2] = array.array('i', [th2 << 1 | pen for th2, pen
+                                          in zip(setpoints[1::3],
+                                                 setpoints[2::3])])
+        if struct.pack('=i', 1) != struct.pack('<i', 1):
+            records.byteswap()
+        raw_plot.write(records.tobytes())
+
+
+def benchmark(hpgl_files, tolerance=task_parser.SIMPLIFY_TOLERANCE,
+              adaptive=True, dedupe=task_parser.DUPLICATE_TOLERANCE):
+    '''!
+    Times the NumPy compiler against the scalar parser and checks it agrees
+    with the scalar compiler.
+    
+    The scalar time is that of @c task_parser.Parser.setpoints() with its
+    double precision kinematics, the plain per point path. The scalar
+    compiler, which rounds every operation to single precision to match the
+    Nucleo, is far slower and only used to check the set points. Prints the
+    time for each file and for all of the files at once.
+    
+    @param hpgl_files a list of names of the hpgl files to compile.
+    @param tolerance  How far (mm) strokes are simplified, or @c None.
+    @param adaptive   @c True to split lines adaptively, or @c False to
+                      split them every @c MAX_LENGTH.
+    @param dedupe     The distance (mm) within which a stroke repeats an
+                      earlier one and is dropped, or @c None.
+    '''
+    scalar_fun = lambda hpgl_file: _scalar_setpoints(hpgl_file, tolerance,
+                                                     adaptive, dedupe)
+    numpy_fun = lambda hpgl_files: compile_batch_numpy(hpgl_files, tolerance,
+                                                       adaptive, dedupe)
+    for hpgl_file in hpgl_files:
+        scalar_time, result = _best_time(scalar_fun, hpgl_file, 5)
+        numpy_time, vector = _best_time(numpy_fun, [hpgl_file], 50)
+        print('{:s}: {:d} set points, scalar {:.2f} ms, numpy {:.3f} ms, '
+              '{:.1f}x faster, {:s}'.format(
+            hpgl_file, len(vector[0]) // 3, scalar_time * 1000,
+            numpy_time * 1000, scalar_time / numpy_time,
+            'same' if compile_setpoints(hpgl_file, tolerance, adaptive,
+                                        dedupe)
+            == vector[0] else 'DIFFERENT'))
+    
+    scalar_time, result = _best_time(
+        lambda files: [scalar_fun(f) for f in files], hpgl_files, 3)
+    numpy_time, vector = _best_time(numpy_fun, hpgl_files, 20)
+    print('{:d} files at once: scalar {:.2f} ms, numpy {:.3f} ms, '
+          '{:.1f}x faster'.format(
+        len(hpgl_files), scalar_time * 1000, numpy_time * 1000,
+        scalar_time / numpy_time))
+
+
+def _scalar_setpoints(hpgl_file, tolerance, adaptive, dedupe):
+    '''!
+    Computes the set points of an hpgl file one point at a time with the
+    parser's double precision kinematics.
+    
+    @param hpgl_file the name of the hpgl file to compile.
+    @param tolerance How far (mm) strokes are simplified, or @c None.
+    @param adaptive  @c True to split lines by
+                     @c task_parser.adaptive_linterp2(), or @c False by
+                     @c task_parser.linterp2().
+    @param dedupe    The distance (mm) within which a stroke repeats an
+                     earlier one and is dropped, or @c None.
+    @return An array of set points, three ints (theta_1, theta_2, pen) each.
+    '''
+    interp_fun = task_parser.adaptive_linterp2 if adaptive else None
+    parser = task_parser.Parser(None, interp_fun=interp_fun,
+                                tolerance=tolerance, dedupe=dedupe)
+    setpoints = array.array('i')
+    for th1, th2, pen in parser.setpoints(hpgl_file):
+        setpoints.extend((th1, th2, pen))
+    return setpoints
+
+
+def _best_time(compile_fun, hpgl, runs):
+    '''!
+    Times the fastest of several runs of a compiler.
+    
+    @param compile_fun  The compiler function.
+    @param hpgl         The argument to pass to the compiler.
+    @param runs         The number of times to run the compiler.
+    @return A tuple (seconds, result) of the fastest run time and the
+            compiler's result.
+    '''
+    best = None
+    for run in range(runs):
+        start = time.perf_counter()
+        result = compile_fun(hpgl)
+        run_time = time.perf_counter() - start
+        if best == None or run_time < best:
+            best = run_time
+    return (best, result)
+
+
+if __name__ == '__main__':
+    _arg_parser = argparse.ArgumentParser(
+        description='Compile HPGL files into plot files for the plotter.')
+    _arg_parser.add_argument('hpgl', nargs='+', help='HPGL files to compile')
+    _arg_parser.add_argument('-o', '--output',
+        help='plot file to write (only with one HPGL file), default is the '
+             'HPGL file name with a .plt extension')
+    _arg_parser.add_argument('--numpy', action='store_true',
+        help='compile whole polylines at once with NumPy')
+    _arg_parser.add_argument('--check', action='store_true',
+        help='check the NumPy set points against the scalar compiler')
+    _arg_parser.add_argument('--simplify', type=float, metavar='MM',
+        default=task_parser.SIMPLIFY_TOLERANCE,
+        help='leave out points of strokes which the pen path can do without '
+             'while staying within this distance (mm), default %(default)s '
+             'as on the plotter')
+    _arg_parser.add_argument('--no-simplify', dest='simplify',
+        action='store_const', const=None,
+        help='keep every point of the strokes')
+    _arg_parser.add_argument('--dedupe', type=float, metavar='MM',
+        default=task_parser.DUPLICATE_TOLERANCE,
+        help='drop strokes which repeat an earlier stroke within this '
+             'distance (mm), default %(default)s as on the plotter')
+    _arg_parser.add_argument('--no-dedupe', dest='dedupe',
+        action='store_const', const=None,
+        help='keep every stroke')
+    _arg_parser.add_argument('--fixed', dest='adaptive', action='store_false',
+        help='split lines every MAX_LENGTH instead of only where the pen '
+             'would stray from them, as the plotter does')
+    _arg_parser.add_argument('--bench', action='store_true',
+        help='time the scalar and NumPy compilers without writing files')
+    _args = _arg_parser.parse_args()
+    if _args.output != None and len(_args.hpgl) > 1:
+        _arg_parser.error('--output needs a single HPGL file')
+    
+    if _args.bench:
+        benchmark(_args.hpgl, _args.simplify, _args.adaptive, _args.dedupe)
+        raise SystemExit
+    
+    if _args.numpy or _args.check:
+        _compiled = compile_batch_numpy(_args.hpgl, _args.simplify,
+                                        _args.adaptive, _args.dedupe)
+    else:
+        _compiled = [compile_setpoints(_file, _args.simplify, _args.adaptive,
+                                       _args.dedupe)
+                     for _file in _args.hpgl]
+    
+    for _hpgl_file, _setpoints in zip(_args.hpgl, _compiled):
+        if _args.check and _setpoints != compile_setpoints(
+                _hpgl_file, _args.simplify, _args.adaptive, _args.dedupe):
+            raise SystemExit('{:s}: numpy set points differ from the '
+                             'scalar compiler'.format(_hpgl_file))
+        _plot_file = _args.output if _args.output != None \
+            else _hpgl_file.rsplit('.', 1)[0] + '.plt'
+        write_plot(_setpoints, _plot_file)
+        _removed = ''
+        if _args.simplify != None:
+            _removed = ' ({:d} removed by simplifying)'.format(
+                (len(compile_setpoints(_hpgl_file, None, _args.adaptive,
+                                       _args.dedupe))
+                 - len(_setpoints)) // 3)
+        print('{:s}: {:d} set points{:s} -> {:s}'.format(
+            _hpgl_file, len(_setpoints) // 3, _removed, _plot_file))
@@ -0,0 +1,226 @@
+"""!
+@file stroke_order.py
+    This file contains a program that reorders the strokes of an HPGL file
+    to shorten the pen up moves between them.
+
+    Inkscape writes strokes in the order they were drawn, which often sends
+    the pen back and forth across the page with the pen up, and every stroke
+    costs a pen down and a pen up. The strokes are put in nearest neighbour
+    order, then that and the original order are improved with 2-opt moves,
+    which may also reverse strokes, and the shorter one is kept.
+    Strokes which end where the next one starts are joined so the pen stays
+    down. It runs with regular Python on a computer:
+    @code
+    python stroke_order.py WE_ARE_AWESOME.hpgl -o WE_ARE_AWESOME_opt.hpgl
+    @endcode
+    The optimized file can be plotted or compiled like any other HPGL file.
+    With @c --dedupe, strokes which retrace an earlier stroke are dropped
+    first by @c task_parser.remove_duplicates().
+
+@author             Tori Bornino
+@author             Jackson McLaughlin
+@author             Zach Stednitz
+@date               March 15, 2022
+
+"""
+import argparse
+import math
+
+import task_parser
+
+## @brief   Rough speed of pen up moves (mm/s).
+#  @details Used to estimate the time saved by shorter pen up moves.
+TRAVEL_SPEED = 20
+
+## @brief   Time for each pen up or pen down (s).
+#  @details The fixed wait the controller used to make for the servo at every
+#           pen change, which the pen timing model in @c main.py shortens.
+PEN_CHANGE_TIME = 0.5
+
+## @brief   Largest gap between strokes which are joined (mm).
+#  @details Strokes closer than this are drawn without lifting the pen.
+JOIN_DISTANCE = 0.1
+
+## @brief   Maximum number of passes of 2-opt improvement.
+MAX_PASSES = 50
+
+## @brief   Where the pen starts after zeroing (plotter units).
+#  @details Both belts are extended to @c R_MAX, which puts the pen on the
+#           centerline between the motors.
+START = (round((task_parser.R / 2 - task_parser.X_HOME) * task_parser.DPMM),
+         round((math.sqrt(task_parser.R_MAX**2 - (task_parser.R / 2)**2)
+                - task_parser.Y_HOME) * task_parser.DPMM))
+
+
+def order_strokes(strokes, start=START, join_distance=JOIN_DISTANCE):
+    '''!
+    Reorders strokes to shorten the pen up moves between them.
+
+    @param strokes          A list of strokes as from
+                            @c task_parser.read_strokes().
+    @param start            Where the pen starts (x, y) in plotter units.
+    @param join_distance    Largest gap between strokes which are joined (mm).
+    @return A new list of strokes. Strokes may be reversed or joined.
+    '''
+    # Improve both the nearest neighbour order and the original order, since
+    # nearest neighbour isn't always better
+    best = None
+    for route in (_nearest_neighbour(strokes, start), list(strokes)):
+        _two_opt(route, start)
+        if best == None or pen_up_distance(route, start) \
+            < pen_up_distance(best, start):
+            best = route
+    return _join(best, join_distance * task_parser.DPMM)
+
+
+def pen_up_distance(strokes, start=START):
+    '''!
+    Measures the pen up moves needed to draw strokes in order.
+
+    @param strokes  A list of strokes as from @c task_parser.read_strokes().
+    @param start    Where the pen starts (x, y) in plotter units.
+    @return The total length of the pen up moves (mm).
+    '''
+    distance = 0
+    last = start
+    for stroke in strokes:
+        distance += _distance(last, stroke[0])
+        last = stroke[-1]
+    return distance / task_parser.DPMM
+
+
+def plot_time(strokes, start=START):
+    '''!
+    Estimates the time spent on pen up moves and pen changes.
+
+    @param strokes  A list of strokes as from @c task_parser.read_strokes().
+    @param start    Where the pen starts (x, y) in plotter units.
+    @return The estimated time (s).
+    '''
+    return pen_up_distance(strokes, start) / TRAVEL_SPEED \
+        + 2 * len(strokes) * PEN_CHANGE_TIME
+
+
+def _nearest_neighbour(strokes, start):
+    '''!
+    Orders strokes by always drawing the closest stroke end next.
+
+    @param strokes  A list of strokes.
+    @param start    Where the pen starts (x, y) in plotter units.
+    @return A new list of the strokes, some of which may be reversed.
+    '''
+    remaining = list(strokes)
+    route = []
+    last = start
+    while remaining:
+        best = None
+        for i, stroke in enumerate(remaining):
+            for reverse in (False, True):
+                d = _distance(last, stroke[-1] if reverse else stroke[0])
+                if best == None or d < best[0]:
+                    best = (d, i, reverse)
+        stroke = remaining.pop(best[1])
+        if best[2]:
+            stroke = stroke[::-1]
+        route.append(stroke)
+        last = stroke[-1]
+    return route
+
+
+def _two_opt(route, start):
+    '''!
+    Improves an order of strokes by reversing parts of it.
+
+    Reversing the strokes i to j also reverses each of those strokes, so only
+    the pen up moves into stroke i and out of stroke j change length.
+
+    @param route    A list of strokes, which is changed in place.
+    @param start    Where the pen starts (x, y) in plotter units.
+    '''
+    for run in range(MAX_PASSES):
+        improved = False
+        for i in range(len(route)):
+            before = start if i == 0 else route[i - 1][-1]
+            for j in range(i, len(route)):
+                first = route[i][0]
+                last = route[j][-1]
+                old = _distance(before, first)
+                new = _distance(before, last)
+                if j + 1 < len(route):
+                    after = route[j + 1][0]
+                    old += _distance(last, after)
+                    new += _distance(first, after)
+                if new < old - 1e-9:
+                    route[i:j + 1] = [stroke[::-1]
+                                      for stroke in reversed(route[i:j + 1])]
+                    improved = True
+        if not improved:
+            break
+
+
+def _join(route, join_distance):
+    '''!
+    Joins strokes which end close to where the next one starts.
+
+    @param route            A list of strokes.
+    @param join_distance    Largest gap which is joined (plotter units).
+    @return A new list of strokes.
+    '''
+    joined = []
+    for stroke in route:
+        if joined and _distance(joined[-1][-1], stroke[0]) <= join_distance:
+            if joined[-1][-1] == stroke[0]:
+                joined[-1] = joined[-1] + stroke[1:]
+            else:
+                joined[-1] = joined[-1] + stroke
+        else:
+            joined.append(stroke)
+    return joined
+
+
+def _distance(a, b):
+    '''!
+    Calculates the distance between two points.
+
+    @param a The first point (x, y).
+    @param b The second point (x, y).
+    @return The distance between the points.
+    '''
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+if __name__ == '__main__':
+    _arg_parser = argparse.ArgumentParser(
+        description='Reorder the strokes of HPGL files to shorten pen up '
+                    'moves.')
+    _arg_parser.add_argument('hpgl', nargs='+', help='HPGL files to reorder')
+    _arg_parser.add_argument('-o', '--output',
+        help='HPGL file to write (only with one HPGL file), default is the '
+             'HPGL file name ending in _opt')
+    _arg_parser.add_argument('--dedupe', type=float, metavar='MM',
+        help='also drop strokes which repeat an earlier stroke within this '
+             'distance (mm)')
+    _arg_parser.add_argument('--join', type=float, default=JOIN_DISTANCE,
+        help='largest gap between strokes to draw without lifting the pen '
+             '(mm), default %(default)s')
+    _args = _arg_parser.parse_args()
+    if _args.output != None and len(_args.hpgl) > 1:
+        _arg_parser.error('--output needs a single HPGL file')
+
+    for _hpgl_file in _args.hpgl:
+        _strokes = task_parser.read_strokes(_hpgl_file)
+        _unique = _strokes
+        if _args.dedupe != None:
+            _unique, _repeats = task_parser.remove_duplicates(_strokes,
+                                                              _args.dedupe)
+            print('{:s}: {:d} repeated strokes removed'.format(
+                _hpgl_file, len(_strokes) - len(_unique)))
+        _ordered = order_strokes(_unique, join_distance=_args.join)
+        _out_file = _args.output if _args.output != None \
+            else _hpgl_file.rsplit('.', 1)[0] + '_opt.hpgl'
+        task_parser.write_hpgl(_ordered, _out_file)
+        print('{:s}: {:d} -> {:d} strokes, pen up {:.0f} -> {:.0f} mm, '
+              'about {:.1f} s saved -> {:s}'.format(
+            _hpgl_file, len(_strokes), len(_ordered),
+            pen_up_distance(_strokes), pen_up_distance(_ordered),
+            plot_time(_strokes) - plot_time(_ordered), _out_file))
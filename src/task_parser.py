@@ -10,11 +10,35 @@
 
 """
 # import task_share
+import array
+import gc
 import math
+import struct
 
-# Pen States
-_UP = 0
-_DOWN = 1
+## @brief Pen state of set points moved to with the pen up.
+PEN_UP = 0
+## @brief Pen state of set points moved to with the pen down.
+PEN_DOWN = 1
+_UP = PEN_UP
+_DOWN = PEN_DOWN
+
+# Tolerance classes of set points, how closely the motors have to reach them
+## @brief Tolerance class of set points of pen up travel moves.
+TOL_TRAVEL = 0
+## @brief Tolerance class of set points along a stroke.
+TOL_DRAW = 1
+## @brief   Tolerance class of corners and ends of strokes.
+#  @details Includes the last travel set point before a stroke, where the
+#           pen comes down.
+TOL_CORNER = 2
+
+## @brief   Bits of flags of each set point in the set point queue.
+#  @details The pen state is bit 0 and the tolerance class is above it.
+FLAG_BITS = 3
+
+## @brief   Smallest turn (degrees) of a stroke which is a corner.
+#  @details Curves are split into pieces which turn less than this.
+CORNER_ANGLE = 30
 
 ## @brief   Encoder pulses (ticks) per revolution
 #  @details The encoder pulses or ticks per revolution of the pulley is 256
@@ -56,36 +80,210 @@ X_HOME = 80.7
 #           Used for the transform from (x, y) coordinates to motor angles.
 Y_HOME = 122.676
 
+## @brief   Width of the drawing area, 4 in (mm).
+#  @details The drawing area starts at the home position, with its far corners
+#           @c R_MAX from the motors.
+WIDTH = 4 * 25.4
+
+## @brief   Height of the drawing area, 6 in (mm).
+HEIGHT = 6 * 25.4
+
 ## @brief   Maximum length (mm) between two consecutive points.
 #  @details Used for interpolation to smooth the drawing profile.
 MAX_LENGTH = 2
 
+## @brief   How far (mm) the pen may stray from a line with adaptive
+#           interpolation.
+#  @details The motors move in a straight line in ticks between set points,
+#           which bows away from the straight line on the page. See
+#           @c adaptive_linterp2().
+INTERP_TOLERANCE = 0.05
+
+## @brief   Largest move (ticks) along x or y in one step of
+#           @c FixedKinematics.
+#  @details The squared belt lengths change by about @c 4*FIXED_STEP times the
+#           position in ticks each step, which has to stay within
+#           MicroPython's 30 bit small ints to avoid allocating. The same
+#           distance as @c MAX_LENGTH, so each interpolated point is one step.
+FIXED_STEP = 1024
+
+## @brief   Default largest error (ticks) of a @c KinematicsTable.
+#  @details Sets the spacing of the table; 8 ticks is 0.016 mm and about
+#           8 kB of table.
+LUT_ERROR = 8
+
+## @brief   Bits of fraction in the position within a table cell.
+LUT_FRAC = 14
+
+## @brief   Bits of fraction of a tick kept in the table.
+LUT_SUB = 3
+
+## @brief   The first bytes of a saved @c KinematicsTable.
+LUT_MAGIC = b'LUT1'
+
+## @brief   The header of a saved @c KinematicsTable.
+#  @details After the magic: cells along x and y (uint16), the cell size (mm),
+#           R, X_HOME and Y_HOME (float32) and TICKS_PER_MM (int32). The
+#           table of int32 follows.
+LUT_HEADER = '<4sHHffffi'
+
+## @brief   Number of bytes read from the HPGL file at a time.
+#  @details The file is read in pieces of this size into a buffer allocated
+#           once by the tokenizer, so memory use doesn't depend on the size
+#           of the drawing or of any one command.
+READ_SIZE = 64
+
+# Tokens found by the HPGL tokenizer
+## @brief Token returned by HPGLTokenizer.next() at the end of the file.
+TOKEN_EOF = 0
+## @brief Token returned by HPGLTokenizer.next() for a two letter mnemonic.
+TOKEN_COMMAND = 1
+## @brief Token returned by HPGLTokenizer.next() for an integer parameter.
+TOKEN_NUMBER = 2
+
+## @brief   The first bytes of a compiled plot file.
+#  @details Plot files are compiled from HPGL on a computer by
+#           @c plot_compiler.py. The header is followed by one record per set
+#           point, see @c Parser.setpoints().
+PLOT_MAGIC = b'PLT1'
+## @brief   Format of the plot file header for @c struct.
+#  @details Magic, number of records, R, X_HOME and Y_HOME as float32 and
+#           TICKS_PER_MM as int32, all little endian.
+PLOT_HEADER = '<4sIfffi'
+## @brief   Size of one plot file record (bytes).
+#  @details Each record is two little endian int32 words, theta_1 and
+#           (theta_2 << 1 | pen).
+PLOT_RECORD_SIZE = 8
+## @brief   Number of plot file records read from the file at a time.
+PLOT_BLOCK = 32
+
+# HPGL mnemonics packed into integers as HPGLTokenizer.command holds them
+_CMD_IN = ord('I') << 8 | ord('N')
+_CMD_SP = ord('S') << 8 | ord('P')
+_CMD_PU = ord('P') << 8 | ord('U')
+_CMD_PD = ord('P') << 8 | ord('D')
+
+# Characters used by the HPGL tokenizer
+_CHAR_0 = ord('0')
+_CHAR_9 = ord('9')
+_CHAR_A = ord('A')
+_CHAR_Z = ord('Z')
+_CHAR_MINUS = ord('-')
+_CHAR_PLUS = ord('+')
+_CHAR_DOT = ord('.')
+_LOWER_CASE = 0x20
+
+# Square of the cosine of CORNER_ANGLE, in fixed point with _CORNER_FRAC bits
+# of fraction
+_CORNER_FRAC = 8
+_CORNER_COS2 = round(math.cos(CORNER_ANGLE * math.pi / 180)**2
+                     * (1 << _CORNER_FRAC))
+
+## @brief   Maximum number of setpoints queued by one run of the parser task.
+#  @details Bounds the time the parser task holds the CPU so that it does not
+#           delay the encoder and controller tasks.
+BATCH = 8
+
+## @brief   Default distance within which a stroke repeats another (mm).
+#  @details Used by @c remove_duplicates(), and by @c main.py to drop
+#           repeated strokes while parsing.
+DUPLICATE_TOLERANCE = 0.1
+
+## @brief   Number of points of a stroke the parser buffers to check it
+#           against earlier strokes.
+#  @details Counts the point where the pen is put down. Longer strokes are
+#           drawn without being checked.
+DEDUPE_POINTS = 256
+
+## @brief   Number of strokes the parser remembers to find repeats of.
+#  @details Each takes 7 words. Strokes after this many are still checked
+#           against the ones remembered.
+DEDUPE_STROKES = 128
+
+## @brief   How far (mm) the plotter simplifies strokes of an HPGL file.
+#  @details Leaving out points the pen path doesn't need means fewer set points
+#           to settle on. @c main.py parses with this tolerance and
+#           @c plot_compiler.py compiles with it by default, so both give
+#           the same set points.
+SIMPLIFY_TOLERANCE = 0.1
+
+## @brief   Number of PD points simplified together by the parser.
+#  @details When the parser simplifies strokes, the points of a stroke are
+#           buffered in arrays of this size. Longer strokes are simplified
+#           in pieces.
+SIMPLIFY_POINTS = 256
+
+## @brief   Setpoint sent after the drawing to move out of the way (ticks).
+#  @details This makes it easier to see the picture drawn.
+HOME = 150000
+
 class Parser:
     '''!
     This class will parse an HPGL file and output a set of points 
-    (theta_1, theta_2, pen) stored in three separate queues.
+    (theta_1, theta_2, pen) stored as records in a set point queue.
     
     The method includes interpolation that will split up long lines into
     smaller lines to smooth drawing. The derivation of the kinematics that
     drive the translation from desired location in (x, y) [mm] to motor angles
     (theta_1, theta_2) [ticks] is explainied in the [Kinematic  Derivation]
     @ref page_kinetics page.
+    
+    The file can either be parsed all at once with @c read() before the
+    scheduler starts, or streamed into the queue while plotting by
+    registering @c run() as a low priority task:
+    @code
+    parser = task_parser.Parser(setpoint_queue, watermark=400)
+    parser.load('drawing.hpgl')
+    task = cotask.Task(parser.run, name='Parser_Task', priority=0, period=10)
+    @endcode
     '''
     
-    def __init__(self, sp_theta1_queue, sp_theta2_queue, sp_pen_queue):
+    def __init__(self, sp_queue, watermark=None, transform_fun=None,
+                 interp_fun=None, tolerance=None, kinematics=None,
+                 dedupe=None):
         '''!
         This class computes the set of points (theta_1, theta_2, pen)
-        and stores them in three separate queues.
+        and stores them in a set point queue.
         
-        @param sp_theta1_queue  A queue for the setpoint motor angle, theta_1.
-        @param sp_theta2_queue  A queue for the setpoint motor angle, theta_2.
-        @param sp_pen_queue     A queue for the pen condition for the movement
-                                to the desired pen location (theta_1, theta_2).
+        @param sp_queue         A @c task_share.RecordQueue or
+                                @c task_share.DeltaQueue for the set points,
+                                each the motor angles (theta_1, theta_2) with
+                                flags of the pen condition for the movement
+                                there and the tolerance class, as from
+                                @c classify(). It needs @c FLAG_BITS bits of
+                                flags.
+        @param watermark        The number of setpoints the parser task keeps
+                                in the queue while streaming, or @c None to
+                                keep the queue full.
+        @param transform_fun    The function which converts a point (x, y)
+                                to motor angles, default @c transform().
+        @param interp_fun       The function which splits a line into smaller
+                                segments, default @c linterp2().
+        @param tolerance        How far (mm) the pen may stray from the hpgl
+                                path when strokes are simplified before
+                                interpolation, or @c None to use every point.
+        @param kinematics       A @c FixedKinematics to compute the set points
+                                without floating point math, in place of
+                                @c transform_fun and @c interp_fun.
+        @param dedupe           The distance (mm) within which a stroke
+                                repeats an earlier one and is dropped, as by
+                                @c StrokeIndex, or @c None to draw every
+                                stroke.
         '''
-        self._th1q = sp_theta1_queue
-        self._th2q = sp_theta2_queue
-        self._penq = sp_pen_queue
+        self._queue = sp_queue
+        self._watermark = watermark
+        self._transform = transform if transform_fun == None \
+            else transform_fun
+        self._interp = linterp2 if interp_fun == None else interp_fun
+        self._tolerance = tolerance
+        self._kinematics = kinematics
+        self._dedupe = dedupe
         
+        # Setpoint generator of the file being streamed by the parser task
+        self._setpoints = None
+        
+        ## @brief True when every setpoint of the loaded file has been queued.
+        self.done = True
         
     def read(self, hpgl_file):
         '''!
@@ -95,80 +293,1255 @@ class Parser:
         Reads each line of data and ignores inputs not relevant to the pen's
         position. Takes the data points and converts them to a readable format
         to send via a queue to our controller for setting set points for our
-        motors.
+        motors. Set points which don't fit in the queue are dropped, so
+        large drawings should be streamed with @c run() instead.
         
         @param hpgl_file the name of the hpgl file you want parsed.
         '''
         print("parsing hpgl...")
         
-        with open(hpgl_file, 'r') as raw_hpgl:
-            # This section of the code reads the hpgl file, then splits it up
-            # into the proper coordinates (x, y, pen). Any non-relevant
-            # information is ignored.
-            for line in raw_hpgl:
-                # split the raw hpgl by the commands at the semi colons. HPGL
-                # usually comes in one line of all commands.
-                split_hpgl = line.split(';')                      
-                # This removes all non-relevant commands such as:
-                # initialize, pen color, and initial pen up commands
-                split_hpgl = [ ele for ele in split_hpgl \
-                               if (ele != 'IN' and ele[:2] != 'SP' \
-                                   and ele != 'PU' and ele != ' ')]                    
-                # This takes each command (pen up PU or pen down PD) and splits
-                # the command into the individual pen coordinates while adding
-                # the state of the pen as a third component of the coordinate.
-                for ele in split_hpgl:
-                    # split command into pairs of coordinates (x,y)
-                    coords = [int(coord) for coord in ele[2:].split(',')]
-                    # add the pen condition to the stored coordinate (x,y,pen)
-                    # then transform to (theta_1, theta_2, pen)
-                    
-                    # PU exclusively comes with one coordinate 
-                    if ele[:2] == 'PU':
-                        x = coords[0] / DPMM
-                        y = coords[1] / DPMM
-                        
-                        th1, th2 = transform(x, y)
-                        if not self._th1q.full():
-                            self._th1q.put(th1)
-                            self._th2q.put(th2)
-                            self._penq.put(_UP)
-                        last_x = x
-                        last_y = y
+        for th1, th2, flags in classify(self.setpoints(hpgl_file)):
+            if not self._queue.full():
+                self._queue.put_record(th1, th2, flags)
+            
+        print('done parsing')
+        
+    def load(self, hpgl_file):
+        '''!
+        Selects the hpgl file which the parser task streams into the queue.
+        
+        The file isn't read until the parser task runs.
+        
+        @param hpgl_file the name of the hpgl file you want parsed.
+        '''
+        self._setpoints = classify(self.setpoints(hpgl_file))
+        self.done = False
+        
+    def run(self):
+        '''!
+        Task which streams the loaded hpgl file into the set point queue.
+        
+        Each run converts at most @c BATCH set points, and only while the
+        queue holds fewer than the watermark, so the file is parsed just ahead
+        of the controller and memory use doesn't depend on the drawing size.
+        '''
+        while True:
+            count = 0
+            while self._setpoints != None and count < BATCH \
+                and self._wants_more():
+                try:
+                    th1, th2, flags = next(self._setpoints)
+                except StopIteration:
+                    self._setpoints = None
+                    self.done = True
+                    print('done parsing')
+                    break
+                self._queue.put_record(th1, th2, flags)
+                count += 1
+            yield ()
+            
+    def setpoints(self, hpgl_file):
+        '''!
+        Generates the set points (theta_1, theta_2, pen) for an hpgl file.
+        
+        The file is read a few bytes at a time by an @c HPGLTokenizer,
+        ignoring commands not relevant to the pen's position. The last set
+        point moves the pen up and out of the way of the drawing.
+        
+        If the parser was given a distance to dedupe by, strokes which repeat
+        an earlier stroke are dropped. If it was given a tolerance, points of
+        each stroke which the pen doesn't need to stay within the tolerance
+        are left out before the lines are split up.
+        
+        The file may instead be a plot file compiled by @c plot_compiler.py,
+        which starts with @c PLOT_MAGIC. Its set points are read in blocks of
+        @c PLOT_BLOCK records without any floating point math.
+        
+        @param hpgl_file the name of the hpgl or plot file you want parsed.
+        @return A generator of set points (theta_1, theta_2, pen) in ticks.
+        '''
+        with open(hpgl_file, 'rb') as raw_hpgl:
+            if raw_hpgl.read(len(PLOT_MAGIC)) == PLOT_MAGIC:
+                yield from _plot_setpoints(raw_hpgl)
+                return
+            raw_hpgl.seek(0)
+            points = _hpgl_points(raw_hpgl)
+            if self._dedupe != None:
+                points = _deduplicated(points, self._dedupe)
+            if self._tolerance != None:
+                points = _simplified(points, self._tolerance)
+            if self._kinematics != None:
+                yield from _fixed_setpoints(points, self._kinematics)
+            else:
+                for pen, x, y in points:
+                    x = x / DPMM
+                    y = y / DPMM
                     
-                    # PD generally comes with multiple coordinates. When two
-                    # consecutive coordinates are more than _MAX_LENGTH away
-                    # from each other, they are split up into smaller line
-                    # segments where each is less than our equal to . 
-                    elif ele[:2] == 'PD':
-                        for i in range(0, len(coords), 2):
-                            x = coords[i] / DPMM
-                            y = coords[i + 1] / DPMM
-                            
-                            interpolated = linterp2(last_x, last_y, x, y)
-                            for xx, yy in interpolated:
-                                th1, th2 = transform(xx, yy)
-                                if not self._th1q.full():
-                                    self._th1q.put(th1)
-                                    self._th2q.put(th2)
-                                    self._penq.put(_DOWN)
-                            last_x = x
-                            last_y = y
+                    # PU moves straight to each coordinate
+                    if pen == _UP:
+                        th1, th2 = self._transform(x, y)
+                        yield (th1, th2, _UP)
                     
-                    # check for command value errors 
+                    # When two consecutive PD coordinates are more than
+                    # MAX_LENGTH away from each other, they are split up
+                    # into smaller line segments where each is less than or
+                    # equal to MAX_LENGTH.
                     else:
-                        print(ele)
-                        raise ValueError("something other than PU/PD")
-              
+                        interpolated = self._interp(last_x, last_y, x, y)
+                        for xx, yy in interpolated:
+                            th1, th2 = self._transform(xx, yy)
+                            yield (th1, th2, _DOWN)
+                    last_x = x
+                    last_y = y
+        
         # Add the command to go to the home position after drawing the image.
-        # This makes it easier to see the picture drawn.
-        if not self._th1q.full():
-            self._th1q.put(150000)
-            self._th2q.put(150000)
-            self._penq.put(_UP)
-            
-        print('done parsing')
+        yield (HOME, HOME, _UP)
+        
+    def _wants_more(self):
+        '''!
+        Checks if the parser task should add more set points to the queue.
+        
+        The queue must have room for the next set point whatever the
+        watermark, since a @c task_share.DeltaQueue fills up by words and
+        may be full of keyframes with fewer set points than the watermark.
+        A queue which isn't full has room for a keyframe, and putting a set
+        point into a full queue would wait forever for the controller, which
+        can't run until the parser task yields.
+        
+        @return @c True if the queue has room and is below the watermark.
+        '''
+        if self._queue.full():
+            return False
+        return self._watermark == None \
+            or self._queue.num_in() < self._watermark
  
+class HPGLTokenizer:
+    '''!
+    This class splits an HPGL file into mnemonics and integer parameters.
+    
+    The file is read in chunks of @c READ_SIZE bytes into a buffer which is
+    allocated once, and the mnemonics and numbers are decoded from the bytes
+    in place, so tokenizing doesn't allocate memory however large the file
+    is. A number or mnemonic split across two chunks is continued in the next
+    chunk. Separators such as semicolons, commas and whitespace are skipped.
+    
+    Example:
+    @code
+    tokens = HPGLTokenizer(open('drawing.hpgl', 'rb'))
+    while tokens.next() != TOKEN_EOF:
+        print(tokens.command, tokens.value)
+    @endcode
+    '''
+    
+    def __init__(self, stream, chunk_size=READ_SIZE):
+        '''!
+        Creates a tokenizer which reads from a binary stream.
+        
+        @param stream       A file opened in binary mode, which must support
+                            @c readinto().
+        @param chunk_size   The number of bytes to read from the file at a
+                            time, default @c READ_SIZE.
+        '''
+        self._stream = stream
+        self._buf = bytearray(chunk_size)
+        self._len = 0
+        self._idx = 0
+        
+        ## @brief   The most recent mnemonic.
+        #  @details Holds the two characters packed as
+        #           (first << 8 | second), upper case.
+        self.command = 0
+        
+        ## @brief The most recent integer parameter.
+        self.value = 0
+        
+    def next(self):
+        '''!
+        Reads the next token from the file.
+        
+        @return @c TOKEN_COMMAND when a mnemonic was read into @c command,
+                @c TOKEN_NUMBER when a number was read into @c value, or
+                @c TOKEN_EOF at the end of the file.
+        '''
+        # Skip separators
+        c = self._byte()
+        while c >= 0 and not (_CHAR_0 <= c <= _CHAR_9 or c == _CHAR_MINUS
+                              or c == _CHAR_PLUS
+                              or _CHAR_A <= (c & ~_LOWER_CASE) <= _CHAR_Z):
+            c = self._byte()
+        if c < 0:
+            return TOKEN_EOF
+        
+        # Mnemonics are two letters
+        if _CHAR_A <= (c & ~_LOWER_CASE) <= _CHAR_Z:
+            self.command = (c & ~_LOWER_CASE) << 8 \
+                           | (self._byte() & ~_LOWER_CASE & 0xFF)
+            return TOKEN_COMMAND
+        
+        # Anything else is a number. Fractions aren't used for coordinates,
+        # so they are dropped.
+        sign = 1
+        if c == _CHAR_MINUS:
+            sign = -1
+            c = self._byte()
+        elif c == _CHAR_PLUS:
+            c = self._byte()
+        value = 0
+        while _CHAR_0 <= c <= _CHAR_9:
+            value = value * 10 + c - _CHAR_0
+            c = self._byte()
+        if c == _CHAR_DOT:
+            c = self._byte()
+            while _CHAR_0 <= c <= _CHAR_9:
+                c = self._byte()
+        
+        # Leave the character after the number to be read next
+        if c >= 0:
+            self._idx -= 1
+        self.value = sign * value
+        return TOKEN_NUMBER
+        
+    def _byte(self):
+        '''!
+        Reads one byte, refilling the buffer from the file when it runs out.
+        
+        @return The byte, or -1 at the end of the file.
+        '''
+        if self._idx >= self._len:
+            self._len = self._stream.readinto(self._buf) or 0
+            self._idx = 0
+            if self._len == 0:
+                return -1
+        c = self._buf[self._idx]
+        self._idx += 1
+        return c
+
+class FixedKinematics:
+    '''!
+    This class tracks the motor angles (theta_1, theta_2) as the pen moves
+    between points in plotter units, using only integer math.
+    
+    The pen's position is kept in ticks, rounded from plotter units, along
+    with each belt length r in ticks and the remainder e = r_exact^2 - r^2,
+    which is between 0 and 2r when r is the integer square root. Moving the
+    pen by (dx, dy) changes r_exact^2 by dx*(2x + dx) + dy*(2y + dy), which
+    is added to e before Newton steps bring e back within range. Starting
+    from the last length the square root settles in one or two steps. Moves
+    longer than @c FIXED_STEP are taken in several steps so that no number
+    grows past a small int.
+    
+    The angles match @c transform() to within one tick, the error coming
+    from rounding the position to ticks.
+    '''
+    
+    def __init__(self, x=0, y=0):
+        '''!
+        Computes the motor angles for the starting point. Only this needs
+        numbers larger than a small int.
+        
+        @param x The starting x coordinate (plotter units).
+        @param y The starting y coordinate (plotter units).
+        '''
+        self._x_home = round(X_HOME * TICKS_PER_MM)
+        self._y_home = round(Y_HOME * TICKS_PER_MM)
+        self._r = R * TICKS_PER_MM
+        
+        # The position and (r, e) of both belts, in ticks
+        self._state = array.array('i', [0] * 6)
+        self._state[0] = self.x_ticks(x)
+        self._state[1] = self.y_ticks(y)
+        for i, x_dist in ((2, self._r - self._state[0]), (4, self._state[0])):
+            square = x_dist**2 + self._state[1]**2
+            root = int(math.sqrt(square))
+            self._state[i] = root
+            self._state[i + 1] = 0
+            _settle(self._state, i, square - root**2)
+        
+        ## @brief The motor angle theta_1 at the pen's position (ticks).
+        self.th1 = self._state[2]
+        ## @brief The motor angle theta_2 at the pen's position (ticks).
+        self.th2 = self._state[4]
+    
+    def move_to(self, x, y):
+        '''!
+        Moves the pen to a point and updates @c th1 and @c th2.
+        
+        @param x The x coordinate (plotter units).
+        @param y The y coordinate (plotter units).
+        '''
+        self.move_to_ticks(self.x_ticks(x), self.y_ticks(y))
+    
+    def move_to_ticks(self, tx, ty):
+        '''!
+        Moves the pen to a point given in ticks from motor 2, as from
+        @c x_ticks() and @c y_ticks(), and updates @c th1 and @c th2.
+        
+        @param tx The distance along x from motor 2 (ticks).
+        @param ty The distance along y from motor 2 (ticks).
+        '''
+        state = self._state
+        while state[0] != tx or state[1] != ty:
+            px = state[0]
+            py = state[1]
+            dx = min(max(tx - px, -FIXED_STEP), FIXED_STEP)
+            dy = min(max(ty - py, -FIXED_STEP), FIXED_STEP)
+            dy_sq = dy*(2*py + dy)
+            # Motor 1 is R away along x, so its x distance shrinks by dx
+            _settle(state, 2, dy_sq - dx*(2*(self._r - px) - dx))
+            _settle(state, 4, dy_sq + dx*(2*px + dx))
+            state[0] = px + dx
+            state[1] = py + dy
+        self.th1 = state[2]
+        self.th2 = state[4]
+    
+    def x_ticks(self, x):
+        '''!
+        Converts an x coordinate to the distance along x from motor 2.
+        
+        @param x The x coordinate (plotter units).
+        @return The rounded distance (ticks).
+        '''
+        return self._x_home + (2*x*TICKS_PER_MM + DPMM) // (2*DPMM)
+    
+    def y_ticks(self, y):
+        '''!
+        Converts a y coordinate to the distance along y from motor 2.
+        
+        @param y The y coordinate (plotter units).
+        @return The rounded distance (ticks).
+        '''
+        return self._y_home + (2*y*TICKS_PER_MM + DPMM) // (2*DPMM)
+
+
+class KinematicsTable:
+    '''!
+    This class converts points in the drawing area to motor angles with a
+    table of motor angles on a grid and bilinear interpolation in integer
+    math, in place of @c transform().
+    
+    Between grid points the error of bilinear interpolation is at most
+    h^2/8 times the sum of the second derivatives of the belt length, which
+    is @c TICKS_PER_MM divided by the belt length. The grid spacing h is
+    chosen from the error budget for the belt closest to its motor, at the
+    home position, leaving one tick for rounding. Points outside the drawing
+    area are passed on to @c transform().
+    
+    The table can be saved to flash with @c save() and loaded again instead
+    of computing it:
+    @code
+    table = task_parser.KinematicsTable(table_file='kinematics.lut')
+    parser = task_parser.Parser(setpoint_queue,
+                                transform_fun=table.transform)
+    @endcode
+    '''
+    
+    def __init__(self, error=LUT_ERROR, table_file=None):
+        '''!
+        Computes the table, or loads a table saved by @c save().
+        
+        @param error        The largest error allowed (ticks), more than one.
+        @param table_file   The name of a saved table to load, or @c None to
+                            compute the table.
+        '''
+        if table_file != None:
+            self._load(table_file)
+        else:
+            if error <= 1:
+                raise ValueError("table error must be more than one tick")
+            r_min = (X_HOME**2 + Y_HOME**2)**0.5
+            # Rounded as it is saved, so a loaded table is the same
+            self._cell = float32((8 * (error - 1) * r_min / TICKS_PER_MM)**0.5)
+            self._nx = int(WIDTH / self._cell) + 1
+            self._ny = int(HEIGHT / self._cell) + 1
+            self._table = array.array('i', [0] * (2 * (self._nx + 1)
+                                                 * (self._ny + 1)))
+            k = 0
+            for j in range(self._ny + 1):
+                for i in range(self._nx + 1):
+                    r_1, r_2 = _radii(i * self._cell, j * self._cell)
+                    self._table[k] = round(r_1 * (TICKS_PER_MM << LUT_SUB))
+                    self._table[k + 1] = round(r_2 * (TICKS_PER_MM << LUT_SUB))
+                    k += 2
+        self._per_mm = (1 << LUT_FRAC) / self._cell
+        self._row = 2 * (self._nx + 1)
+    
+    def transform(self, x, y):
+        '''!
+        Calculates the two motor angles for a point, like @c transform().
+        
+        @param x the x coordinate (mm)
+        @param y the y coordinate (mm)
+        @return the motor angles (r_1, r_2) in (ticks)
+        '''
+        u = int(x * self._per_mm)
+        v = int(y * self._per_mm)
+        i = u >> LUT_FRAC
+        j = v >> LUT_FRAC
+        if u < 0 or v < 0 or i >= self._nx or j >= self._ny:
+            return transform(x, y)
+        
+        k = j * self._row + 2 * i
+        fu = u & ((1 << LUT_FRAC) - 1)
+        fv = v & ((1 << LUT_FRAC) - 1)
+        th1 = _bilinear(self._table, k, self._row, fu, fv) >> LUT_SUB
+        th2 = _bilinear(self._table, k + 1, self._row, fu, fv) >> LUT_SUB
+        
+        return(th1, th2)
+    
+    def worst_error(self, step=DPMM // 4):
+        '''!
+        Finds the largest difference from @c transform() over the drawing
+        area by trying points on a grid. This is slow on the Nucleo.
+        
+        @param step The spacing of the points tried (plotter units).
+        @return The largest difference in either motor angle (ticks).
+        '''
+        error = 0
+        for y in range(0, int(HEIGHT * DPMM) + 1, step):
+            for x in range(0, int(WIDTH * DPMM) + 1, step):
+                a = transform(x / DPMM, y / DPMM)
+                b = self.transform(x / DPMM, y / DPMM)
+                error = max(error, abs(a[0] - b[0]), abs(a[1] - b[1]))
+        return error
+    
+    def size(self):
+        '''!
+        Gets the size of the table.
+        
+        @return The number of bytes in the table.
+        '''
+        return len(self._table) * self._table.itemsize
+    
+    def save(self, table_file):
+        '''!
+        Saves the table so it can be loaded instead of computed.
+        
+        @param table_file The name of the file to write.
+        '''
+        with open(table_file, 'wb') as lut:
+            lut.write(struct.pack(LUT_HEADER, LUT_MAGIC, self._nx, self._ny,
+                                  self._cell, R, X_HOME, Y_HOME,
+                                  TICKS_PER_MM))
+            lut.write(self._table)
+    
+    def _load(self, table_file):
+        '''!
+        Loads a table saved by @c save().
+        
+        The geometry in the header must match this file's constants, since
+        the table was computed from them.
+        
+        @param table_file The name of the file to read.
+        '''
+        with open(table_file, 'rb') as lut:
+            magic, self._nx, self._ny, self._cell, r, x_home, y_home, \
+                ticks_per_mm = struct.unpack(
+                    LUT_HEADER, lut.read(struct.calcsize(LUT_HEADER)))
+            if magic != LUT_MAGIC:
+                raise ValueError("not a kinematics table")
+            if r != float32(R) or x_home != float32(X_HOME) \
+                or y_home != float32(Y_HOME) or ticks_per_mm != TICKS_PER_MM:
+                raise ValueError("table was computed for a different geometry")
+            self._table = array.array('i', [0] * (2 * (self._nx + 1)
+                                                 * (self._ny + 1)))
+            if lut.readinto(self._table) != self.size():
+                raise ValueError("table file is too short")
+
+
+class StrokeIndex:
+    '''!
+    This class remembers the strokes drawn so far, to find strokes which
+    repeat one of them while an hpgl file is streamed.
+    
+    Each stroke is remembered by its end points, its number of points and
+    the sums of their coordinates, in arrays allocated once for
+    @c DEDUPE_STROKES strokes. A stroke repeats an earlier one when it has
+    the same number of points, its ends are within the tolerance of the
+    earlier stroke's ends in the same or the reversed order, and the mean of
+    its points is within the tolerance of the earlier stroke's. Inkscape's
+    second pass over a drawing repeats the same points, so it is found this
+    way; strokes which retrace another through different points are only
+    found by @c remove_duplicates(), which needs the whole drawing. Strokes
+    are kept in a dictionary under the cells of both of their end points,
+    and looked up in the cells around a stroke's first point, so a check
+    takes about the same time however many strokes have been drawn.
+    '''
+    
+    def __init__(self, tolerance, size=DEDUPE_STROKES):
+        '''!
+        Creates an index without any strokes.
+        
+        @param tolerance    The distance within which a stroke repeats
+                            another (mm).
+        @param size         The number of strokes to remember.
+        '''
+        self._tol = tolerance * DPMM
+        self._cell = max(self._tol, 1)
+        self._size = size
+        self._count = 0
+        self._ends = array.array('i', [0] * (4 * size))
+        self._sums = array.array('i', [0] * (3 * size))
+        self._index = {}
+        
+    def seen(self, x0, y0, x1, y1, n, sum_x, sum_y):
+        '''!
+        Checks if a stroke repeats one already drawn, and remembers it if
+        not and there is room.
+        
+        @param x0       The x coordinate of the first point (plotter units).
+        @param y0       The y coordinate of the first point (plotter units).
+        @param x1       The x coordinate of the last point (plotter units).
+        @param y1       The y coordinate of the last point (plotter units).
+        @param n        The number of points, counting the first.
+        @param sum_x    The sum of the x coordinates of the points.
+        @param sum_y    The sum of the y coordinates of the points.
+        @return @c True if the stroke repeats an earlier one.
+        '''
+        tol = self._tol
+        tol2 = tol * tol
+        ends = self._ends
+        sums = self._sums
+        cx = int(x0 // self._cell)
+        cy = int(y0 // self._cell)
+        for kx in range(cx - 1, cx + 2):
+            for ky in range(cy - 1, cy + 2):
+                for i in self._index.get(_cell_key(kx, ky), ()):
+                    if sums[3*i] != n \
+                        or abs(sums[3*i + 1] - sum_x) > n * tol \
+                        or abs(sums[3*i + 2] - sum_y) > n * tol:
+                        continue
+                    a = (ends[4*i], ends[4*i + 1])
+                    b = (ends[4*i + 2], ends[4*i + 3])
+                    if (_distance2(a, (x0, y0)) <= tol2
+                            and _distance2(b, (x1, y1)) <= tol2) \
+                        or (_distance2(a, (x1, y1)) <= tol2
+                            and _distance2(b, (x0, y0)) <= tol2):
+                        return True
+        
+        if self._count < self._size:
+            i = self._count
+            ends[4*i] = x0
+            ends[4*i + 1] = y0
+            ends[4*i + 2] = x1
+            ends[4*i + 3] = y1
+            sums[3*i] = n
+            sums[3*i + 1] = sum_x
+            sums[3*i + 2] = sum_y
+            key0 = _cell_key(int(x0 // self._cell), int(y0 // self._cell))
+            key1 = _cell_key(int(x1 // self._cell), int(y1 // self._cell))
+            self._index.setdefault(key0, []).append(i)
+            if key1 != key0:
+                self._index.setdefault(key1, []).append(i)
+            self._count += 1
+        return False
+
+
+def _cell_key(kx, ky):
+    '''!
+    Packs the column and row of a cell into a dictionary key.
+    
+    Cells far apart may share a key, which only means a few more strokes
+    are compared.
+    
+    @param kx   The column of the cell.
+    @param ky   The row of the cell.
+    @return The key, a small int.
+    '''
+    return (kx << 12) ^ (ky & 0xFFF)
+
+
+def _bilinear(table, k, row, fu, fv):
+    '''!
+    Interpolates between the four corners of a table cell.
+    
+    Interpolating along x and then along y keeps every product within a
+    small int.
+    
+    @param table    The table of values.
+    @param k        The index of the corner nearest the origin.
+    @param row      The distance between rows of the table.
+    @param fu       The position along x within the cell, in
+                    @c LUT_FRAC bits.
+    @param fv       The position along y within the cell, in
+                    @c LUT_FRAC bits.
+    @return The interpolated value.
+    '''
+    a = table[k]
+    b = table[k + row]
+    a += ((table[k + 2] - a) * fu) >> LUT_FRAC
+    b += ((table[k + row + 2] - b) * fu) >> LUT_FRAC
+    return a + (((b - a) * fv) >> LUT_FRAC)
+
+
+def _settle(state, i, change):
+    '''!
+    Updates an integer square root after its square changes.
+    
+    @param state    The array holding the root r at @c i and the remainder e
+                    at @c i+1.
+    @param i        The index of the root.
+    @param change   The change in the square.
+    '''
+    r = state[i]
+    e = state[i + 1] + change
+    # Newton steps toward the root from either side until 0 <= e <= 2r
+    while e < 0 or e > 2*r:
+        step = e // (2*r + 1)
+        e -= step*(2*r + step)
+        r += step
+    state[i] = r
+    state[i + 1] = e
+
+
+def _fixed_setpoints(points, kinematics):
+    '''!
+    Generates the set points for points of an hpgl file without floating
+    point math.
+    
+    Lines are split the same way as by @c linterp2(), into pieces at most
+    @c MAX_LENGTH long, with the points rounded to ticks.
+    
+    @param points       A generator of points (pen, x, y) as from
+                        @c _hpgl_points().
+    @param kinematics   The @c FixedKinematics which tracks the pen.
+    @return A generator of set points (theta_1, theta_2, pen) in ticks.
+    '''
+    step = MAX_LENGTH * DPMM
+    for pen, x, y in points:
+        if pen == _UP:
+            kinematics.move_to(x, y)
+            yield (kinematics.th1, kinematics.th2, _UP)
+        else:
+            n = (max(abs(x - last_x), abs(y - last_y)) + step - 1) // step
+            yield (kinematics.th1, kinematics.th2, _DOWN)
+            if n > 0:
+                tx = kinematics.x_ticks(last_x)
+                ty = kinematics.y_ticks(last_y)
+                dx = kinematics.x_ticks(x) - tx
+                dy = kinematics.y_ticks(y) - ty
+                for i in range(1, n + 1):
+                    # Rounded to the nearest tick
+                    kinematics.move_to_ticks(tx + (2*dx*i + n)//(2*n),
+                                             ty + (2*dy*i + n)//(2*n))
+                    yield (kinematics.th1, kinematics.th2, _DOWN)
+        last_x = x
+        last_y = y
+
+
+def classify(setpoints):
+    '''!
+    Adds the tolerance class of each set point to its pen state.
+    
+    Pen up set points are @c TOL_TRAVEL, except the last one before a
+    stroke, where the pen comes down. Pen down set points are @c TOL_DRAW,
+    except the ends of strokes and where a stroke turns by more than
+    @c CORNER_ANGLE. Those are @c TOL_CORNER. Repeated set points, such as
+    where one line of a stroke ends and the next starts, are left out so
+    they don't hide the turn.
+    
+    @param setpoints    A generator of set points (theta_1, theta_2, pen) as
+                        from @c Parser.setpoints().
+    @return A generator of set points (theta_1, theta_2, flags), where the
+            flags are the pen state in bit 0 and the tolerance class above.
+    '''
+    before = None
+    point = None
+    for after in setpoints:
+        if after == point:
+            continue
+        if point != None:
+            yield _classified(before, point, after)
+        before = point
+        point = after
+    if point != None:
+        yield _classified(before, point, None)
+
+
+def _classified(before, point, after):
+    '''!
+    Finds the flags of a set point from the set points around it.
+    
+    @param before   The set point before, or @c None.
+    @param point    The set point (theta_1, theta_2, pen).
+    @param after    The set point after, or @c None.
+    @return The set point (theta_1, theta_2, flags).
+    '''
+    th1, th2, pen = point
+    if pen == _UP:
+        corner = after != None and after[2] == _DOWN
+    elif after == None or after[2] == _UP or before == None:
+        corner = True
+    else:
+        # Compare the directions into and out of the set point. The turn is
+        # more than CORNER_ANGLE when the dot product is less than the
+        # cosine times both lengths, compared squared to stay in integers.
+        ax = th1 - before[0]
+        ay = th2 - before[1]
+        bx = after[0] - th1
+        by = after[1] - th2
+        dot = ax*bx + ay*by
+        lengths2 = (ax*ax + ay*ay) * (bx*bx + by*by)
+        corner = lengths2 > 0 and (dot <= 0 or (dot*dot << _CORNER_FRAC)
+                                   < _CORNER_COS2 * lengths2)
+    if corner:
+        tolerance = TOL_CORNER
+    elif pen == _UP:
+        tolerance = TOL_TRAVEL
+    else:
+        tolerance = TOL_DRAW
+    return (th1, th2, pen | tolerance << 1)
+
+
+def _hpgl_points(raw_hpgl):
+    '''!
+    Reads the pen coordinates of an hpgl file.
+    
+    Commands not relevant to the pen's position, such as initialize and pen
+    color, are ignored.
+    
+    @param raw_hpgl An hpgl file opened in binary mode.
+    @return A generator of points (pen, x, y) with the pen condition of the
+            move to each point (x, y) in plotter units.
+    '''
+    tokens = HPGLTokenizer(raw_hpgl)
+    # The pen condition of the current command, or None while the
+    # parameters of a non-relevant command are being skipped
+    pen = None
+    # Whether the x coordinate of a pair has been read
+    have_x = False
+    
+    while True:
+        token = tokens.next()
+        if token == TOKEN_EOF:
+            break
+        
+        elif token == TOKEN_COMMAND:
+            have_x = False
+            if tokens.command == _CMD_PU:
+                pen = _UP
+            elif tokens.command == _CMD_PD:
+                pen = _DOWN
+            elif tokens.command == _CMD_IN or tokens.command == _CMD_SP:
+                pen = None
+            # check for command value errors 
+            else:
+                print(chr(tokens.command >> 8) + chr(tokens.command & 0xFF))
+                raise ValueError("something other than PU/PD")
+        
+        # Coordinates come in pairs (x,y)
+        elif pen != None and not have_x:
+            x = tokens.value
+            have_x = True
+        
+        elif pen != None:
+            have_x = False
+            yield (pen, x, tokens.value)
+
+def read_strokes(hpgl_file):
+    '''!
+    Reads the lines drawn by an hpgl file.
+    
+    Each stroke is the list of points (x, y) in plotter units which are drawn
+    without lifting the pen, starting at the point where the pen is put
+    down. Pen up moves which don't lead to a stroke, such as the final move
+    to the origin, are dropped. The whole drawing is held in memory, so this
+    is meant for preparing drawings on a computer.
+    
+    @param hpgl_file the name of the hpgl file you want read.
+    @return A list of strokes.
+    '''
+    strokes = []
+    stroke = None
+    last = (0, 0)
+    with open(hpgl_file, 'rb') as raw_hpgl:
+        for pen, x, y in _hpgl_points(raw_hpgl):
+            if pen == _UP:
+                stroke = None
+            else:
+                if stroke == None:
+                    stroke = [last]
+                    strokes.append(stroke)
+                stroke.append((x, y))
+            last = (x, y)
+    return strokes
+
+def write_hpgl(strokes, hpgl_file):
+    '''!
+    Writes strokes to an hpgl file in the form Inkscape does.
+    
+    @param strokes      A list of strokes as from @c read_strokes().
+    @param hpgl_file    The name of the hpgl file to write.
+    '''
+    with open(hpgl_file, 'w') as raw_hpgl:
+        raw_hpgl.write('IN;PU;SP1;')
+        for stroke in strokes:
+            raw_hpgl.write('PU{:d},{:d};PD'.format(*stroke[0]))
+            raw_hpgl.write(','.join('{:d},{:d}'.format(x, y)
+                                    for x, y in stroke[1:]))
+            raw_hpgl.write(';')
+        raw_hpgl.write('SP0;PU0,0;IN; ')
+
+def simplify(stroke, tolerance):
+    '''!
+    Removes points from a stroke which the pen path doesn't need.
+    
+    Uses the Ramer-Douglas-Peucker algorithm, so no removed point is further
+    than the tolerance from the simplified stroke.
+    
+    @param stroke       A stroke as from @c read_strokes().
+    @param tolerance    How far (mm) the simplified stroke may stray from
+                        the original one.
+    @return The simplified stroke.
+    '''
+    xs = array.array('i', [x for x, y in stroke])
+    ys = array.array('i', [y for x, y in stroke])
+    keep = bytearray(len(stroke))
+    stack = array.array('H', range(2 * len(stroke)))
+    _rdp(xs, ys, len(stroke), tolerance * DPMM, keep, stack)
+    return [point for point, kept in zip(stroke, keep) if kept]
+
+def _simplified(points, tolerance):
+    '''!
+    Removes points from the strokes of an hpgl file which the pen path
+    doesn't need.
+    
+    The PD points of a stroke are collected in arrays allocated once and
+    simplified by @c _rdp() when the stroke ends, or in pieces of
+    @c SIMPLIFY_POINTS when the stroke is longer than that.
+    
+    @param points       A generator of points (pen, x, y) as from
+                        @c _hpgl_points().
+    @param tolerance    How far (mm) the pen may stray from the hpgl path.
+    @return A generator of the points (pen, x, y) which are kept.
+    '''
+    tol = tolerance * DPMM
+    xs = array.array('i', range(SIMPLIFY_POINTS))
+    ys = array.array('i', range(SIMPLIFY_POINTS))
+    keep = bytearray(SIMPLIFY_POINTS)
+    stack = array.array('H', range(2 * SIMPLIFY_POINTS))
+    # The first point of the stroke is where the pen already is
+    xs[0] = 0
+    ys[0] = 0
+    n = 1
+    
+    for pen, x, y in points:
+        if pen == _DOWN and n < SIMPLIFY_POINTS:
+            xs[n] = x
+            ys[n] = y
+            n += 1
+            continue
+        
+        # The stroke ended or the buffer is full, so send its points
+        _rdp(xs, ys, n, tol, keep, stack)
+        for i in range(1, n):
+            if keep[i]:
+                yield (_DOWN, xs[i], ys[i])
+        xs[0] = xs[n - 1]
+        ys[0] = ys[n - 1]
+        n = 1
+        
+        if pen == _DOWN:
+            xs[1] = x
+            ys[1] = y
+            n = 2
+        else:
+            yield (pen, x, y)
+            xs[0] = x
+            ys[0] = y
+    
+    _rdp(xs, ys, n, tol, keep, stack)
+    for i in range(1, n):
+        if keep[i]:
+            yield (_DOWN, xs[i], ys[i])
+
+def _rdp(xs, ys, n, tol, keep, stack):
+    '''!
+    Marks the points of a line which the Ramer-Douglas-Peucker algorithm
+    keeps.
+    
+    Each piece of the line is replaced by a straight line from its first to
+    its last point unless a point in between is further than the tolerance
+    from it, in which case the piece is split at the furthest point. The
+    distance is to the line segment, not the infinite line through its ends,
+    so points where the line doubles back on itself are kept. Pieces still
+    to be checked are kept on a stack instead of recursing.
+    
+    @param xs       An array of the x coordinates of the points.
+    @param ys       An array of the y coordinates of the points.
+    @param n        The number of points in the arrays to use.
+    @param tol      How far the simplified line may stray from the points.
+    @param keep     A bytearray set to 1 for points kept and 0 for others.
+    @param stack    An array of at least 2n unsigned shorts used as a stack.
+    '''
+    for i in range(n):
+        keep[i] = 0
+    if n == 0:
+        return
+    keep[0] = 1
+    keep[n - 1] = 1
+    stack[0] = 0
+    stack[1] = n - 1
+    top = 2
+    while top > 0:
+        top -= 2
+        first = stack[top]
+        last = stack[top + 1]
+        
+        # Distance from each point to the segment is |cross| / length where
+        # the point is alongside it, and to the nearer end elsewhere
+        dx = xs[last] - xs[first]
+        dy = ys[last] - ys[first]
+        length2 = dx * dx + dy * dy
+        length = math.sqrt(length2)
+        worst = 0
+        worst_i = 0
+        for i in range(first + 1, last):
+            px = xs[i] - xs[first]
+            py = ys[i] - ys[first]
+            dot = px * dx + py * dy
+            if dot <= 0:
+                dist = math.sqrt(px * px + py * py)
+            elif dot >= length2:
+                px = xs[i] - xs[last]
+                py = ys[i] - ys[last]
+                dist = math.sqrt(px * px + py * py)
+            else:
+                dist = abs(dx * py - dy * px) / length
+            if dist > worst:
+                worst = dist
+                worst_i = i
+        
+        if worst > tol:
+            keep[worst_i] = 1
+            stack[top] = first
+            stack[top + 1] = worst_i
+            stack[top + 2] = worst_i
+            stack[top + 3] = last
+            top += 4
+
+def remove_duplicates(strokes, tolerance=DUPLICATE_TOLERANCE):
+    '''!
+    Removes strokes which retrace an earlier stroke.
+    
+    Inkscape sometimes draws every line twice, which doubles the plot time
+    and doesn't give a clean darker line since the plotter doesn't exactly
+    repeat itself. A stroke repeats an earlier one when every point of each
+    stroke is within the tolerance of the other stroke, in the same or the
+    reversed direction. Strokes are looked up by their end points in a
+    dictionary, so only strokes which start and end in the same places are
+    compared.
+    
+    @param strokes      A list of strokes as from @c read_strokes().
+    @param tolerance    The distance within which a stroke repeats another
+                        (mm).
+    @return A tuple (strokes, repeats) of the list of strokes without
+            repeats and a list with the number of times each was drawn.
+    '''
+    tol = tolerance * DPMM
+    unique = []
+    repeats = []
+    # Indexes into unique by the cells of both end points
+    index = {}
+    for stroke in strokes:
+        match = None
+        for key in _end_keys(stroke, tol):
+            for i in index.get(key, ()):
+                if _retraces(unique[i], stroke, tol):
+                    match = i
+                    break
+            if match != None:
+                break
+        
+        if match != None:
+            repeats[match] += 1
+        else:
+            key = _end_key(stroke[0], stroke[-1], tol)
+            index.setdefault(key, []).append(len(unique))
+            unique.append(stroke)
+            repeats.append(1)
+    return (unique, repeats)
+
+def _end_key(start, end, tol):
+    '''!
+    Finds the dictionary key for a stroke's end points.
+    
+    The key is the same for a stroke and its reverse.
+    
+    @param start    The first point (x, y) of the stroke.
+    @param end      The last point (x, y) of the stroke.
+    @param tol      The size of the cells the points are sorted into.
+    @return The key.
+    '''
+    cell = max(tol, 1)
+    a = (int(start[0] // cell), int(start[1] // cell))
+    b = (int(end[0] // cell), int(end[1] // cell))
+    return (a, b) if a <= b else (b, a)
+
+def _end_keys(stroke, tol):
+    '''!
+    Finds the keys of every stroke whose end points are within the tolerance
+    of this stroke's end points.
+    
+    @param stroke   The stroke.
+    @param tol      The size of the cells the points are sorted into.
+    @return A generator of keys.
+    '''
+    cell = max(tol, 1)
+    for dx1 in (-cell, 0, cell):
+        for dy1 in (-cell, 0, cell):
+            for dx2 in (-cell, 0, cell):
+                for dy2 in (-cell, 0, cell):
+                    yield _end_key((stroke[0][0] + dx1, stroke[0][1] + dy1),
+                                   (stroke[-1][0] + dx2, stroke[-1][1] + dy2),
+                                   tol)
+
+def _retraces(a, b, tol):
+    '''!
+    Checks if two strokes follow the same path.
+    
+    @param a    The first stroke.
+    @param b    The second stroke.
+    @param tol  The distance within which the strokes must stay.
+    @return @c True if each stroke stays within the tolerance of the other.
+    '''
+    tol2 = tol * tol
+    if _follows(a, b, tol2) and _follows(b, a, tol2):
+        return True
+    # Closed strokes start and end at the same place, so try the reversed
+    # direction as well
+    b = b[::-1]
+    return _follows(a, b, tol2) and _follows(b, a, tol2)
+
+def _follows(a, b, tol2):
+    '''!
+    Checks if every point of stroke b is close to stroke a.
+    
+    The points of b are matched to the lines of a in order, so the check
+    takes one pass over the strokes.
+    
+    @param a    The stroke which is followed.
+    @param b    The stroke whose points are checked.
+    @param tol2 The square of the distance within which b must stay.
+    @return @c True if b stays within the tolerance of a.
+    '''
+    if len(a) == 1:
+        return all(_distance2(a[0], point) <= tol2 for point in b)
+    j = 0
+    for point in b:
+        while _segment_distance2(point, a[j], a[j + 1]) > tol2:
+            j += 1
+            if j >= len(a) - 1:
+                return False
+    return True
+
+def _distance2(a, b):
+    '''!
+    Calculates the square of the distance between two points.
+    
+    @param a The first point (x, y).
+    @param b The second point (x, y).
+    @return The square of the distance.
+    '''
+    return (a[0] - b[0])**2 + (a[1] - b[1])**2
+
+def _segment_distance2(point, a, b):
+    '''!
+    Calculates the square of the distance from a point to a line segment.
+    
+    @param point    The point (x, y).
+    @param a        The start (x, y) of the line segment.
+    @param b        The end (x, y) of the line segment.
+    @return The square of the distance.
+    '''
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return _distance2(point, a)
+    t = ((point[0] - a[0]) * dx + (point[1] - a[1]) * dy) / length2
+    t = min(max(t, 0), 1)
+    return (point[0] - a[0] - t * dx)**2 + (point[1] - a[1] - t * dy)**2
+
+def _deduplicated(points, tolerance):
+    '''!
+    Drops strokes of an hpgl file which repeat an earlier stroke.
+    
+    The PD points of each stroke are buffered in arrays allocated once until
+    the stroke ends, then checked by a @c StrokeIndex and sent on unless
+    they repeat an earlier stroke. Strokes longer than @c DEDUPE_POINTS are
+    sent on as they come without being checked.
+    
+    @param points       A generator of points (pen, x, y) as from
+                        @c _hpgl_points().
+    @param tolerance    The distance within which a stroke repeats another
+                        (mm).
+    @return A generator of the points (pen, x, y) of the strokes kept.
+    '''
+    index = StrokeIndex(tolerance)
+    xs = array.array('i', range(DEDUPE_POINTS))
+    ys = array.array('i', range(DEDUPE_POINTS))
+    # The first stroke starts where the pen already is
+    last_x = 0
+    last_y = 0
+    # Points of the stroke buffered, counting its first, and whether the
+    # stroke is too long to check
+    n = 0
+    passing = False
+    dropped = 0
+    
+    for pen, x, y in points:
+        if pen == _DOWN and passing:
+            yield (pen, x, y)
+        elif pen == _DOWN:
+            if n == 0:
+                xs[0] = last_x
+                ys[0] = last_y
+                n = 1
+            if n < DEDUPE_POINTS:
+                xs[n] = x
+                ys[n] = y
+                n += 1
+            else:
+                for i in range(1, n):
+                    yield (_DOWN, xs[i], ys[i])
+                yield (pen, x, y)
+                n = 0
+                passing = True
+        else:
+            if n > 0:
+                if _repeated(index, xs, ys, n):
+                    dropped += 1
+                else:
+                    for i in range(1, n):
+                        yield (_DOWN, xs[i], ys[i])
+                n = 0
+            passing = False
+            yield (pen, x, y)
+        last_x = x
+        last_y = y
+    
+    if n > 0:
+        if _repeated(index, xs, ys, n):
+            dropped += 1
+        else:
+            for i in range(1, n):
+                yield (_DOWN, xs[i], ys[i])
+    if dropped > 0:
+        print('{:d} repeated strokes dropped'.format(dropped))
+
+def _repeated(index, xs, ys, n):
+    '''!
+    Checks a buffered stroke against the strokes drawn before it.
+    
+    @param index    The @c StrokeIndex of the strokes drawn before.
+    @param xs       An array of the x coordinates of the stroke's points.
+    @param ys       An array of the y coordinates of the stroke's points.
+    @param n        The number of points in the arrays to use.
+    @return @c True if the stroke repeats an earlier one.
+    '''
+    sum_x = 0
+    sum_y = 0
+    for i in range(n):
+        sum_x += xs[i]
+        sum_y += ys[i]
+    return index.seen(xs[0], ys[0], xs[n - 1], ys[n - 1], n, sum_x, sum_y)
+
+def _plot_setpoints(raw_plot):
+    '''!
+    Reads the set points of a compiled plot file.
+    
+    The records are read in blocks into a buffer which is allocated once and
+    decoded in place. The geometry in the header must match this file's
+    constants, since the set points were computed from them.
+    
+    @param raw_plot A plot file opened in binary mode, just after the magic.
+    @return A generator of set points (theta_1, theta_2, pen) in ticks.
+    '''
+    header = raw_plot.read(struct.calcsize(PLOT_HEADER) - len(PLOT_MAGIC))
+    _, count, r, x_home, y_home, ticks_per_mm = \
+        struct.unpack(PLOT_HEADER, PLOT_MAGIC + header)
+    if r != float32(R) or x_home != float32(X_HOME) \
+        or y_home != float32(Y_HOME) or ticks_per_mm != TICKS_PER_MM:
+        raise ValueError("plot was compiled for a different geometry")
+    
+    buf = bytearray(PLOT_BLOCK * PLOT_RECORD_SIZE)
+    while count > 0:
+        n = raw_plot.readinto(buf) // PLOT_RECORD_SIZE
+        if n == 0:
+            raise ValueError("plot file is missing records")
+        for i in range(0, min(n, count) * PLOT_RECORD_SIZE, PLOT_RECORD_SIZE):
+            word = _int32(buf, i + 4)
+            yield (_int32(buf, i), word >> 1, word & 1)
+        count -= n
+
+def _int32(buf, i):
+    '''!
+    Decodes a little endian int32 from a buffer.
+    
+    @param buf  The buffer holding the integer.
+    @param i    The index of the first byte of the integer.
+    @return The integer.
+    '''
+    value = buf[i] | buf[i + 1] << 8 | buf[i + 2] << 16 | buf[i + 3] << 24
+    if buf[i + 3] & 0x80:
+        value -= 1 << 32
+    return value
+
+def float32(value):
+    '''!
+    Rounds a number to the nearest single precision float.
+    
+    @param value The number to round.
+    @return The rounded number.
+    '''
+    return struct.unpack('<f', struct.pack('<f', value))[0]
+
+def measure_heap(hpgl_file, chunk_size=READ_SIZE):
+    '''!
+    Measures the heap used while tokenizing an hpgl file.
+    
+    The garbage collector is disabled while the file is tokenized so that
+    every allocation stays counted; the tokenizer doesn't allocate, so the
+    result should be the same for any file. This needs MicroPython's
+    @c gc.mem_alloc().
+    
+    @param hpgl_file    The name of the hpgl file to tokenize.
+    @param chunk_size   The number of bytes to read from the file at a time.
+    @return A tuple (tokens, bytes) of the number of tokens in the file and
+            the number of heap bytes allocated while tokenizing them.
+    '''
+    with open(hpgl_file, 'rb') as raw_hpgl:
+        tokens = HPGLTokenizer(raw_hpgl, chunk_size)
+        count = 0
+        gc.collect()
+        gc.disable()
+        try:
+            start = gc.mem_alloc()
+            while tokens.next() != TOKEN_EOF:
+                count += 1
+            used = gc.mem_alloc() - start
+        finally:
+            gc.enable()
+    return (count, used)
+
+def compare_kinematics(hpgl_file):
+    '''!
+    Compares the set points of an hpgl file from @c FixedKinematics with
+    those from @c transform().
+    
+    @param hpgl_file The name of the hpgl file to compare.
+    @return A tuple (count, error) of the number of set points and the
+            largest difference in either motor angle (ticks).
+    '''
+    count = 0
+    error = 0
+    fixed = Parser(None, kinematics=FixedKinematics())
+    for a, b in zip(Parser(None).setpoints(hpgl_file),
+                    fixed.setpoints(hpgl_file)):
+        count += 1
+        error = max(error, abs(a[0] - b[0]), abs(a[1] - b[1]))
+    return (count, error)
+
 def transform(x, y):
     '''!
     This transform calculates the two motor angles on the board given some
@@ -210,6 +1583,9 @@ def linterp2(x1, y1, x2, y2):
     dy = y2 - y1
     dmax = max(abs(dx), abs(dy))
     n = math.ceil(dmax / MAX_LENGTH)
+    # A repeated point doesn't need to be split up
+    if n == 0:
+        return [(x1, y1)]
     points = []
     for i in range(n + 1):
         x = x1 + dx / n * i
@@ -219,14 +1595,134 @@ def linterp2(x1, y1, x2, y2):
     return points
 
 
+def inverse_transform(r_1, r_2):
+    '''!
+    Calculates the point within the drawing grid given the two belt lengths,
+    the inverse of @c transform().
+    
+    @param r_1 the distance from motor 1 (mm)
+    @param r_2 the distance from motor 2 (mm)
+    @return the point (x, y) in (mm)
+    '''
+    # Motor 2 is at the origin and motor 1 is R along the x axis, so
+    # r_2^2 - r_1^2 = 2*R*x - R^2
+    x = (r_2**2 - r_1**2 + R**2) / (2*R)
+    y = max(r_2**2 - x**2, 0)**0.5
+    
+    return (x - X_HOME, y - Y_HOME)
+
+
+def adaptive_linterp2(x1, y1, x2, y2, tolerance=INTERP_TOLERANCE):
+    '''!
+    This method divides a line into segments only where the pen would stray
+    from it.
+    
+    The motors move in a straight line in ticks from one set point to the
+    next, which is a curve on the page. Each piece of the line is halved until
+    that curve stays within @c tolerance of the line at its quarter points,
+    which bound it since short pieces bow like a parabola. Pieces are not
+    halved below @c tolerance long. Far fewer points are needed than with
+    @c linterp2() where the kinematics are nearly linear.
+    
+    @param x1 The starting x value of the line
+    @param y1 The starting y value of the line
+    @param x2 The ending x value of the line
+    @param y2 The ending y value of the line
+    @param tolerance How far (mm) the pen may stray from the line
+    @return the list of interpolated points (x,y) defining the smaller segments
+    '''
+    dx = x2 - x1
+    dy = y2 - y1
+    length = (dx**2 + dy**2)**0.5
+    # A repeated point doesn't need to be split up
+    if length == 0:
+        return [(x1, y1)]
+    
+    points = [(x1, y1)]
+    ra = _radii(x1, y1)
+    # The ends of the pieces still to check, as fractions of the line
+    stack = [1.0]
+    ta = 0.0
+    while stack:
+        tb = stack[-1]
+        x = x1 + dx*tb
+        y = y1 + dy*tb
+        rb = _radii(x, y)
+        if (tb - ta)*length > tolerance \
+            and _strays(x1, y1, dx, dy, ra, rb, tolerance*length):
+            stack.append((ta + tb) / 2)
+        else:
+            points.append((x, y))
+            ta = stack.pop()
+            ra = rb
+    
+    return points
+
+
+def _radii(x, y):
+    '''!
+    Calculates the distances from both motors to a point, as @c transform()
+    does before converting them to ticks.
+    
+    @param x the x coordinate (mm)
+    @param y the y coordinate (mm)
+    @return the distances (r_1, r_2) in (mm)
+    '''
+    return (((Y_HOME + y)**2 + (R - (X_HOME + x))**2)**0.5,
+            ((Y_HOME + y)**2 + (X_HOME + x)**2)**0.5)
+
+
+def _strays(x1, y1, dx, dy, ra, rb, limit):
+    '''!
+    Checks whether moving straight in ticks between two points on a line
+    strays too far from the line.
+    
+    @param x1       The starting x value of the line
+    @param y1       The starting y value of the line
+    @param dx       The change in x along the line
+    @param dy       The change in y along the line
+    @param ra       The distances (r_1, r_2) of the first point (mm)
+    @param rb       The distances (r_1, r_2) of the second point (mm)
+    @param limit    The largest distance allowed, times the line length
+    @return True if the quarter, half or three quarter point strays too far.
+    '''
+    for s in (0.25, 0.5, 0.75):
+        x, y = inverse_transform(ra[0] + (rb[0] - ra[0])*s,
+                                 ra[1] + (rb[1] - ra[1])*s)
+        if abs(dx*(y - y1) - dy*(x - x1)) > limit:
+            return True
+    return False
+
+
 # When run as main, this will parse the inputed HPGL file.
 if __name__ == '__main__':
     
     import task_share
     
-    _th1q = task_share.Queue('i', 1000)
-    _th2q = task_share.Queue('i', 1000)
-    _penq = task_share.Queue('i', 1000)
+    _queue = task_share.RecordQueue(1000, flag_bits=FLAG_BITS)
+    
+    # The heap used to tokenize each file should be the same for any size
+    for _file in ('test_area.hpgl', 'test_spiral.hpgl', 'WE_ARE_AWESOME.hpgl'):
+        print('{:s}: {:d} tokens, {:d} bytes allocated'.format(
+            _file, *measure_heap(_file)))
+    
+    # Time the float and the integer kinematics
+    import utime
+    for _file in ('test_area.hpgl', 'test_spiral.hpgl', 'WE_ARE_AWESOME.hpgl'):
+        _times = []
+        for _kinematics in (None, FixedKinematics()):
+            _start = utime.ticks_us()
+            for _setpoint in Parser(None,
+                                    kinematics=_kinematics).setpoints(_file):
+                pass
+            _times.append(utime.ticks_diff(utime.ticks_us(), _start))
+        print('{:s}: {:d} set points within {:d} ticks, float {:d} us, '
+              'fixed {:d} us'.format(_file, *(compare_kinematics(_file)
+                                              + tuple(_times))))
+    
+    _table = KinematicsTable()
+    print('kinematics table: {:d} bytes, within {:d} ticks'.format(
+        _table.size(), _table.worst_error(DPMM)))
     
-    _parser = Parser(_th1q, _th2q, _penq)
+    _parser = Parser(_queue)
     _parser.read('WE_ARE_AWESOME.hpgl')
\ No newline at end of file
@@ -318,6 +318,348 @@ class Queue (BaseShare):
                 type_code_strings[self._type_code], self._max_full, self._size))
 
 
+# ============================================================================
+
+class RecordQueue (Queue):
+    """!
+    A queue which transfers records of two integers and a few flag bits from
+    one task to another as single entries.
+
+    Each record takes two 32 bit words: the first integer, then the second
+    integer shifted left past the flags. That is 8 bytes rather than the 12
+    of three separate queues, so 1.5 times as many records fit in the same
+    memory. Putting or getting a record costs
+    one call and one critical section, and a record is never half written
+    when another task reads it. Records must be put and read with
+    @c put_record() and @c get_record() rather than @c put() and @c get().
+
+    @code
+    import task_share
+
+    # This queue holds set points (theta_1, theta_2, pen)
+    setpoints = task_share.RecordQueue (1000, name="Set Points")
+
+    # In the task making set points
+    setpoints.put_record (theta_1, theta_2, pen)
+
+    # In the task using them
+    if setpoints.any ():
+        theta_1, theta_2, pen = setpoints.get_record ()
+    @endcode
+    """
+
+    def __init__ (self, size, flag_bits = 1, thread_protect = True,
+                  name = None):
+        """!
+        Initialize a record queue by allocating two words for each record.
+
+        The second integer of each record must fit in 32 bits along with the
+        flags.
+
+        @param size The maximum number of records which the queue can hold
+        @param flag_bits The number of bits of flags in each record
+        @param thread_protect @c True if mutual exclusion protection is used
+        @param name A short name for the queue, default @c QueueN where @c N
+               is a serial number for the queue
+        """
+        super ().__init__ ('i', 2 * size, thread_protect, False, name)
+        self._size = size
+        self._flag_bits = flag_bits
+        self._flag_mask = (1 << flag_bits) - 1
+
+
+    @micropython.native
+    def put_record (self, first, second, flags = 0, in_ISR = False):
+        """!
+        Put a record into the queue.
+
+        If there isn't room for the record, wait (blocking the calling
+        process) until room becomes available, as @c Queue.put() does.
+        @param first The first integer of the record
+        @param second The second integer of the record
+        @param flags The flags of the record
+        @param in_ISR Set this to @c True if calling from within an ISR
+        """
+        if self.full ():
+            if in_ISR:
+                return
+            while self.full ():
+                pass
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            _irq_state = pyb.disable_irq ()
+
+        # Write the record and advance the counts and pointers
+        idx = 2 * self._wr_idx
+        self._buffer[idx] = first
+        self._buffer[idx + 1] = second << self._flag_bits | flags
+        self._wr_idx += 1
+        if self._wr_idx >= self._size:
+            self._wr_idx = 0
+        self._num_items += 1
+        if self._num_items > self._max_full:     # Record maximum fillage
+            self._max_full = self._num_items
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (_irq_state)
+
+
+    @micropython.native
+    def get_record (self, in_ISR = False):
+        """!
+        Read a record from the queue.
+
+        If there isn't anything in there, wait (blocking the calling process)
+        until something becomes available, as @c Queue.get() does.
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return A tuple (first, second, flags) holding the record
+        """
+        # Wait until there's something in the queue to be returned
+        while self.empty ():
+            pass
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        # Get the record to be returned from the queue
+        idx = 2 * self._rd_idx
+        first = self._buffer[idx]
+        word = self._buffer[idx + 1]
+
+        # Move the read pointer and adjust the number of items in the queue
+        self._rd_idx += 1
+        if self._rd_idx >= self._size:
+            self._rd_idx = 0
+        self._num_items -= 1
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        return (first, word >> self._flag_bits, word & self._flag_mask)
+
+
+    def __repr__ (self):
+        """!
+        This method puts diagnostic information about the queue into a string.
+
+        It shows the queue's name as well as the maximum number of records
+        and queue size.
+        """
+        return ('{:<12s} RecordQueue Max Full {:d}/{:d}'.format (self._name,
+                self._max_full, self._size))
+
+
+# ============================================================================
+
+class DeltaQueue (Queue):
+    """!
+    A queue which transfers records like a @c RecordQueue, storing most of
+    them as 16 bit changes from the record before.
+
+    A record whose flags match the one before and whose integers each
+    changed by less than 32768 takes two 16 bit words: the two changes. Any
+    other record is stored whole as a keyframe of five words: a marker, then
+    both 32 bit words of a @c RecordQueue record. A run of changes takes half
+    the memory it would in a @c RecordQueue, but each keyframe takes more.
+    The plotter's set points change flags at every pen move and tolerance
+    class, so the HPGL files in @c hpgl take 4.3 to 5.9 bytes per set point:
+    1.4 to 1.9 times as many set points as a @c RecordQueue holds in the same
+    memory, or 2 to 2.8 times as many as three queues. Records
+    are put and read with @c put_record() and @c get_record(), and the
+    reader gets the same records that were put.
+
+    @code
+    import task_share
+
+    # This queue holds set points (theta_1, theta_2, pen) in 8 kB
+    setpoints = task_share.DeltaQueue (2000, name="Set Points")
+    @endcode
+    """
+
+    ## The first word of a keyframe, which no change can be
+    KEYFRAME = -32768
+
+    ## The number of words in a keyframe
+    KEYFRAME_SIZE = 5
+
+    def __init__ (self, size, flag_bits = 1, thread_protect = True,
+                  name = None):
+        """!
+        Initialize a delta queue by allocating two 16 bit words for each
+        record which is stored as changes.
+
+        The second integer of each record must fit in 32 bits along with the
+        flags.
+
+        @param size The number of records stored as changes which the queue
+               can hold, at most 16384; fewer fit when records are stored as
+               keyframes
+        @param flag_bits The number of bits of flags in each record
+        @param thread_protect @c True if mutual exclusion protection is used
+        @param name A short name for the queue, default @c QueueN where @c N
+               is a serial number for the queue
+        """
+        super ().__init__ ('h', 2 * size, thread_protect, False, name)
+        self._flag_bits = flag_bits
+        self._flag_mask = (1 << flag_bits) - 1
+
+
+    @micropython.native
+    def put_record (self, first, second, flags = 0, in_ISR = False):
+        """!
+        Put a record into the queue.
+
+        If there may not be room for the record, wait (blocking the calling
+        process) until room becomes available, as @c Queue.put() does.
+        @param first The first integer of the record
+        @param second The second integer of the record
+        @param flags The flags of the record
+        @param in_ISR Set this to @c True if calling from within an ISR
+        """
+        if self.full ():
+            if in_ISR:
+                return
+            while self.full ():
+                pass
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            _irq_state = pyb.disable_irq ()
+
+        d_first = first - self._put_first
+        d_second = second - self._put_second
+        if flags == self._put_flags and -32768 < d_first < 32768 \
+                and -32768 <= d_second < 32768:
+            self._write (d_first)
+            self._write (d_second)
+            self._used += 2
+        else:
+            word = second << self._flag_bits | flags
+            self._write (DeltaQueue.KEYFRAME)
+            self._write (first >> 16)
+            self._write (((first & 0xFFFF) ^ 0x8000) - 0x8000)
+            self._write (word >> 16)
+            self._write (((word & 0xFFFF) ^ 0x8000) - 0x8000)
+            self._used += DeltaQueue.KEYFRAME_SIZE
+            self._put_flags = flags
+        self._put_first = first
+        self._put_second = second
+
+        self._num_items += 1
+        if self._num_items > self._max_full:     # Record maximum fillage
+            self._max_full = self._num_items
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (_irq_state)
+
+
+    @micropython.native
+    def get_record (self, in_ISR = False):
+        """!
+        Read a record from the queue.
+
+        If there isn't anything in there, wait (blocking the calling process)
+        until something becomes available, as @c Queue.get() does.
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return A tuple (first, second, flags) holding the record
+        """
+        # Wait until there's something in the queue to be returned
+        while self.empty ():
+            pass
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        change = self._read ()
+        if change == DeltaQueue.KEYFRAME:
+            self._get_first = self._read () << 16 | (self._read () & 0xFFFF)
+            word = self._read () << 16 | (self._read () & 0xFFFF)
+            self._get_second = word >> self._flag_bits
+            self._get_flags = word & self._flag_mask
+            self._used -= DeltaQueue.KEYFRAME_SIZE
+        else:
+            self._get_first += change
+            self._get_second += self._read ()
+            self._used -= 2
+        self._num_items -= 1
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        return (self._get_first, self._get_second, self._get_flags)
+
+
+    @micropython.native
+    def full (self):
+        """!
+        Check if the queue may be full.
+
+        This method returns @c True if there may not be room for another
+        record, which is when there isn't room for a keyframe.
+        @return @c True if the queue is full
+        """
+        return (self._size - self._used < DeltaQueue.KEYFRAME_SIZE)
+
+
+    def clear (self):
+        """!
+        Remove all contents from the queue.
+
+        The next record put is stored as a keyframe.
+        """
+        super ().clear ()
+        self._used = 0
+        self._put_first = 0
+        self._put_second = 0
+        self._put_flags = -1
+        self._get_first = 0
+        self._get_second = 0
+        self._get_flags = 0
+
+
+    @micropython.native
+    def _write (self, value):
+        """!
+        Write one word at the write pointer and advance it.
+        @param value The word to write
+        """
+        self._buffer[self._wr_idx] = value
+        self._wr_idx += 1
+        if self._wr_idx >= self._size:
+            self._wr_idx = 0
+
+
+    @micropython.native
+    def _read (self):
+        """!
+        Read one word at the read pointer and advance it.
+        @return The word read
+        """
+        value = self._buffer[self._rd_idx]
+        self._rd_idx += 1
+        if self._rd_idx >= self._size:
+            self._rd_idx = 0
+        return (value)
+
+
+    def __repr__ (self):
+        """!
+        This method puts diagnostic information about the queue into a string.
+
+        It shows the queue's name as well as the maximum number of records
+        and the queue size in words.
+        """
+        return ('{:<12s} DeltaQueue Max Full {:d} in {:d} words'.format (
+                self._name, self._max_full, self._size))
+
+
 # ============================================================================
 
 class Share (BaseShare):
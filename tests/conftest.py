@@ -0,0 +1,40 @@
+'''!@file conftest.py
+    Lets the tests import the plotter's modules on a computer.
+
+    The MicroPython modules @c pyb, @c utime, @c machine and @c micropython
+    are replaced in @c sys.modules with stand-ins that do just enough for the
+    host: interrupts can't be disabled, the clock is the computer's, and
+    @c micropython.native leaves functions as they are.
+'''
+
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# Ticks wrap like MicroPython's small ints
+_TICKS_PERIOD = 1 << 30
+
+
+def _ticks_diff(end, start):
+    diff = (end - start) % _TICKS_PERIOD
+    return diff - _TICKS_PERIOD if diff >= _TICKS_PERIOD // 2 else diff
+
+
+def _stub(name, **attributes):
+    if name not in sys.modules:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+_stub('micropython', native=lambda fun: fun, const=lambda value: value)
+_stub('pyb', disable_irq=lambda: 0, enable_irq=lambda state: None)
+_stub('machine', idle=lambda: None)
+_stub('utime',
+      ticks_us=lambda: int(time.perf_counter() * 1e6) % _TICKS_PERIOD,
+      ticks_ms=lambda: int(time.perf_counter() * 1e3) % _TICKS_PERIOD,
+      ticks_diff=_ticks_diff,
+      ticks_add=lambda ticks, delta: (ticks + delta) % _TICKS_PERIOD)
@@ -0,0 +1,120 @@
+'''!@file test_cotask.py
+    Host tests of the run time histograms and state traces in @c cotask.
+
+    Run with pytest from the repository root:
+    @code
+    python -m pytest tests
+    @endcode
+'''
+
+import array
+
+import cotask
+
+
+def _histogram(counts=()):
+    hist = array.array('H', [0] * cotask.HIST_BINS)
+    for index, count in counts:
+        hist[index] = count
+    return hist
+
+
+def test_count_buckets_times():
+    hist = _histogram()
+    cotask._count(hist, 0)
+    cotask._count(hist, cotask.HIST_BIN_US - 1)
+    cotask._count(hist, cotask.HIST_BIN_US)
+    cotask._count(hist, -5)
+    cotask._count(hist, cotask.HIST_BINS * cotask.HIST_BIN_US * 10)
+    assert hist[0] == 3
+    assert hist[1] == 1
+    assert hist[cotask.HIST_BINS - 1] == 1
+
+
+def test_count_halves_every_bucket_when_one_is_full():
+    hist = _histogram([(0, 65535), (1, 1001), (5, 40)])
+    cotask._count(hist, 0)
+    assert hist[0] == 65535 // 2 + 1
+    assert hist[1] == 500
+    assert hist[5] == 20
+    # A full bucket is only halved when it would overflow
+    hist = _histogram([(0, 65535), (2, 7)])
+    cotask._count(hist, 2 * cotask.HIST_BIN_US)
+    assert hist[0] == 65535
+    assert hist[2] == 8
+
+
+def test_count_keeps_percentiles_of_long_runs():
+    hist = _histogram()
+    for run in range(200000):
+        cotask._count(hist, 50 if run % 4 else 250)
+    assert max(hist) <= 65535
+    assert cotask._percentile(hist, 0.5, 250) == cotask.HIST_BIN_US
+    assert cotask._percentile(hist, 0.99, 250) == 250
+
+
+def test_percentile_of_empty_histogram_is_largest():
+    assert cotask._percentile(_histogram(), 0.5, 0) == 0
+    assert cotask._percentile(_histogram(), 0.99, 1234) == 1234
+
+
+def test_percentile_is_upper_edge_of_bucket():
+    hist = _histogram([(0, 50), (3, 49), (10, 1)])
+    assert cotask._percentile(hist, 0.5, 5000) == cotask.HIST_BIN_US
+    assert cotask._percentile(hist, 0.51, 5000) == 4 * cotask.HIST_BIN_US
+    assert cotask._percentile(hist, 0.99, 5000) == 4 * cotask.HIST_BIN_US
+    assert cotask._percentile(hist, 1.0, 5000) == 11 * cotask.HIST_BIN_US
+
+
+def test_percentile_is_bounded_by_largest():
+    hist = _histogram([(10, 5)])
+    assert cotask._percentile(hist, 0.5, 1020) == 1020
+    # The last bucket holds everything longer, so only the largest bounds it
+    hist = _histogram([(cotask.HIST_BINS - 1, 5)])
+    assert cotask._percentile(hist, 0.99, 90000) \
+        == cotask.HIST_BINS * cotask.HIST_BIN_US
+
+
+def _counting():
+    # A task which moves to a new state every run
+    state = 0
+    while True:
+        state += 1
+        yield state
+
+
+def _traced_task(transitions):
+    task = cotask.Task(_counting, trace=True)
+    for run in range(transitions):
+        task.go()
+        assert task.schedule()
+    return task
+
+
+def test_trace_snapshot_before_the_ring_fills():
+    task = _traced_task(10)
+    assert [item[1] for item in task.trace_snapshot()] == list(range(1, 11))
+
+
+def test_trace_snapshot_when_the_ring_is_just_full():
+    # The index has wrapped back to the oldest transition, which is kept
+    task = _traced_task(cotask.TRACE_SIZE)
+    assert task._tr_index == 0
+    assert task._tr_count == cotask.TRACE_SIZE
+    assert [item[1] for item in task.trace_snapshot()] \
+        == list(range(1, cotask.TRACE_SIZE + 1))
+
+
+def test_trace_snapshot_after_the_ring_wraps():
+    task = _traced_task(cotask.TRACE_SIZE + 5)
+    assert task._tr_count > cotask.TRACE_SIZE
+    assert [item[1] for item in task.trace_snapshot()] \
+        == list(range(6, cotask.TRACE_SIZE + 6))
+    assert 'older transitions overwritten' in task.get_trace()
+
+
+def test_trace_snapshot_of_untraced_task():
+    task = cotask.Task(_counting)
+    task.go()
+    task.schedule()
+    assert task.trace_snapshot() == []
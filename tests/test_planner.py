@@ -0,0 +1,113 @@
+'''!@file test_planner.py
+    Host tests of the junction speeds and speed profiles of
+    @c planner.Planner.
+'''
+
+import math
+
+import planner
+import task_parser
+import task_share
+
+
+def _planner(records=(), **options):
+    queue = task_share.DeltaQueue(64, flag_bits=task_parser.FLAG_BITS)
+    for th1, th2, tolerance in records:
+        queue.put_record(th1, th2, task_parser.PEN_UP | tolerance << 1)
+    return planner.Planner(queue, (0, 0), **options)
+
+
+def _profiled(length, v_entry=0.0, v_exit=0.0):
+    plan = _planner()
+    plan._length = length
+    plan._v_entry = v_entry
+    plan._v_exit = v_exit
+    plan._profile()
+    return plan
+
+
+def _duration(plan):
+    return plan._t_accel + plan._t_cruise + plan._t_decel
+
+
+def test_junction_speed_of_straight_and_reversed_moves():
+    plan = _planner()
+    assert plan._junction2(1.0, 0.0, 1.0, 0.0) == plan._speed**2
+    assert plan._junction2(1.0, 0.0, -1.0, 0.0) == 0.0
+    assert plan._junction2(0.0, 0.0, 1.0, 0.0) == 0.0
+
+
+def test_junction_speed_of_a_right_angle():
+    plan = _planner()
+    # The arc tangent to both moves, JUNCTION_DEVIATION from the corner
+    sin_half = math.sin(math.pi / 4)
+    expected = plan._accel * plan._deviation * sin_half / (1 - sin_half)
+    assert math.isclose(plan._junction2(1.0, 0.0, 0.0, 1.0), expected)
+
+
+def test_junction_speed_falls_as_the_turn_sharpens():
+    plan = _planner()
+    speeds = [plan._junction2(1.0, 0.0, math.cos(turn), math.sin(turn))
+              for turn in (0.1, 0.5, 1.0, 2.0, 3.0)]
+    assert speeds == sorted(speeds, reverse=True)
+
+
+def test_profile_of_a_long_move_cruises_at_full_speed():
+    plan = _profiled(20000.0)
+    a = plan._accel
+    assert plan._v_peak == plan._speed
+    assert math.isclose(plan._t_accel, plan._speed / a)
+    assert math.isclose(plan._t_decel, plan._speed / a)
+    assert plan._t_cruise > 0
+    assert math.isclose(plan._distance(_duration(plan)), 20000.0)
+
+
+def test_profile_of_a_short_move_is_a_triangle():
+    plan = _profiled(500.0, v_entry=1000.0)
+    assert plan._t_cruise == 0
+    assert plan._v_peak < plan._speed
+    # Speeding up and slowing down cover the move between them
+    assert math.isclose(plan._v_peak**2,
+                        plan._accel * 500.0 + (1000.0**2) / 2)
+    assert math.isclose(plan._distance(_duration(plan)), 500.0)
+
+
+def test_profile_distance_is_continuous_and_increasing():
+    plan = _profiled(20000.0, v_entry=2000.0, v_exit=3000.0)
+    times = [_duration(plan) * k / 200 for k in range(201)]
+    distances = [plan._distance(t) for t in times]
+    assert distances == sorted(distances)
+    for edge in (plan._t_accel, plan._t_accel + plan._t_cruise):
+        assert math.isclose(plan._distance(edge - 1e-9),
+                            plan._distance(edge + 1e-9), abs_tol=1e-3)
+
+
+def test_planner_holds_at_corners_and_stops_at_the_end():
+    records = [(5000, 0, task_parser.TOL_TRAVEL),
+               (10000, 0, task_parser.TOL_CORNER),
+               (10000, 5000, task_parser.TOL_TRAVEL)]
+    plan = _planner(records)
+    holds = []
+    for run in range(1000):
+        plan.advance(0.01)
+        if plan.hold() != None:
+            holds.append((plan.th1, plan.th2, plan.reached()))
+            plan.release()
+        if plan.idle():
+            break
+    assert holds == [(10000, 0, task_parser.TOL_CORNER)]
+    assert (plan.th1, plan.th2) == (10000, 5000)
+    assert plan.reached() == task_parser.TOL_TRAVEL
+    assert plan.planned > 0
+
+
+def test_planner_takes_corners_without_holding_when_told_to():
+    records = [(10000, 0, task_parser.TOL_CORNER),
+               (10000, 5000, task_parser.TOL_TRAVEL)]
+    plan = _planner(records, hold_corners=False)
+    for run in range(1000):
+        plan.advance(0.01)
+        assert plan.hold() == None
+        if plan.idle():
+            break
+    assert (plan.th1, plan.th2) == (10000, 5000)
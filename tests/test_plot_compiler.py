@@ -0,0 +1,77 @@
+'''!@file test_plot_compiler.py
+    Host tests that the NumPy compiler matches the parser.
+'''
+
+import random
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import plot_compiler
+import task_parser
+
+
+def _scalar(coords, pens, tolerance):
+    return list(task_parser._simplified(
+        zip(pens.tolist(), coords[0::2].tolist(), coords[1::2].tolist()),
+        tolerance))
+
+
+def _vector(coords, pens, tolerance):
+    kept_coords, kept_pens = plot_compiler._simplified_numpy(
+        [coords], [pens], tolerance)
+    return list(zip(kept_pens[0].tolist(), kept_coords[0][0::2].tolist(),
+                    kept_coords[0][1::2].tolist()))
+
+
+def test_simplified_numpy_keeps_the_parsers_points():
+    # Random walks with strokes longer than SIMPLIFY_POINTS, which the
+    # parser simplifies in pieces
+    rng = random.Random(1)
+    for trial in range(50):
+        n = rng.randint(0, 3 * task_parser.SIMPLIFY_POINTS)
+        pens = numpy.array([rng.random() < 0.9 for i in range(n)],
+                           dtype=numpy.int32)
+        coords = numpy.cumsum([rng.randint(-300, 300)
+                               for i in range(2 * n)]).astype(numpy.int64)
+        for tolerance in (0.05, 0.5):
+            assert _vector(coords, pens, tolerance) \
+                == _scalar(coords, pens, tolerance)
+
+
+def test_simplified_numpy_keeps_stroke_that_doubles_back():
+    coords = numpy.array([0, 0, 400, 0, 200, 0, 0, 0], dtype=numpy.int64)
+    pens = numpy.array([task_parser.PEN_UP, task_parser.PEN_DOWN,
+                        task_parser.PEN_DOWN, task_parser.PEN_UP],
+                       dtype=numpy.int32)
+    assert _vector(coords, pens, 0.1) == _scalar(coords, pens, 0.1)
+    assert len(_vector(coords, pens, 0.1)) == 4
+
+
+def test_deduplicated_numpy_drops_the_parsers_strokes():
+    # Strokes of a few points, some repeated forwards or backwards
+    rng = random.Random(2)
+    for trial in range(30):
+        points = []
+        strokes = []
+        for k in range(rng.randint(0, 12)):
+            if strokes and rng.random() < 0.4:
+                stroke = rng.choice(strokes)
+                if rng.random() < 0.5:
+                    stroke = stroke[::-1]
+            else:
+                stroke = [(rng.randint(0, 2000), rng.randint(0, 2000))
+                          for i in range(rng.randint(2, 6))]
+                strokes.append(stroke)
+            points.append((task_parser.PEN_UP,) + stroke[0])
+            points.extend((task_parser.PEN_DOWN,) + point
+                          for point in stroke[1:])
+        pens = numpy.array([point[0] for point in points], dtype=numpy.int32)
+        coords = numpy.array([point[1:] for point in points],
+                             dtype=numpy.int64).ravel()
+        expected = list(task_parser._deduplicated(iter(points), 0.1))
+        kept_coords, kept_pens = plot_compiler._deduplicated_numpy(
+            coords, pens, 0.1)
+        assert list(zip(kept_pens.tolist(), kept_coords[0::2].tolist(),
+                        kept_coords[1::2].tolist())) == expected
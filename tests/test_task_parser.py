@@ -0,0 +1,143 @@
+'''!@file test_task_parser.py
+    Host tests of the tokenizer, kinematics, stroke simplification and
+    deduplication and set point classification in @c task_parser.
+
+    Run with pytest from the repository root:
+    @code
+    python -m pytest tests
+    @endcode
+'''
+
+import io
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import task_parser
+
+
+def test_simplify_keeps_stroke_that_doubles_back():
+    # 10 mm out and 5 mm back along the same line
+    stroke = [(0, 0), (400, 0), (200, 0)]
+    assert task_parser.simplify(stroke, 0.1) == stroke
+
+
+def test_simplify_drops_points_along_the_line():
+    stroke = [(0, 0), (100, 0), (200, 1), (400, 0)]
+    assert task_parser.simplify(stroke, 0.1) == [(0, 0), (400, 0)]
+
+
+def test_simplified_keeps_stroke_that_doubles_back():
+    points = [(task_parser.PEN_UP, 0, 0), (task_parser.PEN_DOWN, 400, 0),
+              (task_parser.PEN_DOWN, 200, 0), (task_parser.PEN_UP, 0, 0)]
+    assert list(task_parser._simplified(iter(points), 0.1)) == points
+
+
+def _parse(tmp_path, hpgl, dedupe):
+    hpgl_file = tmp_path / 'drawing.hpgl'
+    hpgl_file.write_bytes(hpgl)
+    parser = task_parser.Parser(None, dedupe=dedupe)
+    return list(parser.setpoints(str(hpgl_file)))
+
+
+def test_parser_drops_strokes_drawn_twice(tmp_path):
+    once = b'IN;SP1;PU400,400;PD800,400,800,800;PU0,0;'
+    twice = b'IN;SP1;PU400,400;PD800,400,800,800;' \
+        b'PU400,400;PD800,400,800,800;PU800,800;PD800,401,401,400;PU0,0;'
+    expected = _parse(tmp_path, once, None)
+    result = _parse(tmp_path, twice, 0.1)
+    # The repeats leave only their pen up moves
+    assert [point for point in result if point[2] == task_parser.PEN_DOWN] \
+        == [point for point in expected if point[2] == task_parser.PEN_DOWN]
+    assert len(_parse(tmp_path, twice, None)) > len(result)
+
+
+def test_parser_keeps_different_strokes_between_the_same_ends(tmp_path):
+    hpgl = b'PU400,400;PD800,400,800,800;PU400,400;PD400,800,800,800;PU0,0;'
+    assert _parse(tmp_path, hpgl, 0.1) == _parse(tmp_path, hpgl, None)
+
+
+def test_stroke_index_matches_within_tolerance():
+    index = task_parser.StrokeIndex(0.1)
+    assert not index.seen(0, 0, 100, 0, 3, 150, 0)
+    assert index.seen(2, 1, 100, -2, 3, 152, -1)
+    assert index.seen(100, 0, 0, 0, 3, 150, 0)
+    assert not index.seen(0, 0, 100, 0, 4, 150, 0)
+    assert not index.seen(0, 0, 100, 0, 3, 150, 40)
+
+
+def _turn_class(degrees, length=1000):
+    turn = math.radians(degrees)
+    after = (round(length * math.cos(turn)), round(length * math.sin(turn)),
+             task_parser.PEN_DOWN)
+    flags = task_parser._classified((-length, 0, task_parser.PEN_DOWN),
+                                    (0, 0, task_parser.PEN_DOWN), after)[2]
+    return flags >> 1
+
+
+def test_classified_corners_turn_more_than_corner_angle():
+    angle = task_parser.CORNER_ANGLE
+    for degrees in (0, angle - 1, -(angle - 1)):
+        assert _turn_class(degrees) == task_parser.TOL_DRAW
+    for degrees in (angle + 1, -(angle + 1), 90, 179):
+        assert _turn_class(degrees) == task_parser.TOL_CORNER
+    # Long moves square past a small int without changing the answer
+    assert _turn_class(angle - 1, 100000) == task_parser.TOL_DRAW
+    assert _turn_class(angle + 1, 100000) == task_parser.TOL_CORNER
+
+
+def _tokens(hpgl, chunk_size=task_parser.READ_SIZE):
+    tokens = task_parser.HPGLTokenizer(io.BytesIO(hpgl), chunk_size)
+    found = []
+    while True:
+        token = tokens.next()
+        if token == task_parser.TOKEN_EOF:
+            return found
+        if token == task_parser.TOKEN_COMMAND:
+            found.append(bytes([tokens.command >> 8, tokens.command & 0xFF]))
+        else:
+            found.append(tokens.value)
+
+
+def test_tokenizer_splits_mnemonics_and_numbers():
+    hpgl = b'IN;SP1;PU-40,+1200;pd 10.75,20\n,-3.5;PU;'
+    expected = [b'IN', b'SP', 1, b'PU', -40, 1200, b'PD', 10, 20, -3, b'PU']
+    assert _tokens(hpgl) == expected
+
+
+def test_tokenizer_continues_tokens_across_chunks():
+    hpgl = b'IN;SP1;PU12345,-6789;PD100,200,300,400;PU0,0;' * 3
+    expected = _tokens(hpgl)
+    for chunk_size in (1, 2, 3, 5, 7):
+        assert _tokens(hpgl, chunk_size) == expected
+
+
+def test_tokenizer_ends_on_a_number_or_an_empty_file():
+    assert _tokens(b'PD12') == [b'PD', 12]
+    assert _tokens(b'') == []
+    assert _tokens(b';;\n') == []
+
+
+def test_fixed_kinematics_matches_transform():
+    kinematics = task_parser.FixedKinematics()
+    points = [(0, 0), (4064, 0), (4064, 6096), (0, 6096), (2032, 3048),
+              (17, -29), (4000, 6000), (1, 1), (3999, 11)]
+    for x, y in points:
+        kinematics.move_to(x, y)
+        th1, th2 = task_parser.transform(x / task_parser.DPMM,
+                                         y / task_parser.DPMM)
+        assert abs(kinematics.th1 - th1) <= 1
+        assert abs(kinematics.th2 - th2) <= 1
+
+
+def test_fixed_kinematics_lengths_are_integer_square_roots():
+    kinematics = task_parser.FixedKinematics(100, 200)
+    r = task_parser.R * task_parser.TICKS_PER_MM
+    for x, y in ((100, 200), (4064, 6096), (-300, 50), (2000, 2000)):
+        kinematics.move_to(x, y)
+        tx = kinematics.x_ticks(x)
+        ty = kinematics.y_ticks(y)
+        assert kinematics.th1 == math.isqrt((r - tx)**2 + ty**2)
+        assert kinematics.th2 == math.isqrt(tx**2 + ty**2)
@@ -0,0 +1,72 @@
+'''!@file test_task_share.py
+    Host tests of the set point encoding of @c task_share.DeltaQueue.
+'''
+
+import task_share
+
+
+def _round_trip(queue, records):
+    for record in records:
+        queue.put_record(*record)
+    return [queue.get_record() for record in records]
+
+
+def test_changes_and_keyframes_round_trip():
+    queue = task_share.DeltaQueue(64, flag_bits=3)
+    records = [(1000, -2000, 1), (1010, -1990, 1), (990, -2010, 1),
+               (990, -2010, 5), (985, -2000, 5), (-100000, 170000, 5),
+               (-99000, 169000, 0)]
+    assert _round_trip(queue, records) == records
+    assert not queue.any()
+
+
+def test_large_jumps_are_keyframes():
+    queue = task_share.DeltaQueue(64)
+    queue.put_record(0, 0, 1)
+    assert queue._used == task_share.DeltaQueue.KEYFRAME_SIZE
+    queue.put_record(32767, -32768, 1)
+    assert queue._used == task_share.DeltaQueue.KEYFRAME_SIZE + 2
+    queue.put_record(0, 1, 1)
+    queue.put_record(0, 32769, 1)
+    assert queue._used == 3 * task_share.DeltaQueue.KEYFRAME_SIZE + 2
+    assert [queue.get_record() for i in range(4)] == [
+        (0, 0, 1), (32767, -32768, 1), (0, 1, 1), (0, 32769, 1)]
+
+
+def test_full_leaves_room_for_a_keyframe():
+    # Four records are eight words: a keyframe leaves room for one change,
+    # but not for another keyframe
+    queue = task_share.DeltaQueue(4)
+    assert not queue.full()
+    queue.put_record(5, 5)
+    assert queue.full()
+    queue.get_record()
+    assert not queue.full()
+
+
+def test_round_trip_wraps_around_the_buffer():
+    queue = task_share.DeltaQueue(8, flag_bits=2)
+    expected = []
+    got = []
+    for i in range(200):
+        record = (i * 7919 % 50000 - 25000, -i * 97, i // 3 % 4)
+        expected.append(record)
+        while queue.full():
+            got.append(queue.get_record())
+        queue.put_record(*record)
+    while queue.any():
+        got.append(queue.get_record())
+    assert got == expected
+
+
+def test_clear_starts_again_with_a_keyframe():
+    queue = task_share.DeltaQueue(16)
+    queue.put_record(100, 200, 1)
+    queue.put_record(110, 210, 1)
+    queue.get_record()
+    queue.clear()
+    assert not queue.any()
+    assert queue._used == 0
+    queue.put_record(110, 210, 1)
+    assert queue._used == task_share.DeltaQueue.KEYFRAME_SIZE
+    assert queue.get_record() == (110, 210, 1)